@@ -0,0 +1,243 @@
+"""
+Control de admisión y planificación de runs delante de las llamadas a OpenAI.
+
+Limita los runs en curso por proceso y por assistant_id. Cuando no hay
+capacidad, el request espera en una cola corta y acotada; si la cola está
+llena o la espera vence, se rechaza de inmediato con 503 + Retry-After en
+lugar de acumular backlog en gunicorn.
+
+Los requests tienen una prioridad ("interactive" para leads de Messenger,
+"batch" para replays y herramientas internas). La cola se atiende con weighted
+fair queuing sobre flujos (prioridad, tenant): cada espera recibe una etiqueta
+de finalización virtual y el próximo slot libre va a la etiqueta más baja.
+Además, batch nunca puede ocupar más de BATCH_MAX_INFLIGHT slots, así que
+siempre queda capacidad para tráfico interactivo aunque haya un replay largo.
+"""
+import itertools
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import metrics
+from idempotency import MAX_WAITERS as IDEMPOTENCY_MAX_WAITERS
+
+MAX_INFLIGHT = int(os.getenv("ADMISSION_MAX_INFLIGHT", 4))
+MAX_INFLIGHT_PER_ASSISTANT = int(os.getenv("ADMISSION_MAX_PER_ASSISTANT", 4))
+MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", 8))
+QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 5))
+RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", 10))
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+PRIORITIES = (INTERACTIVE, BATCH)
+
+PRIORITY_WEIGHTS = {
+    INTERACTIVE: float(os.getenv("ADMISSION_WEIGHT_INTERACTIVE", 8)),
+    BATCH: float(os.getenv("ADMISSION_WEIGHT_BATCH", 1)),
+}
+BATCH_MAX_INFLIGHT = int(os.getenv("ADMISSION_BATCH_MAX_INFLIGHT", max(MAX_INFLIGHT // 2, 1)))
+# Batch tolera esperas largas; su cola es aparte para no desplazar a los leads
+BATCH_MAX_QUEUE = int(os.getenv("ADMISSION_BATCH_MAX_QUEUE", 64))
+BATCH_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_BATCH_QUEUE_TIMEOUT", 60))
+# Hilos extra para lo que no pasa por admisión (health checks, webhook)
+SPARE_THREADS = 4
+
+
+def required_threads():
+    """
+    Threads a gthread worker needs so every request reaches the controller.
+
+    Con menos hilos que slots + colas, los requests de más esperan en la cola
+    sin límite del worker y nunca reciben el 503 + Retry-After. Los duplicados
+    que esperan al request original (idempotencia) también ocupan un hilo
+    antes de llegar a la admisión.
+    """
+    return (MAX_INFLIGHT + MAX_QUEUE + BATCH_MAX_QUEUE + IDEMPOTENCY_MAX_WAITERS
+            + SPARE_THREADS)
+
+
+def normalize_priority(value):
+    """Map a user-supplied priority to a known class (default interactive)."""
+    value = (value or "").strip().lower()
+    return value if value in PRIORITIES else INTERACTIVE
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted."""
+
+    def __init__(self, reason, retry_after=RETRY_AFTER):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ("assistant_id", "limit", "priority", "tag", "seq", "granted")
+
+    def __init__(self, assistant_id, limit, priority, tag, seq):
+        self.assistant_id = assistant_id
+        self.limit = limit
+        self.priority = priority
+        self.tag = tag
+        self.seq = seq
+        self.granted = False
+
+
+class AdmissionController:
+    """Bounded in-flight limits with a weighted-fair, bounded wait queue."""
+
+    def __init__(self, max_inflight=MAX_INFLIGHT,
+                 max_per_assistant=MAX_INFLIGHT_PER_ASSISTANT,
+                 max_queue=MAX_QUEUE, queue_timeout=QUEUE_TIMEOUT,
+                 batch_max_inflight=BATCH_MAX_INFLIGHT,
+                 batch_max_queue=BATCH_MAX_QUEUE,
+                 batch_queue_timeout=BATCH_QUEUE_TIMEOUT,
+                 weights=None):
+        self.max_inflight = max_inflight
+        self.max_per_assistant = max_per_assistant
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.batch_max_inflight = min(batch_max_inflight, max_inflight)
+        self.batch_max_queue = batch_max_queue
+        self.batch_queue_timeout = batch_queue_timeout
+        self.weights = weights or PRIORITY_WEIGHTS
+        self._cond = threading.Condition()
+        self._inflight = 0
+        self._per_assistant = defaultdict(int)
+        self._per_priority = defaultdict(int)
+        self._waiters = []
+        self._virtual_time = 0.0
+        self._flow_finish = {}  # (priority, assistant_id) -> última etiqueta
+        self._seq = itertools.count()
+
+    def _has_capacity(self, assistant_id, limit, priority):
+        if priority == BATCH and self._per_priority[BATCH] >= self.batch_max_inflight:
+            return False
+        return (self._inflight < self.max_inflight
+                and self._per_assistant[assistant_id] < limit)
+
+    def _take(self, assistant_id, priority):
+        self._inflight += 1
+        self._per_assistant[assistant_id] += 1
+        self._per_priority[priority] += 1
+
+    def _queue_depth(self, priority):
+        return sum(1 for w in self._waiters if w.priority == priority)
+
+    def _tag(self, assistant_id, priority):
+        # Etiqueta WFQ: cada flujo avanza 1/peso por request encolado
+        flow = (priority, assistant_id)
+        start = max(self._virtual_time, self._flow_finish.get(flow, 0.0))
+        finish = start + 1.0 / self.weights.get(priority, 1.0)
+        self._flow_finish[flow] = finish
+        return finish
+
+    def _dispatch(self):
+        """Grant free slots to eligible waiters, lowest finish tag first."""
+        granted = False
+        for waiter in sorted(self._waiters, key=lambda w: (w.tag, w.seq)):
+            if self._has_capacity(waiter.assistant_id, waiter.limit, waiter.priority):
+                waiter.granted = True
+                self._waiters.remove(waiter)
+                self._take(waiter.assistant_id, waiter.priority)
+                self._virtual_time = max(self._virtual_time, waiter.tag)
+                granted = True
+        if granted:
+            self._prune_flows()
+            self._cond.notify_all()
+
+    def _prune_flows(self):
+        # Un flujo sin esperas y ya alcanzado por el tiempo virtual no aporta
+        # nada a la próxima etiqueta: sin esto el dict crece con cada assistant_id
+        if not self._waiters:
+            self._flow_finish.clear()
+            return
+        waiting = {(w.priority, w.assistant_id) for w in self._waiters}
+        for flow in [f for f, finish in self._flow_finish.items()
+                     if finish <= self._virtual_time and f not in waiting]:
+            del self._flow_finish[flow]
+
+    def acquire(self, assistant_id, limit=None, priority=INTERACTIVE, timeout=None):
+        """
+        Take a slot or raise AdmissionRejected; limit overrides the per-assistant
+        cap and timeout (the request's remaining deadline) shortens the queue wait.
+        """
+        limit = limit or self.max_per_assistant
+        priority = normalize_priority(priority)
+        is_batch = priority == BATCH
+        max_queue = self.batch_max_queue if is_batch else self.max_queue
+        queue_timeout = self.batch_queue_timeout if is_batch else self.queue_timeout
+        # Esperar más de lo que le queda al request es trabajo perdido
+        reason = "queue_timeout"
+        if timeout is not None and timeout < queue_timeout:
+            queue_timeout, reason = max(timeout, 0), "deadline"
+
+        with self._cond:
+            # Sin nadie esperando en su prioridad y con capacidad: pasa directo
+            if (not self._queue_depth(priority)
+                    and self._has_capacity(assistant_id, limit, priority)):
+                self._take(assistant_id, priority)
+                metrics.incr("admission.admitted")
+                metrics.incr(f"admission.admitted.{priority}")
+                return
+
+            if self._queue_depth(priority) >= max_queue:
+                metrics.incr("admission.shed.queue_full")
+                metrics.incr(f"admission.shed.{priority}")
+                raise AdmissionRejected("queue_full")
+
+            waiter = _Waiter(assistant_id, limit, priority,
+                             self._tag(assistant_id, priority), next(self._seq))
+            self._waiters.append(waiter)
+            self._dispatch()
+            deadline = time.monotonic() + queue_timeout
+            while not waiter.granted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._waiters.remove(waiter)
+                    self._prune_flows()
+                    metrics.incr(f"admission.shed.{reason}")
+                    metrics.incr(f"admission.shed.{priority}")
+                    raise AdmissionRejected(reason)
+                self._cond.wait(remaining)
+            metrics.incr("admission.queued")
+            metrics.incr("admission.admitted")
+            metrics.incr(f"admission.admitted.{priority}")
+
+    def release(self, assistant_id, priority=INTERACTIVE):
+        """Return a slot and hand it to the next waiter."""
+        priority = normalize_priority(priority)
+        with self._cond:
+            self._inflight -= 1
+            self._per_assistant[assistant_id] -= 1
+            if not self._per_assistant[assistant_id]:
+                del self._per_assistant[assistant_id]
+            self._per_priority[priority] -= 1
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, assistant_id, limit=None, priority=INTERACTIVE, timeout=None):
+        """Context manager around acquire/release."""
+        self.acquire(assistant_id, limit, priority, timeout)
+        try:
+            yield
+        finally:
+            self.release(assistant_id, priority)
+
+    def stats(self):
+        """Current usage, for /health."""
+        with self._cond:
+            return {
+                "inflight": self._inflight,
+                "max_inflight": self.max_inflight,
+                "queue_depth": len(self._waiters),
+                "max_queue": self.max_queue,
+                "inflight_per_assistant": dict(self._per_assistant),
+                "inflight_per_priority": {p: self._per_priority[p] for p in PRIORITIES},
+                "queue_depth_per_priority": {p: self._queue_depth(p) for p in PRIORITIES},
+                "shed": metrics.get("admission.shed.queue_full")
+                        + metrics.get("admission.shed.queue_timeout")
+                        + metrics.get("admission.shed.deadline"),
+            }
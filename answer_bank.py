@@ -0,0 +1,471 @@
+"""
+Banco de respuestas precalculadas por listing.
+
+La mayoría de las preguntas sobre un lot concreto son previsibles: precio,
+cuartos/baños, disponibilidad por tipo de estado y depósito. Cada una dispara
+un run que vuelve a recuperar el mismo documento del listing. Este módulo:
+
+- Construye offline (build) una respuesta canónica por (listing, intención) a
+  partir de los campos "Campo: valor" de los documentos que se suben al vector
+  store (los mismos nombres de campo que usa el prompt: "lot property id",
+  "current status for rent", "rent price"...). Las respuestas citan los
+  valores tal como están escritos; si falta un dato, esa intención no entra al
+  banco y la pregunta sigue yendo al asistente.
+- Guarda el banco en un archivo binario compacto (índice ordenado por hash +
+  textos UTF-8) que los workers leen con mmap: sin cargar nada en memoria por
+  proceso y sin deserializar al arrancar.
+- Resuelve en /chat el lot o post_id y la intención del mensaje y, si ambos
+  están en el banco, responde al instante. Si la pregunta nombra un tipo de
+  estado ("available for sale?", "how much to rent?"), precio y disponibilidad
+  se responden solo para ese tipo; si el listing no tiene ese estado, no hay
+  respuesta y la pregunta va al asistente.
+
+La clave es (vector store, "post:<post_id>" o "lot:<número>", intención), así
+cada parque tiene su propio espacio de lots. sync_vector_store.py regenera el
+banco cuando cambian los documentos; los workers detectan el archivo nuevo
+solos. Solo se leen documentos de texto (.md, .txt, .html, .csv, .json).
+"""
+import argparse
+import hashlib
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+
+import metrics
+from vector_store_config import LISTINGS_DIR, VECTOR_STORE_ID
+
+ANSWER_BANK_ENABLED = os.getenv("ANSWER_BANK_ENABLED", "false").lower() == "true"
+ANSWER_BANK_PATH = os.getenv("ANSWER_BANK_PATH", "answer_bank.bin")
+# Cada cuánto un worker revisa si el archivo fue regenerado
+RELOAD_INTERVAL = float(os.getenv("ANSWER_BANK_RELOAD_SECONDS", 5))
+
+MAGIC = b"ANSBANK1"
+_HEADER = struct.Struct("<8sI")
+_ENTRY = struct.Struct("<QII")  # hash de la clave, offset, largo
+
+TEXT_EXTENSIONS = {".md", ".txt", ".html", ".csv", ".json"}
+
+PRICE = "price"
+BEDS_BATHS = "beds_baths"
+AVAILABILITY = "availability"
+DEPOSIT = "deposit"
+INTENTS = (PRICE, BEDS_BATHS, AVAILABILITY, DEPOSIT)
+
+INTENT_KEYWORDS = {
+    PRICE: ("price", "prices", "cost", "asking"),
+    BEDS_BATHS: ("bedroom", "bedrooms", "bathroom", "bathrooms", "beds", "baths",
+                 "how many rooms"),
+    AVAILABILITY: ("available", "availability", "still for rent", "still for sale"),
+    DEPOSIT: ("deposit", "security deposit"),
+}
+# "how much" solo es precio si no se pregunta por otra cosa ("how much is the deposit")
+_WEAK_PRICE = ("how much",)
+# Tipo de estado nombrado en la pregunta; "rent to own" se busca antes que "rent"
+STATUS_KEYWORDS = (
+    ("rent_to_own", ("rent to own", "renttoown", "rto")),
+    ("contract_for_deed", ("contract for deed", "cfd", "owner financing", "owner finance")),
+    ("sale", ("for sale", "sale", "buy", "buying", "purchase")),
+    ("rent", ("for rent", "rent", "rental", "renting", "lease")),
+)
+# Intenciones que se responden por tipo de estado ("availability_sale")
+KIND_INTENTS = (PRICE, AVAILABILITY)
+# Temas que el banco no cubre: la pregunta va al asistente completo
+_OTHER_TOPICS = ("lot rent", "pet", "pets", "dog", "dogs", "utilities", "application",
+                 "apply", "rules", "section 8", "fence", "photo", "photos", "picture",
+                 "pictures", "address", "where", "credit", "income", "schedule", "showing")
+MAX_QUERY_WORDS = 15
+
+_POST_ID = re.compile(r'\b(\d+_\d+)\b')
+_LOT = re.compile(r'\blot (?:number |no |num )?(\d+)\b')
+
+# Campo del documento -> atributo del listing
+FIELD_ALIASES = {
+    "lot": "lot", "lot name": "lot", "lot address": "lot",
+    "lot property id": "post_id", "post id": "post_id", "post_id": "post_id",
+    "bedrooms": "bedrooms", "bedroom": "bedrooms", "beds": "bedrooms",
+    "bathrooms": "bathrooms", "bathroom": "bathrooms", "baths": "bathrooms",
+    "current status for rent": "status_rent",
+    "current status for rent to own": "status_rent_to_own",
+    "current status for contract for deed": "status_contract_for_deed",
+    "current status for sale": "status_sale",
+    "rent price": "price_rent", "home rent": "price_rent",
+    "price for the rent to own": "price_rent_to_own", "rent to own price": "price_rent_to_own",
+    "price for a contract for deed": "price_contract_for_deed",
+    "contract for deed price": "price_contract_for_deed",
+    "price for sale": "price_sale", "sale price": "price_sale",
+    "mobile home price": "price_home",
+    "deposit": "deposit", "security deposit": "deposit",
+}
+
+# (tipo de estado, frase con precio, frase sin precio)
+STATUS_PHRASES = (
+    ("rent", "for rent at {}", "for rent"),
+    ("rent_to_own", "rent to own for {}", "rent to own"),
+    ("contract_for_deed", "contract for deed at {}", "contract for deed"),
+    ("sale", "for sale at {}", "for sale"),
+)
+
+
+# ---------------------------------------------------------------------- #
+# Construcción
+# ---------------------------------------------------------------------- #
+
+def _field_name(raw):
+    return re.sub(r'\s+', ' ', re.sub(r'[^\w\s]', ' ', raw.lower())).strip()
+
+
+def parse_listings(text):
+    """Split a document into listings: dicts of the recognized fields."""
+    listings, current = [], {}
+    for line in text.splitlines():
+        line = re.sub(r'^[\s\-*#>]+', '', line).replace('**', '')
+        if ':' not in line:
+            continue
+        raw_key, value = line.split(':', 1)
+        attribute = FIELD_ALIASES.get(_field_name(raw_key))
+        value = value.strip().strip('*').strip()
+        if attribute is None or not value:
+            continue
+        # Un segundo lot o post_id en el mismo documento empieza otro listing
+        if attribute in ("lot", "post_id") and attribute in current:
+            listings.append(current)
+            current = {}
+        current.setdefault(attribute, value)
+    if current:
+        listings.append(current)
+    return [listing for listing in listings if "lot" in listing or "post_id" in listing]
+
+
+def _available(status):
+    status = (status or "").lower()
+    return "available" in status and "not" not in status and "unavailable" not in status
+
+
+def _join(parts):
+    return parts[0] if len(parts) == 1 else ", ".join(parts[:-1]) + " and " + parts[-1]
+
+
+def _rent(price):
+    return price if "/" in price or "month" in price.lower() else f"{price}/month"
+
+
+def build_answers(listing):
+    """Canonical answer per intent; intents without data are left out."""
+    name = listing.get("lot") or "This home"
+    answers = {}
+
+    if listing.get("bedrooms") and listing.get("bathrooms"):
+        answers[BEDS_BATHS] = (f"This is a {listing['bedrooms']} bedroom, "
+                               f"{listing['bathrooms']} bathroom home at {name}.")
+
+    known_statuses = [kind for kind, _, _ in STATUS_PHRASES if f"status_{kind}" in listing]
+    options, priced = [], []
+    for kind, with_price, without_price in STATUS_PHRASES:
+        if not _available(listing.get(f"status_{kind}")):
+            continue
+        price = listing.get(f"price_{kind}")
+        if price:
+            phrase = with_price.format(_rent(price) if kind == "rent" else price)
+            priced.append(phrase)
+            options.append(phrase)
+        else:
+            options.append(without_price)
+
+    if options:
+        answers[AVAILABILITY] = (f"Yes, {name} is available {_join(options)}. "
+                                 "Would you like to schedule a showing?")
+    elif known_statuses:
+        answers[AVAILABILITY] = (f"{name} is not available at the moment. "
+                                 "Would you like me to help you find a similar home?")
+
+    if priced:
+        answers[PRICE] = f"{name} is available {_join(priced)}."
+    elif listing.get("price_home") and options:
+        answers[PRICE] = f"The price for {name} is {listing['price_home']}."
+
+    answers.update(_kind_answers(listing, name, options))
+
+    if listing.get("deposit"):
+        answers[DEPOSIT] = f"The security deposit for {name} is {listing['deposit']}."
+    return answers
+
+
+def _kind_answers(listing, name, options):
+    # Solo para los tipos de estado que el documento declara: si falta el
+    # campo, "available for sale?" no tiene respuesta canónica
+    answers = {}
+    for kind, with_price, without_price in STATUS_PHRASES:
+        if f"status_{kind}" not in listing:
+            continue
+        price = listing.get(f"price_{kind}")
+        if _available(listing[f"status_{kind}"]):
+            phrase = with_price.format(_rent(price) if kind == "rent" else price) if price else without_price
+            answers[_kind_intent(AVAILABILITY, kind)] = (f"Yes, {name} is available {phrase}. "
+                                                          "Would you like to schedule a showing?")
+            if price:
+                answers[_kind_intent(PRICE, kind)] = f"{name} is available {phrase}."
+            continue
+        # options solo trae los tipos disponibles: ofrecerlos como alternativa
+        answer = f"{name} is not available {without_price} at the moment."
+        if options:
+            answer += f" It is available {_join(options)}. Would that work for you?"
+        else:
+            answer += " Would you like me to help you find a similar home?"
+        answers[_kind_intent(AVAILABILITY, kind)] = answer
+    return answers
+
+
+def _kind_intent(intent, kind):
+    return f"{intent}_{kind}"
+
+
+def listing_refs(listing):
+    """Lookup references of a listing: its post_id and its lot number."""
+    refs = []
+    if listing.get("post_id"):
+        refs.append(f"post:{listing['post_id'].strip()}")
+    number = re.search(r'\d+', listing.get("lot", ""))
+    if number:
+        refs.append(f"lot:{number.group()}")
+    return refs
+
+
+def _key(scope, ref, intent):
+    return f"{scope}|{ref}|{intent}"
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def write_bank(path, entries):
+    """Write {key: answer} as the mmap-friendly binary format, atomically."""
+    records = sorted(((_hash(k), k.encode("utf-8") + b"\0" + a.encode("utf-8"))
+                      for k, a in entries.items()), key=lambda r: r[0])
+    offset = _HEADER.size + _ENTRY.size * len(records)
+    index, blob = [], []
+    for key_hash, record in records:
+        index.append(_ENTRY.pack(key_hash, offset, len(record)))
+        blob.append(record)
+        offset += len(record)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, len(records)))
+        f.write(b"".join(index))
+        f.write(b"".join(blob))
+    os.replace(tmp, path)
+
+
+def read_bank(path):
+    """Every {key: answer} in a bank file (empty if it does not exist)."""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return {}
+    magic, count = _HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError(f"{path} no es un banco de respuestas")
+    entries = {}
+    for i in range(count):
+        _, offset, length = _ENTRY.unpack_from(data, _HEADER.size + i * _ENTRY.size)
+        key, answer = data[offset:offset + length].split(b"\0", 1)
+        entries[key.decode("utf-8")] = answer.decode("utf-8")
+    return entries
+
+
+def build(docs_dir, scope=VECTOR_STORE_ID, path=ANSWER_BANK_PATH):
+    """
+    Rebuild the entries of one vector store from its documents, keeping the
+    other vector stores' entries. Returns a summary dict.
+    """
+    # Import perezoso: solo la construcción offline necesita el script de sync
+    import sync_vector_store
+
+    start = time.time()
+    listings = []
+    for relative in sync_vector_store.scan(docs_dir):
+        if os.path.splitext(relative)[1].lower() not in TEXT_EXTENSIONS:
+            continue
+        with open(os.path.join(docs_dir, relative), encoding="utf-8", errors="ignore") as f:
+            listings.extend(parse_listings(f.read()))
+
+    entries = {k: v for k, v in read_bank(path).items() if not k.startswith(f"{scope}|")}
+    owners, ambiguous = {}, set()
+    for number, listing in enumerate(listings):
+        for ref in listing_refs(listing):
+            if owners.setdefault(ref, number) != number:
+                ambiguous.add(ref)
+    for number, listing in enumerate(listings):
+        answers = build_answers(listing)
+        for ref in listing_refs(listing):
+            # Un número de lot repetido en dos documentos no identifica un listing
+            if ref in ambiguous:
+                continue
+            for intent, answer in answers.items():
+                entries[_key(scope, ref, intent)] = answer
+
+    write_bank(path, entries)
+    return {
+        "listings": len(listings),
+        "entries": sum(1 for k in entries if k.startswith(f"{scope}|")),
+        "ambiguous_refs": sorted(ambiguous),
+        "elapsed_s": round(time.time() - start, 2),
+    }
+
+
+# ---------------------------------------------------------------------- #
+# Consulta
+# ---------------------------------------------------------------------- #
+
+def status_kind(normalized_query):
+    """Status kind the query asks about ("sale", "rent"...), or None if zero or several."""
+    padded = f" {normalized_query} "
+    kinds = []
+    for kind, keywords in STATUS_KEYWORDS:
+        for keyword in keywords:
+            if f" {keyword} " in padded:
+                kinds.append(kind)
+                # "rent to own" no debe contar también como "rent"
+                padded = padded.replace(f" {keyword} ", " ")
+                break
+    return kinds[0] if len(kinds) == 1 else None
+
+
+def parse_question(normalized_query):
+    """
+    Return (ref, intents) for a query about one listing, or (None, []).
+
+    Price and availability become per-kind intents ("availability_sale")
+    when the query names one status kind.
+    """
+    if not normalized_query or len(normalized_query.split()) > MAX_QUERY_WORDS:
+        return None, []
+    refs = {f"post:{m}" for m in _POST_ID.findall(normalized_query)}
+    refs |= {f"lot:{m}" for m in _LOT.findall(normalized_query)}
+    if len(refs) != 1:
+        return None, []
+    padded = f" {normalized_query} "
+    if any(f" {topic} " in padded for topic in _OTHER_TOPICS):
+        return refs.pop(), []
+    intents = [intent for intent in INTENTS
+               if any(f" {keyword} " in padded for keyword in INTENT_KEYWORDS[intent])]
+    if not intents and any(f" {keyword} " in padded for keyword in _WEAK_PRICE):
+        intents = [PRICE]
+    kind = status_kind(normalized_query)
+    if kind is not None:
+        intents = [_kind_intent(intent, kind) if intent in KIND_INTENTS else intent
+                   for intent in intents]
+    return refs.pop(), intents
+
+
+class AnswerBank:
+    """Read-only mmap view of the bank file, reopened when it is regenerated."""
+
+    def __init__(self, path=ANSWER_BANK_PATH, reload_interval=RELOAD_INTERVAL):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._map = None
+        self._count = 0
+        self._identity = None
+        self._checked_at = 0.0
+        self._loaded_at = None
+
+    def _refresh(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_interval:
+            return
+        with self._lock:
+            if now - self._checked_at < self.reload_interval:
+                return
+            self._checked_at = now
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                self._map, self._count, self._identity = None, 0, None
+                return
+            identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if identity == self._identity:
+                return
+            with open(self.path, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, count = _HEADER.unpack_from(mapped, 0)
+            if magic != MAGIC:
+                mapped.close()
+                metrics.incr("answer_bank.invalid_file")
+                return
+            # El mapa anterior se libera cuando ningún lookup lo usa
+            self._map, self._count, self._identity = mapped, count, identity
+            self._loaded_at = time.time()
+            metrics.incr("answer_bank.loaded")
+
+    def get(self, scope, ref, intent):
+        """Answer for (scope, ref, intent), or None."""
+        self._refresh()
+        mapped, count = self._map, self._count
+        if mapped is None:
+            return None
+        key_text = _key(scope, ref, intent)
+        key, key_hash = key_text.encode("utf-8"), _hash(key_text)
+        # Búsqueda binaria sobre el índice ordenado por hash
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            if _ENTRY.unpack_from(mapped, _HEADER.size + middle * _ENTRY.size)[0] < key_hash:
+                low = middle + 1
+            else:
+                high = middle
+        while low < count:
+            entry_hash, offset, length = _ENTRY.unpack_from(mapped, _HEADER.size + low * _ENTRY.size)
+            if entry_hash != key_hash:
+                break
+            record = mapped[offset:offset + length]
+            if record.startswith(key + b"\0"):
+                return record[len(key) + 1:].decode("utf-8")
+            low += 1
+        return None
+
+    def answer(self, scope, normalized_query):
+        """Combined canonical answer when the query names one listing and known intents."""
+        ref, intents = parse_question(normalized_query)
+        if ref is None or not intents:
+            return None
+        answers = [self.get(scope, ref, intent) for intent in intents]
+        if any(answer is None for answer in answers):
+            metrics.incr("answer_bank.miss")
+            return None
+        metrics.incr("answer_bank.hit")
+        # Precio y disponibilidad pueden repetir la misma frase
+        return " ".join(dict.fromkeys(answers))
+
+    def stats(self):
+        self._refresh()
+        return {
+            "enabled": ANSWER_BANK_ENABLED,
+            "path": self.path,
+            "entries": self._count,
+            "loaded_at": self._loaded_at,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generar el banco de respuestas por listing")
+    parser.add_argument("--docs", default=LISTINGS_DIR, help="Directorio con los documentos de listings")
+    parser.add_argument("--vector-store-id", default=VECTOR_STORE_ID)
+    parser.add_argument("--output", default=ANSWER_BANK_PATH)
+    args = parser.parse_args()
+
+    summary = build(args.docs, args.vector_store_id, args.output)
+    print(f"📚 Listings: {summary['listings']}")
+    print(f"💬 Respuestas: {summary['entries']}")
+    if summary["ambiguous_refs"]:
+        print(f"⚠️  Lots repetidos, se omiten: {summary['ambiguous_refs']}")
+    print(f"✅ Banco guardado en {args.output} ({summary['elapsed_s']} s)")
+
+
+if __name__ == "__main__":
+    main()
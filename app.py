@@ -1,8 +1,34 @@
-from flask import Flask, request, jsonify
-from openai import OpenAI
-import re
 import time
+
+_IMPORT_STARTED = time.perf_counter()
+
+from flask import Blueprint, Flask, current_app, g, has_request_context, request, jsonify
+from functools import wraps
 import os
+import uuid
+
+import json_backend
+import messenger
+import metrics
+import run_control
+import tracing
+from admission import AdmissionController, AdmissionRejected, BATCH, INTERACTIVE, normalize_priority
+from answer_bank import ANSWER_BANK_ENABLED, AnswerBank
+from circuit_breaker import (BREAKER_ENABLED, CLOSED as BREAKER_CLOSED, DEGRADED_THREAD_TIMEOUT,
+                             FALLBACK_REPLY, OPEN_SECONDS as BREAKER_OPEN_SECONDS,
+                             SLOW_MS as BREAKER_SLOW_MS, CircuitBreaker, local_answer)
+from deadline import DEADLINE_HEADER, Deadline
+from health import UpstreamHealth
+from idempotency import DERIVED_KEY_TTL, IdempotencyStore, derive_key
+from output_guard import PHOTO_RESPONSE, photo_requested
+from pipeline import ConversationPipeline, TurnError
+from routing import ModelRouter
+from retrieval import RetrievalInspector, RETRIEVAL_INSPECTION_ENABLED
+from tenants import TenantRegistry
+from semantic_cache import SemanticCache, SEMANTIC_CACHE_ENABLED
+from traffic import TrafficRecorder
+from transcripts import TranscriptStore
+from vector_store_config import VECTOR_STORE_ID
 
 # Cargar variables de entorno solo si existe el archivo .env (desarrollo local)
 try:
@@ -15,33 +41,498 @@ except:
 # Configuración
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
-# Verificar que la API key esté configurada
-if not OPENAI_API_KEY:
-    raise ValueError("Por favor configura tu OPENAI_API_KEY como variable de entorno")
+# El cliente de OpenAI se crea al primer uso y una vez por proceso: uno creado
+# en el master de gunicorn (--preload) compartiría sus sockets con los workers
+client = None
+_client_pid = None
+
+
+def get_client():
+    """Return this process' OpenAI client, creating it on first use."""
+    global client, _client_pid
+    if client is None or _client_pid != os.getpid():
+        # Verificar que la API key esté configurada
+        if not OPENAI_API_KEY:
+            raise ValueError("Por favor configura tu OPENAI_API_KEY como variable de entorno")
+        # Import perezoso: el SDK es la dependencia más lenta de importar
+        from openai import OpenAI
+        # Sin reintentos del SDK: repiten el timeout completo y pasan el deadline;
+        # pipeline.call_upstream reintenta dentro del presupuesto
+        client = OpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+        _client_pid = os.getpid()
+    return client
+
+
+api = Blueprint('api', __name__)
+
+# Tiempos de arranque, expuestos en /health
+STARTUP = {}
+
+idempotency_store = IdempotencyStore()
+admission = AdmissionController()
+upstream_health = UpstreamHealth(get_client)
+circuit_breaker = CircuitBreaker()
+transcripts = TranscriptStore()
+semantic_cache = SemanticCache()
+answer_bank = AnswerBank()
+retrieval_inspector = RetrievalInspector(get_client)
+model_router = ModelRouter(last_reply=lambda thread_id: _last_reply(thread_id))
+traffic_recorder = TrafficRecorder()
+tenant_registry = TenantRegistry()
+
+
+@tenant_registry.on_change
+def _invalidate_tenant_caches(tenant):
+    """Si cambia la configuración de un parque, sus respuestas cacheadas ya no valen."""
+    semantic_cache.invalidate(tenant.assistant_id)
+
+# Clave opcional para endpoints administrativos
+API_KEY = os.getenv('API_KEY')
+
+# API keys de tráfico batch (replays, herramientas internas), separadas por comas
+BATCH_API_KEYS = {k.strip() for k in os.getenv('BATCH_API_KEYS', '').split(',') if k.strip()}
+
+# Tiempo máximo que un duplicado espera al request original
+IDEMPOTENCY_WAIT = int(os.getenv("IDEMPOTENCY_WAIT", 70))
+
+
+def _abort_reason():
+    """Return why the current request should stop waiting, or None."""
+    # Los turnos de Messenger corren fuera de un request: solo cuenta el apagado
+    if has_request_context() and run_control.client_disconnected(request.environ):
+        return "disconnect"
+    if run_control.shutting_down():
+        return "shutdown"
+    return None
+
+
+# Pipeline compartido por /chat y /chat/continue
+pipeline = ConversationPipeline(get_client, abort_check=_abort_reason)
+
+
+def _resolve_tenant(_pipeline, turn):
+    """Validar el assistant_id contra el registro sin llamar a OpenAI."""
+    if not tenant_registry.is_known(turn.assistant_id):
+        raise TurnError(400, {
+            "error": "El 'assistant_id' no corresponde a ningún parque configurado"
+        })
+    turn.tenant = tenant_registry.get(turn.assistant_id)
+
+
+def _photo_request(_pipeline, turn):
+    """Los pedidos de fotos se responden con "A" sin pagar un run."""
+    if not photo_requested(turn.user_message):
+        return None
+    turn.source = "photo"
+    if turn.continuing:
+        # Con el breaker cerrado se agrega al thread; si no, queda pendiente
+        upstream_ok = not BREAKER_ENABLED or circuit_breaker.state == BREAKER_CLOSED
+        return _append_exchange(_pipeline, turn, PHOTO_RESPONSE, call_upstream=upstream_ok)
+    return _create_answered_thread(_pipeline, turn, PHOTO_RESPONSE)
+
+
+def _record_tenant_metrics(_pipeline, turn):
+    tenant = turn.tenant.name if turn.tenant is not None else "default"
+    metrics.incr(f"tenant.{tenant}.turns")
+    metrics.incr(f"tenant.{tenant}.source.{turn.source}")
+
+
+def _last_reply(thread_id):
+    """Última respuesta del asistente en un thread según el almacén local."""
+    turns = transcripts.history(thread_id=thread_id, limit=1)
+    return turns[0]["response"] if turns else None
+
+
+def _route_model(_pipeline, turn):
+    """Mandar saludos, cierres y datos de contacto a la configuración rápida."""
+    model_router.route(turn)
+
+
+def _record_routing(_pipeline, turn):
+    model_router.record(turn)
+
+
+pipeline.add_hook("pre_route", _resolve_tenant)
+pipeline.add_hook("pre_route", _photo_request)
+pipeline.add_hook("pre_route", _route_model)
+pipeline.add_hook("metrics", _record_tenant_metrics)
+pipeline.add_hook("metrics", _record_routing)
+
+
+def _circuit_breaker(_pipeline, turn):
+    """Con OpenAI caído o lento, responder al instante sin llamar upstream."""
+    if not BREAKER_ENABLED:
+        return None
+    allowed, probe = circuit_breaker.allow()
+    if allowed:
+        turn.extras["breaker_probe"] = probe
+        return None
+    answer = local_answer(turn.tenant.facts if turn.tenant else None, turn.normalized_query)
+    turn.source = "fact" if answer else "fallback"
+    answer = answer or FALLBACK_REPLY
+    if has_request_context():
+        # Respuesta degradada: un reintento con la misma clave debe volver a intentar
+        g.degraded_reply = True
+    if turn.continuing:
+        # OpenAI está marcado como caído: el intercambio se agrega al thread
+        # antes del próximo run (_sync_unsynced_messages)
+        return _append_exchange(_pipeline, turn, answer, call_upstream=False)
+    # /chat siempre devuelve un thread_id; si OpenAI tampoco deja crear el
+    # thread, mejor 503 + Retry-After que un thread_id nulo. Un solo intento
+    # corto: el upstream está marcado como caído y no puede gastar el deadline
+    try:
+        return _create_answered_thread(_pipeline, turn, answer,
+                                       timeout_cap=DEGRADED_THREAD_TIMEOUT, max_retries=0)
+    except TurnError:
+        raise
+    except Exception:
+        metrics.incr("breaker.thread_create_failed")
+        raise TurnError(503, {
+            "error": "Servicio degradado, intenta de nuevo más tarde",
+            "details": "thread_create_failed",
+            "status": "error",
+            "retry_after": int(BREAKER_OPEN_SECONDS),
+        })
+
+
+pipeline.add_hook("pre_route", _circuit_breaker)
+
+
+def _sync_unsynced_messages(_pipeline, turn):
+    """Antes de un run, agregar al thread los intercambios que quedaron pendientes."""
+    if not turn.continuing:
+        return None
+    messages = transcripts.take_unsynced(turn.thread_id)
+    for index, (role, content) in enumerate(messages):
+        try:
+            _pipeline.call_upstream(turn, _pipeline.client.beta.threads.messages.create,
+                                    thread_id=turn.thread_id, role=role, content=content)
+        except Exception:
+            transcripts.add_unsynced(turn.thread_id, messages[index:])
+            raise
+    if messages:
+        metrics.incr("threads.unsynced_replayed", len(messages))
+    return None
+
+
+pipeline.add_hook("pre_route", _sync_unsynced_messages)
+
+
+@pipeline.on_error
+def _record_upstream_failure(_pipeline, turn, error):
+    """Fallas de OpenAI cuentan para la readiness; cancelaciones (503) no."""
+    status_code = getattr(error, 'status_code', 500)
+    if status_code == 503:
+        return
+    probe = turn.extras.get("breaker_probe", False) if turn is not None else False
+    # Solo cuenta si el turno llegó a llamar a OpenAI: un JSON inválido o un
+    # error local no deben sacar al worker de rotación
+    if turn is None or "submit" not in turn.timings:
+        if probe:
+            circuit_breaker.cancel_probe()
+        return
+    upstream_ms = _pipeline.upstream_ms(turn)
+    # Un 408 por un presupuesto corto del cliente (X-Request-Timeout) no dice
+    # nada de OpenAI: solo cuenta si upstream fue lento según el breaker
+    if status_code == 408 and upstream_ms <= BREAKER_SLOW_MS:
+        metrics.incr("deadline.exceeded.client_budget")
+        if probe:
+            circuit_breaker.cancel_probe()
+        return
+    upstream_health.record(False)
+    circuit_breaker.record(False, upstream_ms, probe=probe)
+
+
+def _record_upstream_success(_pipeline, turn):
+    """Un run completado cuenta como llamada exitosa a OpenAI."""
+    probe = turn.extras.get("breaker_probe", False)
+    if turn.run is not None:
+        upstream_health.record(True)
+        circuit_breaker.record(True, _pipeline.upstream_ms(turn), probe=probe)
+    elif probe:
+        circuit_breaker.cancel_probe()
+
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+pipeline.add_hook("metrics", _record_upstream_success)
 
-app = Flask(__name__)
 
-# Función para normalizar consultas
-def clean_query(text):
-    """Normalize the user query before sending it to the assistant."""
-    return re.sub(r'[^\w\s]', '', text.lower()).strip()
+def _usage_dict(run):
+    usage = getattr(run, 'usage', None) if run is not None else None
+    if usage is None:
+        return None
+    return {
+        "prompt_tokens": getattr(usage, 'prompt_tokens', None),
+        "completion_tokens": getattr(usage, 'completion_tokens', None),
+        "total_tokens": getattr(usage, 'total_tokens', None),
+    }
 
 
-# Función para limpiar la respuesta del asistente
-def clean_assistant_response(text):
-    """Clean the assistant response by removing asterisks and document references."""
-    # Eliminar referencias a documentos en formato 【...†source】 o 【...】
-    text = re.sub(r'【[^】]*】', '', text)
-    # Eliminar todos los asteriscos
-    text = text.replace('*', '')
-    # Limpiar espacios múltiples que puedan quedar
-    text = re.sub(r'\s+', ' ', text)
-    return text.strip()
+def _record_transcript(_pipeline, turn):
+    """Encolar el turno en el almacén local (la escritura es asíncrona)."""
+    transcripts.append({
+        "thread_id": turn.result_thread_id,
+        "lead_id": turn.data.get('lead_id'),
+        "assistant_id": turn.assistant_id,
+        "run_id": turn.run.id if turn.run is not None else None,
+        "user_message": turn.user_message,
+        "normalized_query": turn.normalized_query,
+        "response": turn.response,
+        "source": turn.source,
+        "timings": {stage: round(t * 1000, 2) for stage, t in turn.timings.items()},
+        "usage": _usage_dict(turn.run),
+    })
 
 
-@app.route('/chat', methods=['POST'])
+pipeline.add_hook("metrics", _record_transcript)
+
+
+def _create_answered_thread(_pipeline, turn, answer, **call_options):
+    # Crear el thread con el intercambio para que /chat/continue siga teniendo contexto
+    thread = _pipeline.call_upstream(turn, _pipeline.client.beta.threads.create, messages=[
+        {"role": "user", "content": turn.user_message},
+        {"role": "assistant", "content": answer},
+    ], **call_options)
+    turn.created_thread_id = thread.id
+    return answer
+
+
+def _append_exchange(_pipeline, turn, answer, call_upstream=True):
+    """
+    Agregar al thread existente un intercambio respondido sin run, para que el
+    próximo run lo vea. Si OpenAI no está disponible, queda pendiente en el
+    almacén local y se agrega antes del próximo run del thread.
+    """
+    messages = [("user", turn.user_message), ("assistant", answer)]
+    if call_upstream:
+        # Los pendientes anteriores van primero para conservar el orden
+        messages = transcripts.take_unsynced(turn.thread_id) + messages
+        while messages:
+            role, content = messages[0]
+            try:
+                _pipeline.call_upstream(turn, _pipeline.client.beta.threads.messages.create,
+                                        thread_id=turn.thread_id, role=role, content=content,
+                                        timeout_cap=DEGRADED_THREAD_TIMEOUT, max_retries=0)
+            except Exception:
+                metrics.incr("threads.append_failed")
+                break
+            messages.pop(0)
+    if messages:
+        transcripts.add_unsynced(turn.thread_id, messages)
+    return answer
+
+
+def _answer_bank_lookup(_pipeline, turn):
+    """Responder precio, cuartos, disponibilidad o depósito de un lot sin run."""
+    if not ANSWER_BANK_ENABLED or turn.continuing:
+        return None
+    vector_store_id = turn.tenant.vector_store_id if turn.tenant else None
+    answer = answer_bank.answer(vector_store_id or VECTOR_STORE_ID, turn.normalized_query)
+    if answer is None:
+        return None
+    turn.source = "answer_bank"
+    return _create_answered_thread(_pipeline, turn, answer)
+
+
+def _semantic_cache_lookup(_pipeline, turn):
+    """Servir preguntas de primer turno ya respondidas con otra redacción."""
+    if not SEMANTIC_CACHE_ENABLED or turn.continuing:
+        return None
+    # El vector se guarda para store(): un solo embedding por turno
+    vector = turn.extras["query_vector"] = semantic_cache.embed(turn.normalized_query)
+    if vector is None:
+        return None
+    answer = semantic_cache.lookup(turn.assistant_id, turn.normalized_query, vector)
+    if answer is None:
+        return None
+    return _create_answered_thread(_pipeline, turn, answer)
+
+
+def _semantic_cache_store(_pipeline, turn):
+    if SEMANTIC_CACHE_ENABLED and not turn.continuing and turn.source == "assistant":
+        vector = turn.extras.get("query_vector")
+        if vector is not None:
+            semantic_cache.store(turn.assistant_id, turn.normalized_query, turn.response, vector)
+
+
+pipeline.add_hook("cache_lookup", _answer_bank_lookup)
+pipeline.add_hook("cache_lookup", _semantic_cache_lookup)
+pipeline.add_hook("metrics", _semantic_cache_store)
+
+
+def _inspect_retrieval(_pipeline, turn):
+    """Guardar qué chunks devolvió file_search (en segundo plano)."""
+    if RETRIEVAL_INSPECTION_ENABLED and turn.run is not None:
+        retrieval_inspector.inspect(turn.assistant_id, turn.normalized_query,
+                                    turn.run.thread_id, turn.run.id)
+
+
+pipeline.add_hook("metrics", _inspect_retrieval)
+
+
+# Endpoints cuyo deadline corre desde la llegada del request
+_DEADLINE_ENDPOINTS = {'api.chat', 'api.chat_continue'}
+
+
+@api.before_request
+def _start_deadline():
+    """Arrancar el reloj del deadline antes de cualquier espera (idempotencia, admisión)."""
+    if request.endpoint in _DEADLINE_ENDPOINTS:
+        g.arrived_at = time.monotonic()
+        _request_deadline()
+
+
+def _request_deadline():
+    """Deadline del request actual (header X-Request-Timeout o timeout del tenant)."""
+    if 'deadline' not in g:
+        data = request.get_json(silent=True) or {}
+        tenant = tenant_registry.get(data.get('assistant_id') or '')
+        g.deadline = Deadline.for_request(request.headers.get(DEADLINE_HEADER),
+                                          tenant.timeout if tenant else None,
+                                          started=g.get('arrived_at'))
+    return g.deadline
+
+
+def idempotent(view):
+    """
+    Suprimir requests duplicados (reintentos del webhook o del cliente).
+
+    La clave viene del header Idempotency-Key o, si hay thread_id, se deriva
+    de (thread_id, message). Una clave derivada solo agrupa duplicados en
+    curso o de hace DERIVED_KEY_TTL segundos. Solo se guardan respuestas exitosas; los errores
+    y las respuestas degradadas del circuit breaker liberan la clave para que
+    el reintento vuelva a ejecutarse.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        ttl = None
+        if not key:
+            data = request.get_json(silent=True) or {}
+            # Sin thread_id no se deriva clave: el mismo "Hi" de dos leads distintos
+            # no debe compartir respuesta ni thread
+            if data.get('thread_id') and data.get('message'):
+                key = derive_key(request.path, data.get('assistant_id'),
+                                 data.get('thread_id'), data.get('message'))
+                ttl = DERIVED_KEY_TTL
+        if not key:
+            return view(*args, **kwargs)
+
+        key = f"{request.path}:{key}"
+        state, stored = idempotency_store.claim(key, ttl)
+        while state == "pending":
+            metrics.incr("idempotency.attached")
+            # No esperar al original más de lo que le queda a este request
+            wait = min(IDEMPOTENCY_WAIT, max(_request_deadline().remaining(), 0))
+            state, stored = idempotency_store.wait(key, wait)
+            if state == "released":
+                # El original falló: este request toma la clave y ejecuta el run
+                metrics.incr("idempotency.reclaimed")
+                state, stored = idempotency_store.claim(key, ttl)
+            elif state in ("pending", "busy"):
+                return jsonify({
+                    "error": "Ya hay un request en curso con la misma clave de idempotencia",
+                    "status": "error"
+                }), 409
+        if stored is not None:
+            metrics.incr("idempotency.replayed")
+            body, status_code = stored
+            return current_app.response_class(body, status=status_code, mimetype='application/json')
+
+        try:
+            result = view(*args, **kwargs)
+        except Exception:
+            idempotency_store.release(key)
+            raise
+        response = current_app.make_response(result)
+        if response.status_code == 200 and not g.pop('degraded_reply', False):
+            idempotency_store.complete(key, response.get_data(as_text=True), 200)
+        else:
+            idempotency_store.release(key)
+        return response
+    return wrapper
+
+
+def _request_priority(data):
+    """
+    Prioridad del request: las API keys batch siempre son batch; si no, se
+    respeta el campo 'priority' o el header X-Priority (por defecto interactive).
+    """
+    auth = request.headers.get('Authorization', '')
+    if auth.startswith('Bearer ') and auth[7:] in BATCH_API_KEYS:
+        return BATCH
+    return normalize_priority(data.get('priority') or request.headers.get('X-Priority'))
+
+
+def admitted(view):
+    """
+    Rechazar rápido con 503 + Retry-After cuando no hay capacidad.
+
+    La espera en la cola gasta del deadline del request (_request_deadline).
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        data = request.get_json(silent=True) or {}
+        assistant_id = data.get('assistant_id') or ''
+        tenant = tenant_registry.get(assistant_id)
+        priority = _request_priority(data)
+        try:
+            admission.acquire(assistant_id, tenant.max_inflight if tenant else None, priority,
+                              timeout=_request_deadline().remaining())
+        except AdmissionRejected as e:
+            response = jsonify({
+                "error": "Servidor saturado, intenta de nuevo más tarde",
+                "details": e.reason,
+                "status": "error"
+            })
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response, 503
+        try:
+            return view(*args, **kwargs)
+        finally:
+            admission.release(assistant_id, priority)
+    return wrapper
+
+
+def _remember_turn(_pipeline, turn, error=None):
+    # El grabador de tráfico lee los tiempos upstream del turno al final del request
+    if traffic_recorder.enabled and has_request_context():
+        g.traffic_turn = turn
+
+
+pipeline.add_hook("metrics", _remember_turn)
+pipeline.on_error(_remember_turn)
+
+
+def recorded(view):
+    """Grabar el request anonimizado si TRAFFIC_RECORD_PATH está configurado."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not traffic_recorder.enabled:
+            return view(*args, **kwargs)
+        arrival = time.time()
+        start = time.perf_counter()
+        response = current_app.make_response(view(*args, **kwargs))
+        traffic_recorder.record(
+            arrival, request.path, request.get_json(silent=True),
+            response.get_json(silent=True), response.status_code,
+            (time.perf_counter() - start) * 1000, g.get('traffic_turn')
+        )
+        return response
+    return wrapper
+
+
+def _turn_response(body, status_code):
+    """JSON response for a turn; a 503 with retry_after also gets the Retry-After header."""
+    response = jsonify(body)
+    if status_code == 503 and body.get("retry_after"):
+        response.headers['Retry-After'] = str(body["retry_after"])
+    return response, status_code
+
+
+@api.route('/chat', methods=['POST'])
+@recorded
+@idempotent
+@admitted
 def chat():
     """
     Endpoint para procesar mensajes del usuario con el asistente de OpenAI.
@@ -49,119 +540,25 @@ def chat():
     Parámetros esperados (JSON):
     - message: String con el mensaje del usuario
     - assistant_id: String con el ID del asistente
+    - lead_id (opcional): String con el ID del lead, para consultar su historial
+    - priority (opcional): "interactive" (por defecto) o "batch"
+    
+    Header opcional X-Request-Timeout: segundos que el cliente va a esperar.
     
     Retorna:
     - response: String con la respuesta del asistente
     - normalized_query: String con el query normalizado
     - status: String con el estado de la ejecución
+    - deadline: Presupuesto de tiempo del request y cuánto se gastó
     """
-    try:
-        # Obtener datos del request
-        data = request.get_json()
-        
-        if not data:
-            return jsonify({
-                "error": "No se proporcionaron datos en el request"
-            }), 400
-        
-        user_message = data.get('message')
-        assistant_id = data.get('assistant_id')
-        
-        # Validar parámetros requeridos
-        if not user_message:
-            return jsonify({
-                "error": "El parámetro 'message' es requerido"
-            }), 400
-        
-        if not assistant_id:
-            return jsonify({
-                "error": "El parámetro 'assistant_id' es requerido"
-            }), 400
-        
-        # Normalizar el mensaje del usuario
-        normalized_query = clean_query(user_message)
-        
-        # Crear thread y ejecutar el asistente
-        run = client.beta.threads.create_and_run(
-            assistant_id=assistant_id,
-            thread={
-                "messages": [
-                    {"role": "user", "content": user_message}
-                ]
-            }
-        )
-        
-        # Esperar a que se complete la ejecución
-        max_wait_time = 60  # Máximo 60 segundos de espera
-        start_time = time.time()
-        
-        while run.status in ['queued', 'in_progress']:
-            # Verificar timeout
-            if time.time() - start_time > max_wait_time:
-                return jsonify({
-                    "error": "Timeout: El asistente tardó demasiado en responder",
-                    "status": run.status
-                }), 408
-            
-            time.sleep(1)
-            run = client.beta.threads.runs.retrieve(
-                thread_id=run.thread_id,
-                run_id=run.id
-            )
-        
-        # Verificar si se completó exitosamente
-        if run.status == 'completed':
-            # Obtener los mensajes del thread
-            messages = client.beta.threads.messages.list(thread_id=run.thread_id)
-            
-            # Buscar la respuesta del asistente
-            assistant_response = None
-            for message in messages.data:
-                if message.role == "assistant":
-                    for content in message.content:
-                        if hasattr(content, 'text'):
-                            assistant_response = content.text.value
-                            break
-                    if assistant_response:
-                        break
-            
-            if assistant_response:
-                # Limpiar la respuesta del asistente
-                cleaned_response = clean_assistant_response(assistant_response)
-                
-                return jsonify({
-                    "response": cleaned_response,
-                    "normalized_query": normalized_query,
-                    "status": "success",
-                    "thread_id": run.thread_id
-                }), 200
-            else:
-                return jsonify({
-                    "error": "No se pudo obtener la respuesta del asistente",
-                    "status": "error"
-                }), 500
-        
-        else:
-            # La ejecución falló
-            error_message = "Error desconocido"
-            if run.last_error:
-                error_message = f"{run.last_error.code}: {run.last_error.message}"
-            
-            return jsonify({
-                "error": f"La ejecución falló con estado: {run.status}",
-                "details": error_message,
-                "status": "error"
-            }), 500
-    
-    except Exception as e:
-        return jsonify({
-            "error": "Error interno del servidor",
-            "details": str(e),
-            "status": "error"
-        }), 500
+    body, status_code = pipeline.handle(request.get_json, deadline=_request_deadline())
+    return _turn_response(body, status_code)
 
 
-@app.route('/chat/continue', methods=['POST'])
+@api.route('/chat/continue', methods=['POST'])
+@recorded
+@idempotent
+@admitted
 def chat_continue():
     """
     Endpoint para continuar una conversación existente usando un thread_id.
@@ -170,140 +567,302 @@ def chat_continue():
     - message: String con el mensaje del usuario
     - assistant_id: String con el ID del asistente
     - thread_id: String con el ID del thread existente
+    - lead_id (opcional): String con el ID del lead, para consultar su historial
+    - priority (opcional): "interactive" (por defecto) o "batch"
+    
+    Header opcional X-Request-Timeout: segundos que el cliente va a esperar.
     
     Retorna:
     - response: String con la respuesta del asistente
     - normalized_query: String con el query normalizado
     - status: String con el estado de la ejecución
     - thread_id: String con el ID del thread
+    - deadline: Presupuesto de tiempo del request y cuánto se gastó
     """
+    body, status_code = pipeline.handle(request.get_json, require_thread=True,
+                                        deadline=_request_deadline())
+    return _turn_response(body, status_code)
+
+
+def _last_thread(lead_id):
+    turn = transcripts.last_turn(lead_id)
+    return turn["thread_id"] if turn else None
+
+
+messenger_threads = messenger.SenderThreads(_last_thread)
+
+
+def _messenger_turn(key, texts):
+    """Ejecutar un turno con los mensajes agrupados de un remitente y responderle."""
+    # El reloj corre desde que el lote se despacha (la ventana de agrupación no cuenta)
+    started = time.monotonic()
+    page_id, sender_id = key
+    tenant = tenant_registry.get_by_page(page_id)
+    assistant_id = tenant.assistant_id if tenant else messenger.MESSENGER_ASSISTANT_ID
+    if not assistant_id:
+        metrics.incr("messenger.unrouted")
+        return
+
+    # Un turno por remitente entre todos los workers; SenderBusy reprograma el lote
+    lease_key, owner = f"messenger-lease:{page_id}:{sender_id}", uuid.uuid4().hex
+    if not idempotency_store.acquire_lease(lease_key, owner, messenger.LEASE_TTL):
+        raise messenger.SenderBusy()
     try:
-        # Obtener datos del request
-        data = request.get_json()
-        
-        if not data:
-            return jsonify({
-                "error": "No se proporcionaron datos en el request"
-            }), 400
-        
-        user_message = data.get('message')
-        assistant_id = data.get('assistant_id')
-        thread_id = data.get('thread_id')
-        
-        # Validar parámetros requeridos
-        if not user_message:
-            return jsonify({
-                "error": "El parámetro 'message' es requerido"
-            }), 400
-        
-        if not assistant_id:
-            return jsonify({
-                "error": "El parámetro 'assistant_id' es requerido"
-            }), 400
-        
-        if not thread_id:
-            return jsonify({
-                "error": "El parámetro 'thread_id' es requerido para continuar la conversación"
-            }), 400
-        
-        # Normalizar el mensaje del usuario
-        normalized_query = clean_query(user_message)
-        
-        # Agregar mensaje al thread existente
-        client.beta.threads.messages.create(
-            thread_id=thread_id,
-            role="user",
-            content=user_message
-        )
-        
-        # Ejecutar el asistente en el thread existente
-        run = client.beta.threads.runs.create(
-            thread_id=thread_id,
-            assistant_id=assistant_id
-        )
-        
-        # Esperar a que se complete la ejecución
-        max_wait_time = 60  # Máximo 60 segundos de espera
-        start_time = time.time()
-        
-        while run.status in ['queued', 'in_progress']:
-            # Verificar timeout
-            if time.time() - start_time > max_wait_time:
-                return jsonify({
-                    "error": "Timeout: El asistente tardó demasiado en responder",
-                    "status": run.status,
-                    "thread_id": thread_id
-                }), 408
-            
-            time.sleep(1)
-            run = client.beta.threads.runs.retrieve(
-                thread_id=thread_id,
-                run_id=run.id
-            )
-        
-        # Verificar si se completó exitosamente
-        if run.status == 'completed':
-            # Obtener los mensajes del thread
-            messages = client.beta.threads.messages.list(thread_id=thread_id)
-            
-            # Buscar la respuesta del asistente (el mensaje más reciente)
-            assistant_response = None
-            for message in messages.data:
-                if message.role == "assistant":
-                    for content in message.content:
-                        if hasattr(content, 'text'):
-                            assistant_response = content.text.value
-                            break
-                    if assistant_response:
-                        break
-            
-            if assistant_response:
-                # Limpiar la respuesta del asistente
-                cleaned_response = clean_assistant_response(assistant_response)
-                
-                return jsonify({
-                    "response": cleaned_response,
-                    "normalized_query": normalized_query,
-                    "status": "success",
-                    "thread_id": thread_id
-                }), 200
-            else:
-                return jsonify({
-                    "error": "No se pudo obtener la respuesta del asistente",
-                    "status": "error",
-                    "thread_id": thread_id
-                }), 500
-        
-        else:
-            # La ejecución falló
-            error_message = "Error desconocido"
-            if run.last_error:
-                error_message = f"{run.last_error.code}: {run.last_error.message}"
-            
-            return jsonify({
-                "error": f"La ejecución falló con estado: {run.status}",
-                "details": error_message,
-                "status": "error",
-                "thread_id": thread_id
-            }), 500
+        _run_messenger_turn(tenant, assistant_id, sender_id, texts, started)
+    finally:
+        idempotency_store.release_lease(lease_key, owner)
+
+
+def _run_messenger_turn(tenant, assistant_id, sender_id, texts, started=None):
+    lead_id = f"messenger:{sender_id}"
+    thread_id = messenger_threads.get(lead_id)
+    data = {
+        "message": messenger.merge_messages(texts),
+        "assistant_id": assistant_id,
+        "thread_id": thread_id,
+        "lead_id": lead_id,
+    }
+    deadline = Deadline.for_request(tenant_timeout=tenant.timeout if tenant else None,
+                                    started=started)
+    # AdmissionRejected sube al batcher, que reintenta el lote más tarde
+    with admission.slot(assistant_id, tenant.max_inflight if tenant else None, INTERACTIVE,
+                        timeout=deadline.remaining()):
+        body, status_code = pipeline.handle(lambda: data, require_thread=thread_id is not None,
+                                            deadline=deadline)
+    if status_code != 200:
+        metrics.incr("messenger.turn_failed")
+        return
+    if body.get("thread_id"):
+        messenger_threads.set(lead_id, body["thread_id"])
+    reply = body["response"]
+    # "A" es una señal para el flujo de fotos, no un texto para el lead
+    if reply == PHOTO_RESPONSE:
+        metrics.incr("messenger.photo_request")
+        reply = messenger.PHOTO_REPLY
+        if not reply:
+            return
+    messenger.send_reply(sender_id, reply)
+
+
+messenger_batcher = messenger.MessageBatcher(_messenger_turn)
+
+
+@api.route('/webhook/messenger', methods=['GET'])
+def messenger_verify():
+    """Verificación de la suscripción del webhook (hub.challenge)."""
+    if (request.args.get('hub.mode') == 'subscribe'
+            and messenger.MESSENGER_VERIFY_TOKEN
+            and request.args.get('hub.verify_token') == messenger.MESSENGER_VERIFY_TOKEN):
+        return request.args.get('hub.challenge', ''), 200
+    return jsonify({"error": "Token de verificación inválido"}), 403
+
+
+@api.route('/webhook/messenger', methods=['POST'])
+def messenger_webhook():
+    """
+    Endpoint para recibir mensajes de Facebook Messenger.
+
+    Verifica la firma X-Hub-Signature-256, agrupa los mensajes seguidos de cada
+    remitente y responde 200 de inmediato; la respuesta del asistente se envía
+    después con la Send API.
+    """
+    if not messenger.verify_signature(request.get_data(),
+                                      request.headers.get('X-Hub-Signature-256')):
+        metrics.incr("messenger.bad_signature")
+        return jsonify({"error": "Firma inválida"}), 403
+
+    for event in messenger.parse_events(request.get_json(silent=True) or {}):
+        # Messenger reintenta las entregas: cada mid se procesa una sola vez
+        if event["mid"]:
+            key = f"messenger:{event['mid']}"
+            state, _ = idempotency_store.claim(key)
+            if state != "owner":
+                metrics.incr("messenger.duplicate")
+                continue
+            idempotency_store.complete(key, "", 200)
+        metrics.incr("messenger.received")
+        messenger_batcher.add((event["page_id"], event["sender_id"]), event["text"])
+    return jsonify({"status": "received"}), 200
+
+
+def _admin_auth_error():
+    """
+    Los endpoints administrativos (transcripciones con teléfonos y emails,
+    vaciado de caché) fallan cerrados: sin API_KEY configurada quedan
+    deshabilitados.
+    """
+    if not API_KEY:
+        return jsonify({"error": "API_KEY no configurada; endpoint deshabilitado"}), 503
+    if request.headers.get('Authorization') != f'Bearer {API_KEY}':
+        return jsonify({"error": "Unauthorized"}), 401
+    return None
+
+
+@api.route('/cache/invalidate', methods=['POST'])
+def cache_invalidate():
+    """
+    Endpoint para vaciar la caché semántica.
+    Requiere la API Key; sin API_KEY configurada responde 503.
     
-    except Exception as e:
-        return jsonify({
-            "error": "Error interno del servidor",
-            "details": str(e),
-            "status": "error"
-        }), 500
+    Parámetros opcionales (JSON):
+    - assistant_id: String con el ID del asistente; si falta se vacía toda la caché
+    """
+    error = _admin_auth_error()
+    if error is not None:
+        return error
+    data = request.get_json(silent=True) or {}
+    removed = semantic_cache.invalidate(data.get('assistant_id'))
+    return jsonify({"status": "success", "removed": removed}), 200
 
 
-@app.route('/health', methods=['GET'])
+# Tope de turnos por respuesta de historial
+MAX_HISTORY_LIMIT = int(os.getenv("MAX_HISTORY_LIMIT", 1000))
+
+
+def _history_response(**key):
+    """Historial de un thread o lead desde el almacén local (JSON o NDJSON)."""
+    limit = request.args.get('limit', type=int)
+    if 'limit' in request.args and (limit is None or limit <= 0):
+        return jsonify({"error": "'limit' debe ser un entero positivo"}), 400
+    limit = min(limit or MAX_HISTORY_LIMIT, MAX_HISTORY_LIMIT)
+    if json_backend.wants_ndjson(request):
+        # Un turno por línea, leído del cursor a medida que se envía
+        turns = transcripts.iter_history(limit=limit, **key)
+        return json_backend.ndjson_response(current_app, turns)
+    start = time.perf_counter()
+    turns = transcripts.history(limit=limit, **key)
+    return jsonify({
+        **key,
+        "turns": turns,
+        "count": len(turns),
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 2)
+    }), 200
+
+
+@api.route('/threads/<thread_id>/history', methods=['GET'])
+def thread_history(thread_id):
+    """
+    Endpoint para obtener todos los turnos registrados de un thread.
+    Requiere la API Key (los turnos incluyen mensajes y datos de contacto);
+    sin API_KEY configurada responde 503.
+    
+    Parámetros opcionales (query string):
+    - limit: Número máximo de turnos (los más recientes; 1 a MAX_HISTORY_LIMIT)
+    - format: "ndjson" para recibir un turno por línea en streaming
+    """
+    error = _admin_auth_error()
+    if error is not None:
+        return error
+    return _history_response(thread_id=thread_id)
+
+
+@api.route('/leads/<lead_id>/history', methods=['GET'])
+def lead_history(lead_id):
+    """
+    Endpoint para obtener todos los turnos registrados de un lead.
+    Requiere la API Key (los turnos incluyen mensajes y datos de contacto);
+    sin API_KEY configurada responde 503.
+    
+    Parámetros opcionales (query string):
+    - limit: Número máximo de turnos (los más recientes; 1 a MAX_HISTORY_LIMIT)
+    - format: "ndjson" para recibir un turno por línea en streaming
+    """
+    error = _admin_auth_error()
+    if error is not None:
+        return error
+    return _history_response(lead_id=lead_id)
+
+
+@api.route('/health', methods=['GET'])
 def health():
     """Endpoint para verificar que el servidor esté funcionando."""
+    upstream_health.ensure_started()
+    ready, readiness = upstream_health.readiness(admission.stats())
     return jsonify({
         "status": "healthy",
-        "message": "API endpoint está funcionando correctamente"
+        "message": "API endpoint está funcionando correctamente",
+        "ready": ready,
+        "readiness": readiness,
+        "inflight_runs": run_control.inflight_count(),
+        "admission": admission.stats(),
+        "circuit_breaker": circuit_breaker.stats(),
+        "startup": STARTUP,
+        "semantic_cache": semantic_cache.stats(),
+        "answer_bank": answer_bank.stats(),
+        "messenger": messenger_batcher.stats(),
+        "tenants": [t.name for t in tenant_registry.tenants()],
+        "tenants_source": tenant_registry.source,
+        "metrics": metrics.snapshot()
     }), 200
 
 
+@api.route('/health/live', methods=['GET'])
+def health_live():
+    """Liveness: el proceso responde, sin mirar dependencias externas."""
+    return jsonify({"status": "alive"}), 200
+
+
+@api.route('/health/ready', methods=['GET'])
+def health_ready():
+    """
+    Readiness: el worker puede atender tráfico.
+    
+    Usa el último probe cacheado de OpenAI, la tasa de error reciente y la
+    saturación del worker; nunca hace llamadas de red. Devuelve 503 si no está listo.
+    """
+    upstream_health.ensure_started()
+    saturation = admission.stats()
+    ready, readiness = upstream_health.readiness(saturation)
+    body = {
+        "status": "ready" if ready else "not_ready",
+        "inflight_runs": run_control.inflight_count(),
+        "saturation": saturation,
+        **readiness
+    }
+    return jsonify(body), 200 if ready else 503
+
+
+def warm_up():
+    """
+    Precarga costosa que conviene hacer una sola vez en el master de gunicorn
+    (preload_app): registro de tenants y modelo de la caché semántica.
+    """
+    tenant_registry.load()
+    tenant_registry.warn_if_missing()
+    if SEMANTIC_CACHE_ENABLED:
+        semantic_cache.embedder
+
+
+def reset_after_fork():
+    """
+    Recrear en cada worker el estado que no sobrevive a fork (sockets, hilos).
+
+    Las conexiones SQLite y los executors de local_state se recrean solos al
+    cambiar el pid.
+    """
+    global client, _client_pid
+    client = None
+    _client_pid = None
+    run_control.reset_after_fork()
+
+
+def create_app():
+    """Build the Flask app: tracing, routes and preloaded state."""
+    start = time.perf_counter()
+    flask_app = Flask(__name__)
+    STARTUP["json_backend"] = json_backend.install(flask_app)
+    tracing.setup_tracing(flask_app)
+    flask_app.register_blueprint(api)
+    warm_up()
+    STARTUP["pid"] = os.getpid()
+    STARTUP["import_ms"] = round((start - _IMPORT_STARTED) * 1000, 1)
+    STARTUP["create_app_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return flask_app
+
+
+app = create_app()
+
+
 if __name__ == '__main__':
     # Obtener puerto desde variable de entorno o usar 5000 por defecto
     port = int(os.getenv('PORT', 5000))
@@ -312,7 +871,11 @@ if __name__ == '__main__':
     print(f"📡 Servidor corriendo en http://0.0.0.0:{port}")
     print("\nEndpoints disponibles:")
     print("  POST /chat - Procesar mensajes del usuario")
+    print("  POST /webhook/messenger - Webhook de Facebook Messenger")
+    print("  GET  /threads/<thread_id>/history - Historial local de un thread")
     print("  GET  /health - Verificar estado del servidor")
+    print("  GET  /health/live - Liveness")
+    print("  GET  /health/ready - Readiness (probe de OpenAI cacheado)")
     print("\nEjemplo de uso:")
     print(f"""
     curl -X POST http://localhost:{port}/chat \\
@@ -0,0 +1,109 @@
+"""
+Micro-benchmark de serialización JSON de la API.
+
+Compara el proveedor por defecto de Flask (json de la librería estándar) con
+orjson para las cargas típicas:
+- el body de /chat (parseo del request y respuesta),
+- un historial grande de /threads/<id>/history, como JSON y como NDJSON.
+
+Mide solo la serialización dentro de Flask, sin red ni OpenAI.
+
+Uso:
+    python bench_json.py [iteraciones]
+"""
+import statistics
+import sys
+import time
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+import json_backend
+
+CHAT_REQUEST = {
+    "message": "Hi, is lot 335 still available? 100815996313376_364484063234800",
+    "assistant_id": "asst_hcYW49TgFL4OtyAFNLGrlnDm",
+    "thread_id": "thread_abc123",
+    "lead_id": "messenger:24518837203",
+}
+
+CHAT_RESPONSE = {
+    "response": "Lot 335 Nogales Lane is a 3 bedroom, 2 bathroom home available for rent "
+                "at $1,000/month. Would you like to schedule a showing?",
+    "normalized_query": "hi is lot 335 still available 100815996313376_364484063234800",
+    "status": "success",
+    "thread_id": "thread_abc123",
+}
+
+
+def _history(turns):
+    return [{
+        "id": i,
+        "created_at": 1760000000.0 + i,
+        "thread_id": "thread_abc123",
+        "lead_id": "messenger:24518837203",
+        "assistant_id": CHAT_REQUEST["assistant_id"],
+        "run_id": f"run_{i}",
+        "user_message": CHAT_REQUEST["message"],
+        "normalized_query": CHAT_RESPONSE["normalized_query"],
+        "response": CHAT_RESPONSE["response"],
+        "source": "assistant",
+        "timings": {"submit": 310.2, "wait": 4210.5, "extract": 180.1},
+        "usage": {"prompt_tokens": 2410, "completion_tokens": 64, "total_tokens": 2474},
+    } for i in range(turns)]
+
+
+def _build_app(backend):
+    app = Flask(__name__)
+    if backend == "orjson":
+        json_backend.install(app)
+    else:
+        app.json = DefaultJSONProvider(app)
+    return app
+
+
+def _measure(func, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return statistics.mean(samples) * 1e6
+
+
+def bench(backend, iterations):
+    app = _build_app(backend)
+    raw_request = app.json.dumps(CHAT_REQUEST).encode("utf-8")
+    history = _history(500)
+    results = {}
+    with app.test_request_context():
+        results["parse /chat request"] = _measure(lambda: app.json.loads(raw_request), iterations)
+        results["jsonify /chat response"] = _measure(
+            lambda: app.json.response(CHAT_RESPONSE).get_data(), iterations)
+        results["jsonify history (500)"] = _measure(
+            lambda: app.json.response({"turns": history}).get_data(), max(iterations // 50, 10))
+        results["ndjson history (500)"] = _measure(
+            lambda: b"".join(json_backend.dumpb(app, turn) + b"\n" for turn in history),
+            max(iterations // 50, 10))
+    return results
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    backends = ["json"] + (["orjson"] if json_backend.orjson is not None else [])
+    if len(backends) == 1:
+        print("⚠️  orjson no está instalado: solo se mide la librería estándar")
+
+    results = {backend: bench(backend, iterations) for backend in backends}
+    print(f"\n📊 Serialización JSON por request ({iterations} iteraciones)\n")
+    print(f"{'operación':<26}" + "".join(f"{b:>14}" for b in backends)
+          + ("      mejora" if len(backends) > 1 else ""))
+    for operation in results["json"]:
+        row = f"{operation:<26}" + "".join(f"{results[b][operation]:>11.1f} µs" for b in backends)
+        if len(backends) > 1:
+            row += f"{results['json'][operation] / results['orjson'][operation]:>11.1f}x"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Micro-benchmark del pipeline de conversación por etapa.
+
+Usa un cliente simulado sin latencia de red, así que mide solo el costo
+propio del servidor en cada etapa (validación, polling, extracción, limpieza,
+reglas de salida y métricas).
+
+Uso:
+    python bench_pipeline.py [iteraciones]
+"""
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+
+from pipeline import ConversationPipeline, STAGES
+
+SAMPLE_RESPONSE = (
+    "**Lot 335 Nogales Lane** is a 3 bedroom, 2 bathroom home available for rent "
+    "at $1,000/month 【4:0†source】. Would you like to schedule a showing? "
+    "100815996313376_364484063234800"
+)
+
+
+class StubClient:
+    """Minimal stand-in for the OpenAI client with instant responses."""
+
+    def __init__(self, polls=2):
+        self.polls = polls
+        self.beta = SimpleNamespace(threads=self)
+        self.runs = self
+        self.messages = self
+        self._remaining = {}
+
+    # threads.create_and_run
+    def create_and_run(self, assistant_id, thread, **kwargs):
+        return self._new_run("thread_bench")
+
+    # threads.runs.create / threads.messages.create
+    def create(self, thread_id, assistant_id=None, **kwargs):
+        return self._new_run(thread_id)
+
+    def retrieve(self, thread_id, run_id, **kwargs):
+        self._remaining[run_id] -= 1
+        status = "in_progress" if self._remaining[run_id] > 0 else "completed"
+        return SimpleNamespace(id=run_id, thread_id=thread_id, status=status,
+                               last_error=None, usage=None)
+
+    def list(self, thread_id, **kwargs):
+        text = SimpleNamespace(value=SAMPLE_RESPONSE)
+        message = SimpleNamespace(role="assistant", content=[SimpleNamespace(text=text)])
+        return SimpleNamespace(data=[message])
+
+    def _new_run(self, thread_id):
+        run_id = f"run_{len(self._remaining)}"
+        self._remaining[run_id] = self.polls
+        return SimpleNamespace(id=run_id, thread_id=thread_id, status="queued",
+                               last_error=None, usage=None)
+
+
+def run_benchmark(iterations):
+    client = StubClient()
+    pipeline = ConversationPipeline(lambda: client, sleep=lambda s: None)
+    timings = {stage: [] for stage in STAGES}
+    totals = []
+
+    payloads = [
+        {"message": "Tell me about lot 335", "assistant_id": "asst_bench"},
+        {"message": "Is this available? 100815996313376_364484063234800",
+         "assistant_id": "asst_bench", "thread_id": "thread_bench"},
+    ]
+
+    for i in range(iterations):
+        payload = payloads[i % len(payloads)]
+        start = time.perf_counter()
+        turn = pipeline.parse(payload, require_thread="thread_id" in payload)
+        pipeline.execute(turn)
+        totals.append(time.perf_counter() - start)
+        for stage, elapsed in turn.timings.items():
+            timings[stage].append(elapsed)
+
+    return timings, totals
+
+
+def _fmt(values):
+    values = sorted(values)
+    p95 = values[int(len(values) * 0.95) - 1] if len(values) > 1 else values[0]
+    return f"media {statistics.mean(values) * 1e6:8.1f} µs   p95 {p95 * 1e6:8.1f} µs"
+
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+
+    print("⏱️  MICRO-BENCHMARK DEL PIPELINE")
+    print("=" * 60)
+    timings, totals = run_benchmark(iterations)
+    for stage in STAGES:
+        if timings[stage]:
+            print(f"{stage:<14} {_fmt(timings[stage])}")
+    print("-" * 60)
+    print(f"{'turno completo':<14} {_fmt(totals)}")
+    print(f"\n✅ {iterations} turnos ejecutados")
@@ -0,0 +1,182 @@
+"""
+Circuit breaker delante de OpenAI con respuestas de modo degradado.
+
+Cuando OpenAI falla o se pone lento, cada request espera el loop completo de
+60 s (o falla después de ocupar un worker) y el backlog tumba el servicio. El
+breaker mira una ventana deslizante de llamadas upstream:
+
+- closed: todo pasa. Si en BREAKER_WINDOW_SECONDS hay al menos
+  BREAKER_MIN_CALLS llamadas y la tasa de errores o de llamadas lentas
+  (> BREAKER_SLOW_MS) supera su umbral, se abre.
+- open: durante BREAKER_OPEN_SECONDS no se llama a OpenAI; el turno se
+  responde al instante con un dato fijo del parque si la pregunta lo permite
+  o con la respuesta estándar del prompt. En /chat el thread se crea con un
+  único intento de BREAKER_THREAD_TIMEOUT segundos; si falla, 503 + Retry-After.
+- half_open: pasado ese tiempo se deja pasar un request de prueba. Si sale
+  bien se cierra; si falla vuelve a abrirse.
+
+El estado es por proceso, como las métricas.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+import metrics
+
+BREAKER_ENABLED = os.getenv("BREAKER_ENABLED", "true").lower() == "true"
+WINDOW_SECONDS = float(os.getenv("BREAKER_WINDOW_SECONDS", 60))
+MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", 10))
+ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", 0.5))
+SLOW_MS = float(os.getenv("BREAKER_SLOW_MS", 30000))
+SLOW_RATE = float(os.getenv("BREAKER_SLOW_RATE", 0.5))
+OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", 30))
+# Un request de prueba que nunca reporta resultado no bloquea la recuperación
+PROBE_TIMEOUT = float(os.getenv("BREAKER_PROBE_TIMEOUT", 90))
+# Con el breaker abierto, /chat igual crea el thread para devolver thread_id:
+# un intento corto y sin reintentos contra el upstream que se marcó caído
+DEGRADED_THREAD_TIMEOUT = float(os.getenv("BREAKER_THREAD_TIMEOUT", 2.5))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Respuesta estándar del prompt cuando no hay información
+FALLBACK_REPLY = ("That detail can be confirmed with the park manager. "
+                  "Would you like me to help schedule a showing so you can ask directly?")
+
+# Palabras del query que identifican cada dato fijo del parque (claves de "facts")
+FACT_KEYWORDS = {
+    "lot rent": ("lot rent", "community rent", "space rent"),
+    "section 8": ("section 8", "section8", "voucher", "vouchers"),
+    "pets": ("pet", "pets", "dog", "dogs", "cat", "cats"),
+    "fencing": ("fence", "fences", "fencing"),
+    "address": ("address", "located", "location", "where is the park", "where are you"),
+}
+
+
+def local_answer(facts, normalized_query):
+    """Answer from the tenant's fixed facts when the query clearly asks for one."""
+    if not facts or not normalized_query:
+        return None
+    padded = f" {normalized_query} "
+    for key, value in facts.items():
+        keywords = FACT_KEYWORDS.get(key.lower(), (key.lower(),))
+        if any(f" {keyword} " in padded for keyword in keywords):
+            return f"{key}: {value}."
+    return None
+
+
+class CircuitBreaker:
+    """Sliding-window breaker over upstream error rate and latency."""
+
+    def __init__(self, window=WINDOW_SECONDS, min_calls=MIN_CALLS, error_rate=ERROR_RATE,
+                 slow_ms=SLOW_MS, slow_rate=SLOW_RATE, open_seconds=OPEN_SECONDS,
+                 probe_timeout=PROBE_TIMEOUT):
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_ms = slow_ms
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.probe_timeout = probe_timeout
+        self._lock = threading.Lock()
+        self._calls = deque()  # (timestamp, ok, slow)
+        self._state = CLOSED
+        self._opened_at = None
+        self._probe_started = None
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state(time.monotonic())
+
+    def _current_state(self, now):
+        if self._state == OPEN and now - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._probe_started = None
+        return self._state
+
+    def allow(self):
+        """
+        Return (allowed, probe). probe is True for the single half-open request
+        whose outcome decides whether the breaker closes.
+        """
+        now = time.monotonic()
+        with self._lock:
+            state = self._current_state(now)
+            if state == CLOSED:
+                return True, False
+            if state == HALF_OPEN and (self._probe_started is None
+                                       or now - self._probe_started > self.probe_timeout):
+                self._probe_started = now
+                metrics.incr("breaker.probes")
+                return True, True
+        metrics.incr("breaker.short_circuited")
+        return False, False
+
+    def record(self, ok, latency_ms=None, probe=False):
+        """Record an upstream call outcome and move between states."""
+        now = time.monotonic()
+        slow = latency_ms is not None and latency_ms > self.slow_ms
+        with self._lock:
+            state = self._current_state(now)
+            if state == HALF_OPEN:
+                if not probe:
+                    return
+                if ok and not slow:
+                    self._close()
+                else:
+                    self._open(now)
+                return
+            if state == OPEN:
+                return
+            self._calls.append((now, ok, slow))
+            self._trim(now)
+            calls = len(self._calls)
+            if calls < self.min_calls:
+                return
+            errors = sum(1 for _, call_ok, _ in self._calls if not call_ok)
+            slow_calls = sum(1 for _, _, call_slow in self._calls if call_slow)
+            if errors / calls > self.error_rate or slow_calls / calls > self.slow_rate:
+                self._open(now)
+
+    def cancel_probe(self):
+        """The probe request never reached upstream (e.g. served from cache)."""
+        with self._lock:
+            self._probe_started = None
+
+    def _open(self, now):
+        self._state = OPEN
+        self._opened_at = now
+        self._probe_started = None
+        self._calls.clear()
+        metrics.incr("breaker.opened")
+
+    def _close(self):
+        self._state = CLOSED
+        self._opened_at = None
+        self._probe_started = None
+        self._calls.clear()
+        metrics.incr("breaker.closed")
+
+    def _trim(self, now):
+        cutoff = now - self.window
+        while self._calls and self._calls[0][0] < cutoff:
+            self._calls.popleft()
+
+    def stats(self):
+        """Current state and window, for /health."""
+        now = time.monotonic()
+        with self._lock:
+            state = self._current_state(now)
+            self._trim(now)
+            calls = len(self._calls)
+            return {
+                "state": state,
+                "window_calls": calls,
+                "window_errors": sum(1 for _, ok, _ in self._calls if not ok),
+                "window_slow": sum(1 for _, _, slow in self._calls if slow),
+                "open_for_s": round(max(0.0, self.open_seconds - (now - self._opened_at)), 1)
+                              if state == OPEN else None,
+            }
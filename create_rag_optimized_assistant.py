@@ -120,15 +120,8 @@ When a user's message includes a post_id (format: numbers_numbers like "10081599
 4. Use ONLY the lot name/address in your responses - NEVER use the post_id
 5. Provide information from that property's document only
 
-**CRITICAL RULE - Post ID Visibility (ABSOLUTE - NO EXCEPTIONS):**
-- The post_id (format: numbers_numbers like "100815996313376_364484063234800") is ONLY for internal search
-- **EVEN IF the user sends the post_id in their message, DO NOT include it in your response**
-- **NEVER include the post_id in ANY response under ANY circumstance**
-- **NEVER say "Lot 100815996313376_364484063234800"**
-- **NEVER repeat or echo back the post_id numbers that the user sent**
-- ALWAYS use the actual lot name from the document instead (e.g., "Lot 335 Nogales Lane", "335 Nogales Ln")
-- If the lot name/address is in the document under "Lot:" field, use that exact name
-- The post_id is invisible to you in responses - treat it as if it doesn't exist when writing responses
+**Post ID Visibility:**
+- ALWAYS refer to the property by the lot name from the document (e.g., "Lot 335 Nogales Lane"), using the exact "Lot:" field when present
 
 Example - Showing CORRECT vs WRONG responses:
 
@@ -370,7 +363,7 @@ For unrelated requests (calculations, general knowledge, personal tasks):
 - Don't repeat park name unnecessarily
 - Don't use general knowledge if no data was retrieved
 - Don't ask clarifying questions when user has already provided clear specifications
-- **NEVER mention, include, repeat, or echo back the post_id (lot property id) in any response - even if the user sends it in their message, ignore it completely in your response and use the lot name/address instead**
+- NEVER repeat the post_id (numbers_numbers) in a response, even if the user sent it; use the lot name instead
 
 # Always Remember
 - Prioritize knowledge base first
@@ -379,6 +372,32 @@ For unrelated requests (calculations, general knowledge, personal tasks):
 - Guide toward scheduling
 - Respect customer pace and budget"""
 
+# Configuración por parque: con TENANT=<nombre> se usan los datos de tenants.json
+VECTOR_STORE_ID = 'vs_68f948333dbc8191a4c1c0e12f86c77e'
+TENANT = os.getenv("TENANT")
+
+if TENANT:
+    from tenants import TENANTS_CONFIG, TenantRegistry, render_facts
+
+    tenant = TenantRegistry().get_by_name(TENANT)
+    if tenant is None:
+        raise ValueError(f"No existe el tenant '{TENANT}' en {TENANTS_CONFIG}")
+
+    DEFAULT_FACTS = """- Lot rent: $525/month (fixed, always)
+- Section 8: Accepted
+- Pets: Non-vicious pets allowed
+- Fencing: Not allowed
+- Address: 69 Foothills Circle, Gillette, WY 82716"""
+    RAG_OPTIMIZED_INSTRUCTIONS = RAG_OPTIMIZED_INSTRUCTIONS.replace(
+        DEFAULT_FACTS, render_facts(tenant.facts)
+    )
+    if "Lot rent" in tenant.facts:
+        RAG_OPTIMIZED_INSTRUCTIONS = RAG_OPTIMIZED_INSTRUCTIONS.replace(
+            '→ $525/month (fixed)', f'→ {tenant.facts["Lot rent"]}'
+        )
+    VECTOR_STORE_ID = tenant.vector_store_id or VECTOR_STORE_ID
+    print(f"🏘️  Tenant: {tenant.name}")
+
 print("🔧 Creando nuevo assistant con prompt optimizado para RAG...")
 
 # Crear el nuevo asistente con configuración óptima
@@ -396,7 +415,7 @@ new_assistant = client.beta.assistants.create(
         }
     }],
     tool_resources={
-        "file_search": {"vector_store_ids": ['vs_68f948333dbc8191a4c1c0e12f86c77e']}
+        "file_search": {"vector_store_ids": [VECTOR_STORE_ID]}
     },
     temperature=0.7,
     top_p=1.0
@@ -405,7 +424,7 @@ new_assistant = client.beta.assistants.create(
 print(f"✅ Nuevo assistant RAG optimizado creado: {new_assistant.id}")
 print(f"📝 Nombre: {new_assistant.name}")
 print(f"🤖 Modelo: {new_assistant.model}")
-print(f"📚 Vector Store: {'vs_68f948333dbc8191a4c1c0e12f86c77e'}")
+print(f"📚 Vector Store: {VECTOR_STORE_ID}")
 print(f"🎯 Score Threshold: 0.35")
 
 # Función para normalizar consultas
@@ -0,0 +1,103 @@
+"""
+Deadline único por request, propagado hasta las llamadas a OpenAI.
+
+Antes cada capa tenía su propio timeout (65/90 s en los clientes,
+--timeout 90 en gunicorn, 60 s solo para el loop de polling) y las llamadas
+del SDK no tenían ninguno: un request podía seguir trabajando después de que
+el cliente se rindió. Ahora:
+
+- El presupuesto sale del header X-Request-Timeout (segundos) o, si no
+  viene, del "timeout" del tenant o de REQUEST_TIMEOUT. Nunca supera
+  MAX_REQUEST_TIMEOUT, que debe quedar por debajo del --timeout de gunicorn.
+- El reloj empieza al llegar el request (un before_request marca la hora de
+  llegada de /chat y /chat/continue; en Messenger, al despachar el lote): la
+  espera en idempotencia y en admisión también gasta presupuesto.
+- Cada etapa consulta el tiempo restante: la cola de admisión, create_and_run,
+  cada runs.retrieve y messages.list reciben timeout = tiempo restante, y el
+  polling se corta cuando el presupuesto se agota (408 y cancelación del run).
+- La respuesta incluye cuánto del presupuesto se gastó.
+- El cliente de OpenAI se crea con max_retries=0: el SDK reintentaba con el
+  mismo timeout y un request podía gastar tres veces su presupuesto. Los
+  reintentos (rate limit, 5xx, conexión) los hace call_upstream, solo
+  mientras quede tiempo.
+"""
+import os
+import time
+
+import metrics
+
+DEADLINE_HEADER = "X-Request-Timeout"
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", 60))
+MAX_REQUEST_TIMEOUT = float(os.getenv("MAX_REQUEST_TIMEOUT", 85))
+# Tiempo reservado para limpiar la respuesta y enviarla
+DEADLINE_MARGIN = float(os.getenv("DEADLINE_MARGIN", 0.5))
+# Una llamada con menos tiempo que esto no llega a completarse
+MIN_CALL_TIMEOUT = 0.1
+# Reintentos de una llamada upstream dentro del presupuesto, con backoff exponencial
+UPSTREAM_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", 2))
+RETRY_BACKOFF = float(os.getenv("OPENAI_RETRY_BACKOFF", 0.5))
+
+
+def parse_timeout(value):
+    """Seconds from a timeout header value, or None if missing or invalid."""
+    if value is None:
+        return None
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        metrics.incr("deadline.invalid_header")
+        return None
+    return seconds if seconds > 0 else None
+
+
+class Deadline:
+    """Time budget of one request, shared by every stage that waits on upstream."""
+
+    def __init__(self, budget, source="default", clock=time.monotonic, started=None):
+        self.budget = budget
+        self.source = source
+        self._clock = clock
+        # started: instante de llegada (mismo reloj) si el deadline se crea después
+        self.started = clock() if started is None else started
+
+    @classmethod
+    def for_request(cls, header_value=None, tenant_timeout=None, started=None):
+        """Budget from the request header, else the tenant's timeout, else the default."""
+        requested = parse_timeout(header_value)
+        if requested is not None:
+            budget, source = requested, "header"
+        elif tenant_timeout:
+            budget, source = float(tenant_timeout), "tenant"
+        else:
+            budget, source = REQUEST_TIMEOUT, "default"
+        metrics.incr(f"deadline.source.{source}")
+        return cls(min(budget, MAX_REQUEST_TIMEOUT), source, started=started)
+
+    def elapsed(self):
+        return self._clock() - self.started
+
+    def remaining(self):
+        return self.budget - self.elapsed()
+
+    @property
+    def expired(self):
+        return self.remaining() <= DEADLINE_MARGIN
+
+    def allows(self, seconds):
+        """True if waiting this long still leaves time for another call."""
+        return self.remaining() - seconds > DEADLINE_MARGIN + MIN_CALL_TIMEOUT
+
+    def call_timeout(self, cap=None):
+        """Timeout for the next upstream call: what is left minus the margin, at most cap."""
+        timeout = max(self.remaining() - DEADLINE_MARGIN, MIN_CALL_TIMEOUT)
+        return min(timeout, cap) if cap is not None else timeout
+
+    def report(self):
+        """Budget and time spent, for the response body."""
+        spent = self.elapsed()
+        return {
+            "budget_ms": round(self.budget * 1000),
+            "spent_ms": round(spent * 1000, 1),
+            "spent_ratio": round(spent / self.budget, 3) if self.budget else None,
+            "source": self.source,
+        }
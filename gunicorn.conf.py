@@ -0,0 +1,82 @@
+"""
+Configuración de gunicorn (se carga automáticamente desde el directorio de trabajo).
+
+Los flags del Procfile (--bind, --timeout, --workers) tienen prioridad sobre
+los valores definidos aquí.
+"""
+import os
+import signal
+import time
+
+from admission import required_threads
+
+# Cargar la app una sola vez en el master (registro de tenants, patrones
+# compilados, modelos) y compartir esa memoria con los workers vía fork
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"
+
+# Hilos por worker (gthread): permite que el control de admisión encole y
+# rechace requests en lugar de dejarlos en el backlog del socket. Invariante:
+# threads >= slots en curso + colas de admisión (+ margen para health checks);
+# si no, el request de más espera un hilo libre y nunca llega a la admisión.
+# WEB_THREADS solo puede subir ese mínimo.
+threads = max(int(os.getenv("WEB_THREADS", 0)), required_threads())
+
+# Tiempo que un worker tiene para terminar sus requests tras SIGTERM
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", 30))
+
+# Dentro de la ventana de gracia se deja drenar a los runs; el resto del tiempo
+# se reserva para cancelarlos y responder antes del SIGKILL
+DRAIN_SECONDS = max(graceful_timeout - 10, 0)
+
+
+def post_fork(server, worker):
+    """Recreate per-process state (clients, connections, threads) in the worker."""
+    worker._boot_started = time.perf_counter()
+    import app
+
+    app.reset_after_fork()
+
+
+def post_worker_init(worker):
+    """Record worker boot time, start the upstream probe and chain SIGTERM handling."""
+    import app
+    import run_control
+
+    boot_ms = round((time.perf_counter() - getattr(worker, "_boot_started", time.perf_counter())) * 1000, 1)
+    app.STARTUP["worker_pid"] = os.getpid()
+    app.STARTUP["worker_boot_ms"] = boot_ms
+    worker.log.info("Worker %s listo en %s ms", os.getpid(), boot_ms)
+
+    # Probar OpenAI desde el arranque: si el hilo espera al primer /health,
+    # la primera readiness siempre sale "upstream_probe_stale"
+    app.upstream_health.ensure_started()
+
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def handle_term(signum, frame):
+        run_control.begin_shutdown(DRAIN_SECONDS)
+        if callable(previous):
+            previous(signum, frame)
+
+    signal.signal(signal.SIGTERM, handle_term)
+
+
+def worker_exit(server, worker):
+    """Cancel any run still tracked when the worker exits."""
+    import app
+    import run_control
+
+    if not run_control.inflight_count():
+        return
+    cancelled = run_control.cancel_all(app.get_client(), reason="shutdown")
+    if cancelled:
+        server.log.info("Runs cancelados al apagar el worker: %s", cancelled)
+
+
+def worker_abort(worker):
+    """SIGABRT (gunicorn timeout): best-effort cancel before dying."""
+    import app
+    import run_control
+
+    if run_control.inflight_count():
+        run_control.cancel_all(app.get_client(), reason="abort", timeout=2)
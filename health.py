@@ -0,0 +1,106 @@
+"""
+Estado de salud del servicio: liveness y readiness.
+
+La readiness se basa en datos cacheados para que los health checks de Railway
+nunca bloqueen en la red:
+- Un hilo en segundo plano prueba OpenAI cada HEALTH_PROBE_INTERVAL segundos.
+- Los endpoints registran el resultado de cada llamada upstream en una ventana
+  deslizante; si la tasa de error supera el umbral, el worker deja de estar listo.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+import metrics
+from local_state import ProcessThread
+
+PROBE_INTERVAL = float(os.getenv("HEALTH_PROBE_INTERVAL", 30))
+PROBE_TIMEOUT = float(os.getenv("HEALTH_PROBE_TIMEOUT", 5))
+PROBE_MODEL = os.getenv("HEALTH_PROBE_MODEL", "gpt-4o-mini")
+# Un probe más viejo que esto no cuenta como evidencia de que upstream responde
+PROBE_MAX_AGE = PROBE_INTERVAL * 3
+ERROR_WINDOW_SECONDS = float(os.getenv("HEALTH_ERROR_WINDOW", 60))
+ERROR_RATE_THRESHOLD = float(os.getenv("HEALTH_ERROR_RATE_THRESHOLD", 0.5))
+ERROR_MIN_SAMPLES = int(os.getenv("HEALTH_ERROR_MIN_SAMPLES", 5))
+
+
+class UpstreamHealth:
+    """Cached upstream probe plus a sliding window of call outcomes."""
+
+    def __init__(self, client_getter):
+        self._client_getter = client_getter
+        self._lock = threading.Lock()
+        self._events = deque()  # (timestamp, ok)
+        self._probe = {"ok": None, "checked_at": None, "latency_ms": None, "error": None}
+        self._thread = ProcessThread(self._probe_loop, "upstream-probe")
+
+    def ensure_started(self):
+        """Start the probe thread once per process (threads don't survive fork)."""
+        self._thread.ensure_started()
+
+    def _probe_loop(self):
+        while True:
+            self.probe_once()
+            time.sleep(PROBE_INTERVAL)
+
+    def probe_once(self):
+        """Run a cheap upstream call and cache its outcome."""
+        start = time.time()
+        try:
+            self._client_getter().models.retrieve(PROBE_MODEL, timeout=PROBE_TIMEOUT)
+            result = {"ok": True, "error": None}
+        except Exception as e:
+            metrics.incr("health.probe_failed")
+            result = {"ok": False, "error": str(e)[:200]}
+        result["checked_at"] = time.time()
+        result["latency_ms"] = int((result["checked_at"] - start) * 1000)
+        with self._lock:
+            self._probe = result
+
+    def record(self, ok):
+        """Record the outcome of a real upstream call."""
+        now = time.time()
+        with self._lock:
+            self._events.append((now, ok))
+            self._trim(now)
+
+    def _trim(self, now):
+        cutoff = now - ERROR_WINDOW_SECONDS
+        while self._events and self._events[0][0] < cutoff:
+            self._events.popleft()
+
+    def error_rate(self):
+        """Return (error_rate, samples) over the sliding window."""
+        with self._lock:
+            self._trim(time.time())
+            samples = len(self._events)
+            if not samples:
+                return 0.0, 0
+            errors = sum(1 for _, ok in self._events if not ok)
+            return errors / samples, samples
+
+    def readiness(self, saturation=None):
+        """Return (ready, details) without touching the network."""
+        with self._lock:
+            probe = dict(self._probe)
+        rate, samples = self.error_rate()
+        reasons = []
+        if probe["ok"] is False:
+            reasons.append("upstream_probe_failed")
+        elif probe["checked_at"] is None or time.time() - probe["checked_at"] > PROBE_MAX_AGE:
+            reasons.append("upstream_probe_stale")
+        if samples >= ERROR_MIN_SAMPLES and rate > ERROR_RATE_THRESHOLD:
+            reasons.append("upstream_error_rate")
+        if saturation:
+            # Solo la cola interactiva cuenta: un replay encolado no satura a los leads
+            depth = saturation.get("queue_depth_per_priority", {}).get(
+                "interactive", saturation.get("queue_depth", 0))
+            if depth >= saturation.get("max_queue", 1):
+                reasons.append("saturated")
+        return not reasons, {
+            "reasons": reasons,
+            "probe": probe,
+            "error_rate": round(rate, 3),
+            "error_samples": samples,
+        }
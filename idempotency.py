@@ -0,0 +1,186 @@
+"""
+Supresión de requests duplicados mediante claves de idempotencia.
+
+El estado vive en un archivo SQLite local para que todos los workers de
+gunicorn de la misma máquina lo compartan:
+- El primer request con una clave la reclama (estado "pending") y ejecuta el run.
+- Los duplicados que llegan mientras tanto esperan a que termine y reciben su
+  resultado. Si el dueño falla y libera la clave, el duplicado la reclama y
+  ejecuta el run él mismo.
+- Al terminar se guarda la respuesta y se reutiliza durante IDEMPOTENCY_TTL
+  segundos. Las claves derivadas del mensaje (sin header Idempotency-Key) solo
+  viven IDEMPOTENCY_DERIVED_TTL segundos: agrupan reintentos casi simultáneos,
+  pero un lead que repite "ok" o "hello?" en el mismo thread recibe un run nuevo.
+
+También guarda leases: exclusión mutua con vencimiento entre workers (p. ej.
+un turno de Messenger a la vez por remitente). Un lease de un worker muerto
+vence solo.
+"""
+import hashlib
+import os
+import threading
+import time
+
+import metrics
+from local_state import SQLiteConnections
+
+IDEMPOTENCY_DB = os.getenv("IDEMPOTENCY_DB", "/tmp/assistant_idempotency.db")
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", 300))
+DERIVED_KEY_TTL = int(os.getenv("IDEMPOTENCY_DERIVED_TTL", 5))
+# Un "pending" más viejo que esto se considera abandonado (worker muerto)
+PENDING_TIMEOUT = int(os.getenv("IDEMPOTENCY_PENDING_TIMEOUT", 120))
+POLL_INTERVAL = 0.25
+# Duplicados esperando al original a la vez, por worker: cada uno ocupa un
+# hilo de gthread (admission.required_threads los cuenta)
+MAX_WAITERS = int(os.getenv("IDEMPOTENCY_MAX_WAITERS", 8))
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS idempotency ("
+    " key TEXT PRIMARY KEY,"
+    " state TEXT NOT NULL,"
+    " body TEXT,"
+    " status_code INTEGER,"
+    " updated_at REAL NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS leases ("
+    " key TEXT PRIMARY KEY,"
+    " owner TEXT NOT NULL,"
+    " expires_at REAL NOT NULL)",
+)
+
+
+def derive_key(route, assistant_id, thread_id, message):
+    """Build a deterministic key for a message sent to an existing thread."""
+    raw = "\x1f".join([route, assistant_id or "", thread_id or "", message or ""])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class IdempotencyStore:
+    """SQLite-backed store shared by every worker on the host."""
+
+    def __init__(self, path=IDEMPOTENCY_DB, ttl=IDEMPOTENCY_TTL,
+                 pending_timeout=PENDING_TIMEOUT, max_waiters=MAX_WAITERS):
+        self.path = path
+        self.ttl = ttl
+        self.pending_timeout = pending_timeout
+        self._connections = SQLiteConnections(path, _SCHEMA, isolation_level=None)
+        self._last_purge = 0.0
+        self._waiters = threading.BoundedSemaphore(max_waiters)
+
+    def _conn(self):
+        return self._connections.get()
+
+    def claim(self, key, ttl=None):
+        """
+        Try to become the owner of a key.
+
+        ttl overrides how long a completed response is reused for this key.
+        Returns ("owner", None), ("pending", None) or ("done", (body, status_code)).
+        """
+        conn = self._conn()
+        now = time.time()
+        self._purge(now)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT state, body, status_code, updated_at FROM idempotency WHERE key = ?",
+                (key,)
+            ).fetchone()
+            if row is None or self._expired(row, now, ttl):
+                conn.execute(
+                    "INSERT OR REPLACE INTO idempotency (key, state, updated_at) "
+                    "VALUES (?, 'pending', ?)",
+                    (key, now)
+                )
+                conn.execute("COMMIT")
+                return "owner", None
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        state, body, status_code, _ = row
+        if state == "done":
+            return "done", (body, status_code)
+        return "pending", None
+
+    def wait(self, key, timeout):
+        """
+        Block until the owner finishes.
+
+        Returns ("done", (body, status_code)), ("released", None) if the owner
+        failed and dropped the key, ("pending", None) on timeout, or
+        ("busy", None) right away if MAX_WAITERS duplicates are already waiting.
+        """
+        if not self._waiters.acquire(blocking=False):
+            metrics.incr("idempotency.waiters_full")
+            return "busy", None
+        try:
+            return self._wait(key, timeout)
+        finally:
+            self._waiters.release()
+
+    def _wait(self, key, timeout):
+        deadline = time.time() + timeout
+        conn = self._conn()
+        while True:
+            row = conn.execute(
+                "SELECT state, body, status_code FROM idempotency WHERE key = ?",
+                (key,)
+            ).fetchone()
+            if row is None:
+                # El dueño falló y liberó la clave
+                return "released", None
+            if row[0] == "done":
+                return "done", (row[1], row[2])
+            if time.time() >= deadline:
+                return "pending", None
+            time.sleep(POLL_INTERVAL)
+
+    def complete(self, key, body, status_code):
+        """Store the final response for a key."""
+        self._conn().execute(
+            "UPDATE idempotency SET state = 'done', body = ?, status_code = ?, updated_at = ? "
+            "WHERE key = ?",
+            (body, status_code, time.time(), key)
+        )
+
+    def release(self, key):
+        """Drop a pending key so retries can run again."""
+        self._conn().execute(
+            "DELETE FROM idempotency WHERE key = ? AND state = 'pending'", (key,)
+        )
+
+    def acquire_lease(self, key, owner, ttl):
+        """Take an expiring lease on key; True if owner holds it afterwards."""
+        now = time.time()
+        cursor = self._conn().execute(
+            "INSERT INTO leases (key, owner, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+            "WHERE leases.expires_at < ? OR leases.owner = excluded.owner",
+            (key, owner, now + ttl, now)
+        )
+        return cursor.rowcount == 1
+
+    def release_lease(self, key, owner):
+        """Drop a lease, only if owner still holds it."""
+        self._conn().execute("DELETE FROM leases WHERE key = ? AND owner = ?", (key, owner))
+
+    def _expired(self, row, now, ttl=None):
+        state, _, _, updated_at = row
+        if state == "done":
+            limit = self.ttl if ttl is None else ttl
+        else:
+            limit = self.pending_timeout
+        return now - updated_at > limit
+
+    def _purge(self, now):
+        # Limpieza perezosa, como máximo una vez por minuto y por worker
+        if now - self._last_purge < 60:
+            return
+        self._last_purge = now
+        self._conn().execute(
+            "DELETE FROM idempotency WHERE updated_at < ?",
+            (now - max(self.ttl, self.pending_timeout),)
+        )
+        self._conn().execute("DELETE FROM leases WHERE expires_at < ?", (now,))
+        metrics.incr("idempotency.purges")
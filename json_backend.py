@@ -0,0 +1,81 @@
+"""
+Serialización JSON de la API.
+
+Si orjson está instalado, jsonify() y request.get_json() lo usan en lugar del
+módulo json de la librería estándar: serializa directo a bytes (sin pasar por
+str ni volver a codificar) y parsea el body sin decodificarlo antes. Sin
+orjson se usa el proveedor por defecto de Flask, así que es opcional.
+
+También arma respuestas NDJSON (un objeto JSON por línea) que se generan a
+medida que se leen las filas, para no construir listas grandes en memoria.
+"""
+from flask import Response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson (compact, unsorted keys)."""
+
+    sort_keys = False
+
+    def dumps(self, obj, **kwargs):
+        # Argumentos propios de json.dumps (cls, separators...) van a la librería estándar
+        if set(kwargs) - {"indent", "separators"}:
+            return super().dumps(obj, **kwargs)
+        return self.dumpb(obj, indent=kwargs.get("indent")).decode("utf-8")
+
+    def dumpb(self, obj, indent=None):
+        """Serialize straight to UTF-8 bytes."""
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option)
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(
+            self.dumpb(obj, indent=indent) + b"\n", mimetype=self.mimetype
+        )
+
+
+def install(app):
+    """Use orjson for the app when available; returns the backend name."""
+    if orjson is None:
+        return "json"
+    app.json = OrjsonProvider(app)
+    return "orjson"
+
+
+def dumpb(app, obj):
+    """Serialize one object to compact bytes with the app's provider."""
+    if isinstance(app.json, OrjsonProvider):
+        return app.json.dumpb(obj)
+    return app.json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+def ndjson_response(app, rows):
+    """Stream an iterable of dicts as NDJSON, one line per row."""
+    def generate():
+        for row in rows:
+            yield dumpb(app, row) + b"\n"
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+
+
+def wants_ndjson(request):
+    """True when the client asked for NDJSON (?format=ndjson or Accept header)."""
+    if request.args.get("format") == "ndjson":
+        return True
+    return request.accept_mimetypes.best == NDJSON_MIMETYPE
@@ -0,0 +1,92 @@
+"""
+Estado local por hilo y por proceso: conexiones SQLite, executors e hilos.
+
+Con preload_app, gunicorn carga la app en el master y crea los workers con
+fork. Ni las conexiones SQLite ni los hilos sobreviven a un fork, así que
+cada worker debe crear los suyos. Estos helpers lo hacen de forma perezosa:
+guardan el pid con el que se crearon y, si cambió, vuelven a empezar.
+"""
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class SQLiteConnections:
+    """One SQLite connection per thread, opened in WAL mode with the store's schema."""
+
+    def __init__(self, path, schema=(), pragmas=(), row_factory=None, **connect_kwargs):
+        self.path = path
+        self.schema = schema
+        self.pragmas = pragmas
+        self.row_factory = row_factory
+        self.connect_kwargs = connect_kwargs
+        self._local = threading.local()
+        self._pid = os.getpid()
+
+    def get(self):
+        """Connection for the current thread, opened on first use."""
+        if self._pid != os.getpid():
+            self.reset()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, **self.connect_kwargs)
+            conn.execute("PRAGMA journal_mode=WAL")
+            for pragma in self.pragmas:
+                conn.execute(f"PRAGMA {pragma}")
+            for statement in self.schema:
+                conn.execute(statement)
+            if self.row_factory is not None:
+                conn.row_factory = self.row_factory
+            self._local.conn = conn
+        return conn
+
+    def reset(self):
+        """Drop connections inherited from a parent process."""
+        self._pid = os.getpid()
+        self._local = threading.local()
+
+
+class ProcessExecutor:
+    """ThreadPoolExecutor created lazily, once per process."""
+
+    def __init__(self, max_workers, thread_name_prefix):
+        self.max_workers = max_workers
+        self.thread_name_prefix = thread_name_prefix
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    def get(self):
+        if self._executor is not None and self._pid == os.getpid():
+            return self._executor
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix=self.thread_name_prefix)
+        return self._executor
+
+    def submit(self, fn, *args, **kwargs):
+        return self.get().submit(fn, *args, **kwargs)
+
+
+class ProcessThread:
+    """Daemon thread started lazily, once per process."""
+
+    def __init__(self, target, name):
+        self.target = target
+        self.name = name
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self.target, name=self.name, daemon=True)
+            self._thread.start()
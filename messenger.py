@@ -0,0 +1,259 @@
+"""
+Webhook de Facebook Messenger con agrupación de mensajes seguidos.
+
+Los leads suelen mandar varios mensajes cortos seguidos ("Hi", "is this
+available?", "<post_id>"). Llamar a /chat/continue por cada uno arranca tres
+runs que compiten por el mismo thread. Aquí:
+
+- Se verifica la firma X-Hub-Signature-256 (HMAC-SHA256 con el app secret).
+- Los mensajes de cada remitente se acumulan durante una ventana corta
+  (MESSENGER_DEBOUNCE_SECONDS, reiniciada con cada mensaje y acotada por
+  MESSENGER_MAX_BATCH_SECONDS) y se unen en un solo turno.
+- Mientras un remitente tiene un turno en curso, sus mensajes nuevos esperan
+  y salen juntos en el siguiente turno: nunca hay dos runs en su thread.
+- El webhook responde 200 de inmediato; la respuesta se envía después con la
+  Send API de Graph.
+
+La ventana es por proceso: con varios workers, los mensajes de un mismo
+remitente que caigan en workers distintos forman lotes separados. Para que
+esos lotes no corran a la vez sobre el mismo thread, cada turno toma un lease
+por remitente en el SQLite compartido (IdempotencyStore); si otro worker lo
+tiene, el lote se reprograma con SenderBusy hasta que quede libre.
+"""
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+
+import metrics
+from admission import AdmissionRejected
+from local_state import ProcessExecutor
+
+MESSENGER_APP_SECRET = os.getenv("MESSENGER_APP_SECRET")
+MESSENGER_VERIFY_TOKEN = os.getenv("MESSENGER_VERIFY_TOKEN")
+MESSENGER_PAGE_ACCESS_TOKEN = os.getenv("MESSENGER_PAGE_ACCESS_TOKEN")
+# Asistente para páginas que no están en el registro de tenants
+MESSENGER_ASSISTANT_ID = os.getenv("MESSENGER_ASSISTANT_ID")
+GRAPH_SEND_URL = os.getenv("MESSENGER_GRAPH_URL", "https://graph.facebook.com/v19.0/me/messages")
+
+DEBOUNCE_SECONDS = float(os.getenv("MESSENGER_DEBOUNCE_SECONDS", 2.5))
+MAX_BATCH_SECONDS = float(os.getenv("MESSENGER_MAX_BATCH_SECONDS", 8))
+TURN_WORKERS = int(os.getenv("MESSENGER_TURN_WORKERS", 8))
+MAX_RETRIES = 3
+# Vencimiento del lease por remitente: más que un turno completo (deadline + envío)
+LEASE_TTL = float(os.getenv("MESSENGER_LEASE_TTL", 120))
+# Texto enviado cuando el asistente marca un pedido de fotos ("A"); sin
+# configurar no se responde y el pedido queda para el equipo de la página
+PHOTO_REPLY = os.getenv("MESSENGER_PHOTO_REPLY")
+SEND_TIMEOUT = 10
+# Límite de caracteres de un mensaje de texto en Messenger
+MAX_MESSAGE_CHARS = 2000
+
+
+def verify_signature(body, header, secret=None):
+    """Check X-Hub-Signature-256 against the raw request body."""
+    secret = secret or MESSENGER_APP_SECRET
+    if not secret or not header or not header.startswith("sha256="):
+        return False
+    expected = hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, header[len("sha256="):])
+
+
+def parse_events(payload):
+    """
+    Extract incoming text messages from a webhook payload.
+
+    Returns dicts with page_id, sender_id, mid and text; echoes of the page's
+    own messages and non-text events (attachments, reads) are skipped.
+    """
+    events = []
+    if payload.get("object") != "page":
+        return events
+    for entry in payload.get("entry", []):
+        for event in entry.get("messaging", []):
+            message = event.get("message") or {}
+            text = (message.get("text") or "").strip()
+            if not text or message.get("is_echo"):
+                continue
+            events.append({
+                "page_id": entry.get("id") or event.get("recipient", {}).get("id"),
+                "sender_id": event.get("sender", {}).get("id"),
+                "mid": message.get("mid"),
+                "text": text,
+            })
+    return events
+
+
+def merge_messages(texts):
+    """Join rapid-fire messages into a single user turn."""
+    return "\n".join(texts)
+
+
+def send_reply(recipient_id, text, token=None):
+    """Send a text reply through the Graph Send API, split at the size limit."""
+    token = token or MESSENGER_PAGE_ACCESS_TOKEN
+    if not token:
+        metrics.incr("messenger.reply_unconfigured")
+        return False
+    for start in range(0, len(text), MAX_MESSAGE_CHARS):
+        try:
+            response = requests.post(
+                GRAPH_SEND_URL,
+                params={"access_token": token},
+                json={
+                    "recipient": {"id": recipient_id},
+                    "messaging_type": "RESPONSE",
+                    "message": {"text": text[start:start + MAX_MESSAGE_CHARS]},
+                },
+                timeout=SEND_TIMEOUT,
+            )
+            response.raise_for_status()
+        except requests.RequestException:
+            metrics.incr("messenger.reply_failed")
+            return False
+    metrics.incr("messenger.replies")
+    return True
+
+
+class SenderBusy(Exception):
+    """Raised by handle_turn when another worker is running a turn for the sender."""
+
+    def __init__(self, retry_after=DEBOUNCE_SECONDS):
+        super().__init__("sender_busy")
+        self.retry_after = retry_after
+
+
+class _Batch:
+    __slots__ = ("texts", "first_at", "timer", "retries")
+
+    def __init__(self):
+        self.texts = []
+        self.first_at = time.monotonic()
+        self.timer = None
+        self.retries = 0
+
+
+class MessageBatcher:
+    """
+    Per-sender debounce buffer.
+
+    handle_turn(key, texts) runs on a worker thread with every message that
+    arrived during the window; at most one turn per key runs at a time. If it
+    raises SenderBusy the batch is rescheduled without counting as a retry.
+    """
+
+    def __init__(self, handle_turn, window=DEBOUNCE_SECONDS, max_wait=MAX_BATCH_SECONDS,
+                 workers=TURN_WORKERS):
+        self._handle_turn = handle_turn
+        self.window = window
+        self.max_wait = max_wait
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._pending = {}  # key -> _Batch
+        self._busy = set()
+        self._executor = ProcessExecutor(max_workers=workers, thread_name_prefix="messenger")
+
+    def add(self, key, text):
+        """Buffer a message; the turn fires once the sender stops typing."""
+        with self._lock:
+            batch = self._pending.get(key)
+            if batch is None:
+                batch = self._pending[key] = _Batch()
+            else:
+                metrics.incr("messenger.merged")
+            batch.texts.append(text)
+            # Con un turno en curso, el lote sale cuando ese turno termine
+            if key not in self._busy:
+                self._schedule(key, batch)
+
+    def _schedule(self, key, batch, delay=None):
+        if batch.timer is not None:
+            batch.timer.cancel()
+        if delay is None:
+            remaining = batch.first_at + self.max_wait - time.monotonic()
+            delay = max(0.0, min(self.window, remaining))
+        batch.timer = threading.Timer(delay, self._fire, (key,))
+        batch.timer.daemon = True
+        batch.timer.start()
+
+    def _fire(self, key):
+        with self._lock:
+            if key in self._busy or key not in self._pending:
+                return
+            batch = self._pending.pop(key)
+            self._busy.add(key)
+        self._executor.submit(self._run, key, batch)
+
+    def _run(self, key, batch):
+        retry_after, counted = None, True
+        try:
+            self._handle_turn(key, batch.texts)
+            metrics.incr("messenger.turns")
+        except SenderBusy as e:
+            # Otro worker tiene un turno de este remitente: esperar sin gastar reintentos
+            retry_after, counted = e.retry_after, False
+            metrics.incr("messenger.sender_busy")
+        except AdmissionRejected as e:
+            retry_after = e.retry_after
+        except Exception:
+            metrics.incr("messenger.turn_failed")
+        finally:
+            with self._lock:
+                self._busy.discard(key)
+                if retry_after is not None:
+                    self._requeue(key, batch, retry_after, counted)
+                following = self._pending.get(key)
+                if following is not None and following.timer is None:
+                    self._schedule(key, following)
+
+    def _requeue(self, key, batch, retry_after, counted=True):
+        # Sin capacidad: se reintenta más tarde con los mensajes originales delante
+        if counted and batch.retries >= MAX_RETRIES:
+            metrics.incr("messenger.dropped")
+            return
+        following = self._pending.get(key)
+        if following is not None:
+            if following.timer is not None:
+                following.timer.cancel()
+            batch.texts.extend(following.texts)
+        if counted:
+            batch.retries += 1
+            metrics.incr("messenger.retried")
+        self._pending[key] = batch
+        self._schedule(key, batch, delay=retry_after)
+
+    def stats(self):
+        with self._lock:
+            return {"pending_senders": len(self._pending), "active_turns": len(self._busy)}
+
+
+class SenderThreads:
+    """Bounded sender -> thread_id map with a fallback lookup (e.g. transcripts)."""
+
+    def __init__(self, lookup=None, max_size=10000):
+        self._lookup = lookup
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._threads = OrderedDict()
+
+    def get(self, lead_id):
+        with self._lock:
+            thread_id = self._threads.get(lead_id)
+            if thread_id is not None:
+                self._threads.move_to_end(lead_id)
+                return thread_id
+        thread_id = self._lookup(lead_id) if self._lookup else None
+        if thread_id is not None:
+            self.set(lead_id, thread_id)
+        return thread_id
+
+    def set(self, lead_id, thread_id):
+        with self._lock:
+            self._threads[lead_id] = thread_id
+            self._threads.move_to_end(lead_id)
+            while len(self._threads) > self.max_size:
+                self._threads.popitem(last=False)
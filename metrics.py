@@ -0,0 +1,30 @@
+"""
+Contadores de métricas en memoria del proceso.
+
+Cada worker de gunicorn mantiene sus propios contadores; se exponen vía /health.
+"""
+import threading
+from collections import defaultdict
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+
+
+def incr(name, value=1):
+    """Increment a named counter."""
+    with _lock:
+        _counters[name] += value
+
+
+def get(name):
+    """Return the current value of a counter."""
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def snapshot(prefix=None):
+    """Return a copy of all counters, optionally filtered by prefix."""
+    with _lock:
+        if prefix is None:
+            return dict(_counters)
+        return {k: v for k, v in _counters.items() if k.startswith(prefix)}
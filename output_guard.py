@@ -0,0 +1,124 @@
+"""
+Reglas de post-procesamiento aplicadas a la respuesta del asistente.
+
+Garantizan en código reglas que antes solo vivían en el prompt:
+- Nunca devolver post_ids (formato numbers_numbers), ni su etiqueta
+  ("(post ...)").
+- Si el usuario pide fotos ("send me pictures", "can I see more pics?"),
+  responder exactamente "A". Mencionar fotos sin pedirlas ("I saw the
+  pictures on marketplace", "I saw your post with pictures, is it
+  available?") no cuenta.
+- Registrar menciones prohibidas (documents, knowledge base, ...) como métricas.
+
+Todas las expresiones se compilan una sola vez al importar el módulo y son
+lineales (sin cuantificadores anidados), así que el costo por respuesta es O(n).
+"""
+import re
+
+import metrics
+
+# post_id de Facebook Marketplace: "100815996313376_364484063234800". Son dos
+# bloques largos de dígitos; "3_2" o "2024_05" no son post_ids. Se elimina
+# también la etiqueta y el paréntesis que lo envuelven ("(post 1008..._3644...)")
+_POST_ID = r'\b\d{10,20}_\d{10,20}\b'
+_POST_ID_LABEL = r'(?:\b(?:post|listing|lot property)(?:[ _]?id)?\s*[:#]?\s*)?'
+POST_ID_PATTERN = re.compile(
+    r'[(\[]\s*' + _POST_ID_LABEL + _POST_ID + r'\s*[)\]]'
+    r'|' + _POST_ID_LABEL + _POST_ID,
+    re.IGNORECASE
+)
+
+# Frases que el prompt prohíbe mencionar; se combinan en un único autómata
+FORBIDDEN_PHRASES = (
+    "knowledge base",
+    "lot property id",
+    "post_id",
+    "post id",
+    "documents",
+    "document",
+    "files",
+    "file",
+)
+FORBIDDEN_PATTERN = re.compile(
+    r'\b(?:' + '|'.join(re.escape(p) for p in FORBIDDEN_PHRASES) + r')\b',
+    re.IGNORECASE
+)
+
+# Pedidos de fotos -> el prompt exige responder "A". Cuentan formas
+# imperativas o preguntas ("send me pics", "do you have more photos?",
+# "can I see pictures?"), una pregunta que empieza por la palabra "fotos"
+# ("any pictures of lot 335?", "Got pics?", "Photos of the inside?") o la
+# palabra sola ("pictures"). Entre el verbo y la palabra "fotos" solo se
+# admiten espacios (nunca puntuación), así que "any more info? the pics look
+# great" no cuenta
+_PHOTO_WORDS = r'(?:photos?|pics?|pictures?|images?|fotos?)'
+_PHOTO_ASKS = (
+    r'send|text|email|show|share|mandar|manda|mandame|mándame|enviar|envia|'
+    r'envía|enviame|envíame|muestrame|muéstrame',
+    r'do (?:you|u) have|have (?:you|u) got|(?:you|u) got|got any|are there|'
+    r'is there|tienes|tiene|tienen|hay',
+    r'(?:can|could|may) (?:i|we) (?:see|get|have)|'
+    r'(?:like|love|want|wanna) (?:to )?see|puedo ver|quiero ver',
+)
+# Palabras que pueden abrir una pregunta antes de "fotos" ("any more pics?")
+_PHOTO_LEAD = r'(?:any|more|some|other|additional|extra|new|the|got|have|m[aá]s|hay|tienes)'
+PHOTO_REQUEST_PATTERN = re.compile(
+    r'\b(?:' + '|'.join(_PHOTO_ASKS) + r')\b(?:[ \t]+[\w\']+){0,3}?[ \t]+'
+    + _PHOTO_WORDS + r'\b'
+    r'|(?:^|[.!?,;:\n])[ \t]*(?:' + _PHOTO_LEAD + r'[ \t]+){0,2}' + _PHOTO_WORDS
+    + r'\b[^.!?,;:\n]*\?'
+    r'|^\W*(?:(?:any|more|other|additional|extra|m[aá]s)\s+)?' + _PHOTO_WORDS
+    + r'(?:\s+(?:please|pls|plz|por favor))?\W*$',
+    re.IGNORECASE
+)
+PHOTO_RESPONSE = "A"
+
+# Limpieza tras la redacción: espacios dobles y espacios antes de puntuación
+_EMPTY_BRACKETS = re.compile(r'[(\[]\s*[)\]]')
+_MULTI_SPACE = re.compile(r'[ \t]{2,}')
+_SPACE_BEFORE_PUNCT = re.compile(r' +([,.!?;:])')
+_DANGLING_PUNCT = re.compile(r'[,;:]+(?=[.!?]|$)')
+
+
+def redact_post_ids(text):
+    """Remove post_ids from the text, returning (text, count)."""
+    text, count = POST_ID_PATTERN.subn('', text)
+    if count:
+        text = _EMPTY_BRACKETS.sub('', text)
+        text = _MULTI_SPACE.sub(' ', text)
+        text = _SPACE_BEFORE_PUNCT.sub(r'\1', text)
+        text = _DANGLING_PUNCT.sub('', text)
+        text = text.strip()
+    return text, count
+
+
+def photo_requested(user_message):
+    """True if the user asks to be sent or shown photos."""
+    return bool(user_message) and PHOTO_REQUEST_PATTERN.search(user_message) is not None
+
+
+def guard_response(response, user_message):
+    """
+    Apply the output rules to an already cleaned assistant response.
+
+    Returns the response that must be sent to the client. Every rule that
+    fires is recorded in metrics under the "guard." prefix.
+    """
+    # Regla de frase exacta: pedidos de fotos se responden con "A"
+    if photo_requested(user_message):
+        if response != PHOTO_RESPONSE:
+            metrics.incr("guard.photo_rule_applied")
+        return PHOTO_RESPONSE
+
+    # Redactar post_ids que el modelo haya repetido
+    response, redacted = redact_post_ids(response)
+    if redacted:
+        metrics.incr("guard.post_id_redacted", redacted)
+
+    # Menciones prohibidas: solo se registran, reescribir prosa es arriesgado
+    violations = len(FORBIDDEN_PATTERN.findall(response))
+    if violations:
+        metrics.incr("guard.forbidden_phrase", violations)
+
+    metrics.incr("guard.checked")
+    return response
@@ -0,0 +1,434 @@
+"""
+Pipeline de ejecución de un turno de conversación.
+
+/chat y /chat/continue comparten el mismo flujo; este módulo lo implementa una
+sola vez con etapas explícitas:
+
+    pre_route -> cache_lookup -> submit -> wait -> extract -> post_process -> metrics
+
+Cada etapa admite hooks (caché, streaming, instrumentación). Un hook de
+pre_route o cache_lookup puede devolver un texto de respuesta; en ese caso se
+saltan submit/wait/extract y el texto sigue por post_process como cualquier
+respuesta del asistente.
+
+Todas las llamadas a OpenAI respetan el deadline del turno (deadline.py):
+reciben como timeout el tiempo restante y, agotado el presupuesto, el turno
+termina en 408.
+"""
+import re
+import time
+
+import metrics
+import run_control
+from deadline import REQUEST_TIMEOUT, RETRY_BACKOFF, UPSTREAM_MAX_RETRIES, Deadline
+import tracing
+from output_guard import guard_response
+
+STAGES = ("pre_route", "cache_lookup", "submit", "wait", "extract", "post_process", "metrics")
+
+# Etapas cuyos hooks pueden responder sin llamar a OpenAI
+SHORT_CIRCUIT_STAGES = ("pre_route", "cache_lookup")
+
+
+# Función para normalizar consultas
+def clean_query(text):
+    """Normalize the user query before sending it to the assistant."""
+    return re.sub(r'[^\w\s]', '', text.lower()).strip()
+
+
+# Función para limpiar la respuesta del asistente
+def clean_assistant_response(text):
+    """Clean the assistant response by removing asterisks and document references."""
+    # Eliminar referencias a documentos en formato 【...†source】 o 【...】
+    text = re.sub(r'【[^】]*】', '', text)
+    # Eliminar todos los asteriscos
+    text = text.replace('*', '')
+    # Limpiar espacios múltiples que puedan quedar
+    text = re.sub(r'\s+', ' ', text)
+    return text.strip()
+
+
+def retryable(error):
+    """Upstream errors worth retrying: rate limits, 5xx and connection failures (not timeouts)."""
+    status = getattr(error, 'status_code', None)
+    if status is not None:
+        return status == 429 or status >= 500
+    # Sin importar el SDK: APITimeoutError hereda de APIConnectionError
+    names = {cls.__name__ for cls in type(error).__mro__}
+    return "APIConnectionError" in names and "APITimeoutError" not in names
+
+
+class TurnError(Exception):
+    """A turn that ends with an error response (status code + JSON body)."""
+
+    def __init__(self, status_code, body):
+        super().__init__(body.get("error"))
+        self.status_code = status_code
+        self.body = body
+
+
+class Turn:
+    """State of a single conversation turn as it moves through the stages."""
+
+    def __init__(self, user_message, assistant_id, thread_id=None, data=None, deadline=None):
+        self.user_message = user_message
+        self.assistant_id = assistant_id
+        # thread_id enviado por el cliente (/chat/continue); None en /chat
+        self.thread_id = thread_id
+        self.data = data or {}
+        self.normalized_query = clean_query(user_message)
+        # Configuración del parque (registro de tenants)
+        self.tenant = None
+        # Presupuesto de tiempo del request, compartido por todas las etapas
+        self.deadline = deadline or Deadline(REQUEST_TIMEOUT)
+        # Parámetros extra del run (model, tools, instructions) que fija un hook
+        self.run_options = {}
+        self.run = None
+        # Thread creado sin run (p. ej. respuesta servida desde caché)
+        self.created_thread_id = None
+        self.raw_response = None
+        self.response = None
+        self.source = "assistant"
+        self.timings = {}
+        self.extras = {}
+
+    @property
+    def continuing(self):
+        return self.thread_id is not None
+
+    @property
+    def result_thread_id(self):
+        """Thread to report back: the caller's, or the one the run created."""
+        if self.continuing:
+            return self.thread_id
+        if self.run is not None:
+            return self.run.thread_id
+        return self.created_thread_id
+
+    def error(self, status_code, body):
+        """Build a TurnError, adding thread_id for /chat/continue errors."""
+        if self.continuing and status_code != 400:
+            body = dict(body, thread_id=self.thread_id)
+        return TurnError(status_code, body)
+
+
+class ConversationPipeline:
+    """Runs a turn against the Assistants API; shared by both chat endpoints."""
+
+    def __init__(self, client_getter, max_wait_time=REQUEST_TIMEOUT, poll_interval=1,
+                 abort_check=None, sleep=None):
+        self._client_getter = client_getter
+        # Presupuesto de los turnos que llegan sin deadline propio
+        self.max_wait_time = max_wait_time
+        self.poll_interval = poll_interval
+        self.abort_check = abort_check
+        self._sleep = sleep or time.sleep
+        self.hooks = {stage: [] for stage in STAGES}
+        self.error_hooks = []
+
+    @property
+    def client(self):
+        return self._client_getter()
+
+    def add_hook(self, stage, hook):
+        """Register hook(pipeline, turn) for a stage."""
+        if stage not in self.hooks:
+            raise ValueError(f"Etapa desconocida: {stage}")
+        self.hooks[stage].append(hook)
+        return hook
+
+    def on_error(self, hook):
+        """Register hook(pipeline, turn, error) for failed turns."""
+        self.error_hooks.append(hook)
+        return hook
+
+    # ------------------------------------------------------------------ #
+    # Entrada
+    # ------------------------------------------------------------------ #
+
+    def parse(self, data, require_thread=False, deadline=None):
+        """Validate the JSON payload and build a Turn (400 on bad input)."""
+        if not data:
+            raise TurnError(400, {"error": "No se proporcionaron datos en el request"})
+
+        user_message = data.get('message')
+        assistant_id = data.get('assistant_id')
+        thread_id = data.get('thread_id') if require_thread else None
+
+        # Validar parámetros requeridos
+        if not user_message:
+            raise TurnError(400, {"error": "El parámetro 'message' es requerido"})
+
+        if not assistant_id:
+            raise TurnError(400, {"error": "El parámetro 'assistant_id' es requerido"})
+
+        if require_thread and not thread_id:
+            raise TurnError(400, {
+                "error": "El parámetro 'thread_id' es requerido para continuar la conversación"
+            })
+
+        return Turn(user_message, assistant_id, thread_id, data,
+                    deadline or Deadline(self.max_wait_time))
+
+    def handle(self, get_data, require_thread=False, deadline=None):
+        """
+        Run a full turn from a payload getter; returns (body, status_code).
+
+        get_data se llama dentro del manejo de errores para que un JSON
+        inválido termine en el mismo 500 que antes.
+        """
+        turn = None
+        try:
+            turn = self.parse(get_data(), require_thread, deadline)
+            return self.execute(turn), 200
+        except TurnError as e:
+            # 408 también cuenta: un run que no termina es una falla upstream
+            if e.status_code >= 500 or e.status_code == 408:
+                self._run_error_hooks(turn, e)
+            return e.body, e.status_code
+        except Exception as e:
+            self._run_error_hooks(turn, e)
+            return {
+                "error": "Error interno del servidor",
+                "details": str(e),
+                "status": "error"
+            }, 500
+
+    def execute(self, turn):
+        """Run every stage for a parsed turn and return the success body."""
+        for stage in ("pre_route", "cache_lookup"):
+            self._timed(stage, turn)
+            if turn.response is not None:
+                break
+
+        if turn.response is None:
+            # Sin tiempo para un run (p. ej. tras esperar en admisión): no crearlo
+            if turn.deadline.expired:
+                raise self._deadline_error(turn, "submit")
+            self._timed("submit", turn, self.submit)
+            self._timed("wait", turn, self.wait)
+            self._timed("extract", turn, self.extract)
+
+        self._timed("post_process", turn, self.post_process)
+        self._timed("metrics", turn, self.record_metrics)
+
+        return {
+            "response": turn.response,
+            "normalized_query": turn.normalized_query,
+            "status": "success",
+            "thread_id": turn.result_thread_id,
+            "deadline": turn.deadline.report()
+        }
+
+    # ------------------------------------------------------------------ #
+    # Etapas
+    # ------------------------------------------------------------------ #
+
+    def submit(self, turn):
+        """Create the run: new thread for /chat, existing thread for /chat/continue."""
+        if turn.continuing:
+            # Agregar mensaje al thread existente
+            with tracing.span("openai.messages.create", **{"openai.thread_id": turn.thread_id}):
+                self.call_upstream(
+                    turn, self.client.beta.threads.messages.create,
+                    thread_id=turn.thread_id,
+                    role="user",
+                    content=turn.user_message
+                )
+            # Ejecutar el asistente en el thread existente
+            with tracing.span("openai.runs.create", **{"openai.thread_id": turn.thread_id}) as current:
+                turn.run = self.call_upstream(
+                    turn, self.client.beta.threads.runs.create,
+                    thread_id=turn.thread_id,
+                    assistant_id=turn.assistant_id,
+                    **turn.run_options
+                )
+                tracing.set_attribute(current, "openai.run_id", turn.run.id)
+        else:
+            # Crear thread y ejecutar el asistente
+            with tracing.span("openai.threads.create_and_run") as current:
+                turn.run = self.call_upstream(
+                    turn, self.client.beta.threads.create_and_run,
+                    assistant_id=turn.assistant_id,
+                    thread={
+                        "messages": [
+                            {"role": "user", "content": turn.user_message}
+                        ]
+                    },
+                    **turn.run_options
+                )
+                tracing.set_attribute(current, "openai.run_id", turn.run.id)
+                tracing.set_attribute(current, "openai.thread_id", turn.run.thread_id)
+        turn.extras["run_submitted_ns"] = time.time_ns()
+
+    def wait(self, turn):
+        """Poll the run until it leaves queued/in_progress, cancelling when abandoned."""
+        run = turn.run
+        run_control.register(run.thread_id, run.id)
+
+        try:
+            while run.status in ['queued', 'in_progress']:
+                # Verificar el deadline del request
+                if turn.deadline.expired:
+                    run_control.cancel_async(self.client, run.thread_id, run.id, "timeout")
+                    raise self._deadline_error(turn, "wait", run.status)
+
+                # Nadie va a leer la respuesta: cancelar el run
+                abort_reason = self.abort_check() if self.abort_check else None
+                if abort_reason:
+                    run_control.cancel_async(self.client, run.thread_id, run.id, abort_reason)
+                    # 503: el worker se está apagando o el cliente ya no escucha
+                    raise turn.error(503, {
+                        "error": "La ejecución fue cancelada",
+                        "details": abort_reason,
+                        "status": run.status
+                    })
+
+                self._sleep(min(self.poll_interval, turn.deadline.call_timeout()))
+                with tracing.span("openai.runs.retrieve", **{"openai.run_id": run.id}) as current:
+                    try:
+                        run = self.call_upstream(
+                            turn, self.client.beta.threads.runs.retrieve,
+                            thread_id=run.thread_id,
+                            run_id=run.id
+                        )
+                    except TurnError as e:
+                        # El deadline venció durante el retrieve: el run sigue vivo
+                        if e.status_code == 408:
+                            run_control.cancel_async(self.client, run.thread_id, run.id, "timeout")
+                        raise
+                    tracing.set_attribute(current, "openai.run_status", run.status)
+                turn.run = run
+        finally:
+            run_control.unregister(run.id)
+
+    def extract(self, turn):
+        """Fetch the latest assistant message of a completed run."""
+        run = turn.run
+        if run.status != 'completed':
+            # La ejecución falló
+            error_message = "Error desconocido"
+            if run.last_error:
+                error_message = f"{run.last_error.code}: {run.last_error.message}"
+
+            raise turn.error(500, {
+                "error": f"La ejecución falló con estado: {run.status}",
+                "details": error_message,
+                "status": "error"
+            })
+
+        run_control.record_usage(run)
+        self._trace_slow_run(turn)
+
+        # Obtener los mensajes del thread
+        with tracing.span("openai.messages.list", **{"openai.thread_id": run.thread_id}):
+            messages = self.call_upstream(turn, self.client.beta.threads.messages.list,
+                                          thread_id=run.thread_id)
+
+        # Buscar la respuesta del asistente (el mensaje más reciente)
+        for message in messages.data:
+            if message.role == "assistant":
+                for content in message.content:
+                    if hasattr(content, 'text'):
+                        turn.raw_response = content.text.value
+                        break
+                if turn.raw_response:
+                    break
+
+        if not turn.raw_response:
+            raise turn.error(500, {
+                "error": "No se pudo obtener la respuesta del asistente",
+                "status": "error"
+            })
+        turn.response = turn.raw_response
+
+    def post_process(self, turn):
+        """Clean the text and apply the output rules (post_ids, photos, ...)."""
+        cleaned_response = clean_assistant_response(turn.response)
+        turn.response = guard_response(cleaned_response, turn.user_message)
+
+    def record_metrics(self, turn):
+        """Aggregate stage timings into the process metrics."""
+        metrics.incr("pipeline.turns")
+        metrics.incr(f"pipeline.source.{turn.source}")
+        for stage, elapsed in turn.timings.items():
+            metrics.incr(f"pipeline.{stage}.ms", int(elapsed * 1000))
+
+    # ------------------------------------------------------------------ #
+    # Internos
+    # ------------------------------------------------------------------ #
+
+    def call_upstream(self, turn, call, timeout_cap=None, max_retries=UPSTREAM_MAX_RETRIES, **kwargs):
+        """
+        Call the SDK with the time left as timeout; 408 once the deadline passed.
+
+        Retryable errors are retried with backoff only while the deadline leaves
+        room for another attempt (the client itself has max_retries=0).
+        timeout_cap bounds each attempt below the remaining budget.
+        """
+        name = getattr(call, "__name__", "call")
+        attempt = 0
+        while True:
+            if turn.deadline.expired:
+                raise self._deadline_error(turn, name)
+            try:
+                return call(timeout=turn.deadline.call_timeout(timeout_cap), **kwargs)
+            except Exception as e:
+                # Un timeout del SDK (o cualquier falla) con el presupuesto agotado es un 408
+                if turn.deadline.expired:
+                    raise self._deadline_error(turn, name)
+                backoff = RETRY_BACKOFF * 2 ** attempt
+                if (attempt >= max_retries or not retryable(e)
+                        or not turn.deadline.allows(backoff)):
+                    raise
+                attempt += 1
+                metrics.incr("upstream.retries")
+                self._sleep(backoff)
+
+    @staticmethod
+    def _deadline_error(turn, stage, status="error"):
+        metrics.incr(f"deadline.exceeded.{stage}")
+        return turn.error(408, {
+            "error": "Timeout: El asistente tardó demasiado en responder",
+            "status": status,
+            "deadline": turn.deadline.report()
+        })
+
+    @staticmethod
+    def upstream_ms(turn):
+        """Time spent in the stages that call OpenAI, in milliseconds."""
+        return sum(turn.timings.get(stage, 0) for stage in ("submit", "wait", "extract")) * 1000
+
+    def _timed(self, stage, turn, func=None):
+        start = time.perf_counter()
+        try:
+            with tracing.span(f"pipeline.{stage}"):
+                if func is not None:
+                    func(turn)
+                for hook in self.hooks[stage]:
+                    result = hook(self, turn)
+                    if stage in SHORT_CIRCUIT_STAGES and result is not None:
+                        turn.response = result
+                        # El hook puede nombrar su propia fuente (p. ej. "fallback")
+                        if turn.source == "assistant":
+                            turn.source = stage
+                        break
+        finally:
+            turn.timings[stage] = time.perf_counter() - start
+
+    def _trace_slow_run(self, turn):
+        # Solo los runs lentos justifican la llamada extra a runs.steps.list,
+        # y se hace en segundo plano para no demorar messages.list
+        if not tracing.enabled():
+            return
+        submitted = turn.extras.get("run_submitted_ns")
+        if submitted is None or (time.time_ns() - submitted) / 1e6 < tracing.TRACE_SLOW_MS:
+            return
+        tracing.record_run_steps_async(self.client, turn.run.thread_id, turn.run.id, submitted)
+
+    def _run_error_hooks(self, turn, error):
+        for hook in self.error_hooks:
+            try:
+                hook(self, turn, error)
+            except Exception:
+                pass
@@ -0,0 +1,380 @@
+"""
+Reproducción de tráfico grabado (TRAFFIC_RECORD_PATH) para benchmarks.
+
+Dos partes:
+
+1. Un stub de la API de Assistants que responde con las respuestas grabadas y
+   simula los tiempos upstream grabados (submit, wait, extract). El servidor
+   bajo prueba se apunta al stub con OPENAI_BASE_URL:
+
+       python replay_traffic.py stub traffic.jsonl --port 8090
+       OPENAI_BASE_URL=http://localhost:8090/v1 OPENAI_API_KEY=stub gunicorn app:app
+
+2. El replayer, que envía los requests con los mismos intervalos de llegada
+   (1x), acelerados (Nx) o tan rápido como permita la concurrencia (max):
+
+       python replay_traffic.py replay traffic.jsonl --target http://localhost:5000 --speed 4
+       python replay_traffic.py replay traffic.jsonl --speed max --concurrency 64
+
+Los /chat/continue esperan a que termine el request anterior del mismo thread
+y usan el thread_id real que devolvió el servidor. Si la grabación empieza a
+mitad de una conversación, su primer mensaje se envía como /chat.
+"""
+import argparse
+import itertools
+import json
+import statistics
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from flask import Flask, jsonify, request
+
+import traffic
+
+DEFAULT_RESPONSE = ("That detail can be confirmed with the park manager. "
+                    "Would you like me to help schedule a showing so you can ask directly?")
+
+
+# ---------------------------------------------------------------------- #
+# Stub upstream
+# ---------------------------------------------------------------------- #
+
+class RecordedUpstream:
+    """In-memory Assistants API that replays recorded answers and timings."""
+
+    def __init__(self, entries, latency_scale=1.0):
+        self.latency_scale = latency_scale
+        self._answers = defaultdict(list)
+        for entry in entries:
+            if entry.get("upstream_ms") and entry.get("message"):
+                self._answers[entry["message"]].append(entry)
+        self._cursor = defaultdict(int)
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.threads = {}  # thread_id -> [message]
+        self.runs = {}     # run_id -> run state
+
+    def _id(self, prefix):
+        return f"{prefix}_stub{next(self._ids)}"
+
+    def _sleep(self, entry, stage):
+        if entry is not None:
+            time.sleep(entry["upstream_ms"].get(stage, 0) / 1000 * self.latency_scale)
+
+    def _lookup(self, message):
+        # Las repeticiones de un mismo mensaje rotan entre sus respuestas grabadas
+        with self._lock:
+            options = self._answers.get(message)
+            if not options:
+                return None
+            index = self._cursor[message] % len(options)
+            self._cursor[message] += 1
+            return options[index]
+
+    def add_message(self, thread_id, role, content):
+        message = {
+            "id": self._id("msg"),
+            "object": "thread.message",
+            "created_at": int(time.time()),
+            "thread_id": thread_id,
+            "role": role,
+            "content": [{"type": "text", "text": {"value": content, "annotations": []}}],
+        }
+        self.threads.setdefault(thread_id, []).append(message)
+        return message
+
+    def create_thread(self, messages=()):
+        thread_id = self._id("thread")
+        self.threads[thread_id] = []
+        for message in messages:
+            self.add_message(thread_id, message.get("role", "user"), message.get("content", ""))
+        return {"id": thread_id, "object": "thread", "created_at": int(time.time()), "metadata": {}}
+
+    def start_run(self, thread_id, assistant_id, model=None):
+        user_messages = [m for m in self.threads.get(thread_id, []) if m["role"] == "user"]
+        message = user_messages[-1]["content"][0]["text"]["value"] if user_messages else ""
+        entry = self._lookup(message)
+        self._sleep(entry, "submit")
+        wait = entry["upstream_ms"].get("wait", 0) / 1000 * self.latency_scale if entry else 0
+        run = {
+            "id": self._id("run"),
+            "object": "thread.run",
+            "created_at": int(time.time()),
+            "thread_id": thread_id,
+            "assistant_id": assistant_id,
+            "model": model or "gpt-4o-mini",
+            "status": "queued",
+            "last_error": None,
+            "usage": None,
+            "_ready_at": time.time() + wait,
+            "_entry": entry,
+        }
+        self.runs[run["id"]] = run
+        return self.public(run)
+
+    def poll(self, run_id):
+        run = self.runs[run_id]
+        if run["status"] in ("queued", "in_progress"):
+            if time.time() < run["_ready_at"]:
+                run["status"] = "in_progress"
+            else:
+                entry = run["_entry"]
+                if entry is not None and entry["status"] >= 500:
+                    run["status"] = "failed"
+                    run["last_error"] = {"code": "server_error", "message": "recorded failure"}
+                else:
+                    run["status"] = "completed"
+                    run["usage"] = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+                    answer = entry["response"] if entry is not None else DEFAULT_RESPONSE
+                    self.add_message(run["thread_id"], "assistant", answer or DEFAULT_RESPONSE)
+        return self.public(run)
+
+    def cancel(self, run_id):
+        run = self.runs[run_id]
+        run["status"] = "cancelled"
+        return self.public(run)
+
+    def list_messages(self, thread_id):
+        messages = list(reversed(self.threads.get(thread_id, [])))
+        # El tiempo de extract se simula con el último run completado del thread
+        last = next((r for r in reversed(list(self.runs.values()))
+                     if r["thread_id"] == thread_id and r["status"] == "completed"), None)
+        if last is not None:
+            self._sleep(last["_entry"], "extract")
+        return {"object": "list", "data": messages, "has_more": False,
+                "first_id": messages[0]["id"] if messages else None,
+                "last_id": messages[-1]["id"] if messages else None}
+
+    @staticmethod
+    def public(run):
+        return {k: v for k, v in run.items() if not k.startswith("_")}
+
+
+def build_stub(upstream):
+    """Flask app exposing the subset of /v1 used by the pipeline."""
+    stub = Flask("upstream_stub")
+
+    @stub.route('/v1/threads', methods=['POST'])
+    def create_thread():
+        data = request.get_json(silent=True) or {}
+        return jsonify(upstream.create_thread(data.get("messages", [])))
+
+    @stub.route('/v1/threads/runs', methods=['POST'])
+    def create_and_run():
+        data = request.get_json()
+        thread = upstream.create_thread(data.get("thread", {}).get("messages", []))
+        return jsonify(upstream.start_run(thread["id"], data["assistant_id"], data.get("model")))
+
+    @stub.route('/v1/threads/<thread_id>/messages', methods=['POST'])
+    def create_message(thread_id):
+        data = request.get_json()
+        return jsonify(upstream.add_message(thread_id, data.get("role", "user"), data.get("content", "")))
+
+    @stub.route('/v1/threads/<thread_id>/messages', methods=['GET'])
+    def list_messages(thread_id):
+        return jsonify(upstream.list_messages(thread_id))
+
+    @stub.route('/v1/threads/<thread_id>/runs', methods=['POST'])
+    def create_run(thread_id):
+        data = request.get_json()
+        return jsonify(upstream.start_run(thread_id, data["assistant_id"], data.get("model")))
+
+    @stub.route('/v1/threads/<thread_id>/runs/<run_id>', methods=['GET'])
+    def retrieve_run(thread_id, run_id):
+        return jsonify(upstream.poll(run_id))
+
+    @stub.route('/v1/threads/<thread_id>/runs/<run_id>/cancel', methods=['POST'])
+    def cancel_run(thread_id, run_id):
+        return jsonify(upstream.cancel(run_id))
+
+    @stub.route('/v1/threads/<thread_id>/runs/<run_id>/steps', methods=['GET'])
+    def run_steps(thread_id, run_id):
+        return jsonify({"object": "list", "data": [], "has_more": False,
+                        "first_id": None, "last_id": None})
+
+    @stub.route('/v1/models/<path:model>', methods=['GET'])
+    def retrieve_model(model):
+        return jsonify({"id": model, "object": "model", "created": 0, "owned_by": "stub"})
+
+    return stub
+
+
+# ---------------------------------------------------------------------- #
+# Replayer
+# ---------------------------------------------------------------------- #
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * pct / 100))], 1)
+
+
+def _summary(latencies):
+    return {
+        "count": len(latencies),
+        "p50_ms": _percentile(latencies, 50),
+        "p95_ms": _percentile(latencies, 95),
+        "p99_ms": _percentile(latencies, 99),
+        "mean_ms": round(statistics.mean(latencies), 1) if latencies else None,
+    }
+
+
+class Replayer:
+    """Sends recorded requests to a target preserving arrival gaps and thread order."""
+
+    def __init__(self, entries, target, speed=1.0, concurrency=32, timeout=120, assistant_id=None):
+        self.entries = entries
+        self.target = target.rstrip("/")
+        self.speed = speed
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.assistant_id = assistant_id
+        self.session = requests.Session()
+        self.session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+        self._live_threads = {}  # thread grabado -> thread real
+        self._results = []
+        self._lock = threading.Lock()
+
+    def run(self):
+        known = {e["result_thread"] for e in self.entries
+                 if e.get("result_thread") and not e["path"].endswith("/continue")}
+        started = set()
+        last = {}  # thread grabado -> future del request anterior
+        start = time.perf_counter()
+        base = self.entries[0]["ts"] if self.entries else 0
+        lags = []
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for entry in self.entries:
+                if self.speed != float("inf"):
+                    due = (entry["ts"] - base) / self.speed
+                    delay = due - (time.perf_counter() - start)
+                    if delay > 0:
+                        time.sleep(delay)
+                    lags.append(max(0.0, -delay) * 1000)
+                thread = entry.get("thread") if entry["path"].endswith("/continue") else None
+                # Un continue de un thread que empezó antes de la grabación se envía como /chat
+                as_new = thread is not None and thread not in known and thread not in started
+                if thread is not None:
+                    started.add(thread)
+                key = thread or entry.get("result_thread")
+                previous = last.get(thread) if thread else None
+                future = executor.submit(self._send, entry, previous, as_new)
+                if key:
+                    last[key] = future
+        elapsed = time.perf_counter() - start
+        return self._report(elapsed, lags)
+
+    def _send(self, entry, previous, as_new):
+        if previous is not None:
+            try:
+                previous.result()
+            except Exception:
+                pass
+        thread = entry.get("thread")
+        payload = {
+            "message": entry["message"],
+            "assistant_id": self.assistant_id or entry["assistant_id"],
+        }
+        for field, value in (("lead_id", entry.get("lead")), ("priority", entry.get("priority"))):
+            if value:
+                payload[field] = value
+        path = entry["path"]
+        if path.endswith("/continue"):
+            live = self._live_threads.get(thread)
+            if live is None or as_new:
+                path = "/chat"
+            else:
+                payload["thread_id"] = live
+
+        start = time.perf_counter()
+        try:
+            response = self.session.post(self.target + path, json=payload, timeout=self.timeout)
+            status = response.status_code
+            body = response.json() if response.content else {}
+        except (requests.RequestException, ValueError):
+            status, body = 0, {}
+        latency = (time.perf_counter() - start) * 1000
+
+        if status == 200 and body.get("thread_id"):
+            recorded_thread = thread or entry.get("result_thread")
+            if recorded_thread:
+                with self._lock:
+                    self._live_threads[recorded_thread] = body["thread_id"]
+        with self._lock:
+            self._results.append({
+                "path": entry["path"], "status": status, "latency_ms": latency,
+                "recorded_status": entry.get("status"), "recorded_latency_ms": entry.get("latency_ms"),
+            })
+
+    def _report(self, elapsed, lags):
+        results = self._results
+        by_path = defaultdict(list)
+        for r in results:
+            if r["status"] == 200:
+                by_path[r["path"]].append(r["latency_ms"])
+        recorded = [r["recorded_latency_ms"] for r in results
+                    if r["recorded_status"] == 200 and r["recorded_latency_ms"] is not None]
+        return {
+            "requests": len(results),
+            "elapsed_s": round(elapsed, 2),
+            "throughput_rps": round(len(results) / elapsed, 2) if elapsed else None,
+            "status": dict(Counter(r["status"] for r in results)),
+            "latency": {path: _summary(values) for path, values in by_path.items()},
+            "recorded_latency": _summary(recorded),
+            "schedule_lag_p95_ms": _percentile(lags, 95),
+        }
+
+
+def _speed(value):
+    if value == "max":
+        return float("inf")
+    value = float(value.rstrip("x"))
+    if value <= 0:
+        raise argparse.ArgumentTypeError("La velocidad debe ser mayor que 0")
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reproducir tráfico grabado")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    stub_parser = commands.add_parser("stub", help="Levantar el upstream simulado")
+    stub_parser.add_argument("recording")
+    stub_parser.add_argument("--port", type=int, default=8090)
+    stub_parser.add_argument("--latency-scale", type=float, default=1.0,
+                             help="Multiplicador de los tiempos upstream grabados")
+
+    replay_parser = commands.add_parser("replay", help="Enviar el tráfico al servidor")
+    replay_parser.add_argument("recording")
+    replay_parser.add_argument("--target", default="http://localhost:5000")
+    replay_parser.add_argument("--speed", type=_speed, default=1.0, help="1, 4, 10x o max")
+    replay_parser.add_argument("--concurrency", type=int, default=32)
+    replay_parser.add_argument("--assistant-id", help="Forzar un assistant_id en todos los requests")
+    replay_parser.add_argument("--limit", type=int, help="Reproducir solo los primeros N requests")
+
+    args = parser.parse_args()
+    entries = traffic.load(args.recording)
+    if args.command == "stub":
+        print(f"🧪 Stub upstream con {len(entries)} respuestas grabadas en http://0.0.0.0:{args.port}/v1")
+        build_stub(RecordedUpstream(entries, args.latency_scale)).run(
+            host="0.0.0.0", port=args.port, threaded=True, load_dotenv=False)
+        return
+
+    if args.limit:
+        entries = entries[:args.limit]
+    if not entries:
+        print("❌ La grabación está vacía")
+        sys.exit(1)
+    print(f"▶️  Reproduciendo {len(entries)} requests a {args.target} (velocidad {args.speed})")
+    report = Replayer(entries, args.target, args.speed, args.concurrency,
+                      assistant_id=args.assistant_id).run()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
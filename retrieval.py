@@ -0,0 +1,234 @@
+"""
+Inspección de los resultados de file_search de cada run.
+
+El score_threshold (0.35) y el ranker de create_rag_optimized_assistant.py se
+ajustaron a mano sin ver qué chunks devolvía file_search ni cuánto tardaba.
+Con RETRIEVAL_INSPECTION_ENABLED activo, después de cada run completado se
+piden sus pasos (runs.steps.list con el contenido de los resultados incluido)
+en un hilo en segundo plano y se guardan:
+
+- los archivos recuperados (file_id, nombre, score y texto del chunk),
+- las ranking_options que aplicó OpenAI,
+- la duración de cada paso del run y del paso de file_search.
+
+Los resultados se guardan en un SQLite por (assistant_id, query normalizado),
+el último run pisa al anterior. Con eso se puede reevaluar offline otro
+umbral sin volver a llamar a OpenAI:
+
+    python retrieval.py --threshold 0.5
+    python retrieval.py --export retrieval.jsonl
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import time
+
+import metrics
+from local_state import ProcessExecutor, SQLiteConnections
+
+RETRIEVAL_INSPECTION_ENABLED = os.getenv("RETRIEVAL_INSPECTION_ENABLED", "false").lower() == "true"
+# Fracción de runs inspeccionados: cada inspección cuesta una llamada extra
+RETRIEVAL_SAMPLE_RATIO = float(os.getenv("RETRIEVAL_SAMPLE_RATIO", 1.0))
+RETRIEVAL_DB = os.getenv("RETRIEVAL_DB", "retrieval.db")
+
+STEPS_INCLUDE = ["step_details.tool_calls[*].file_search.results[*].content"]
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS retrievals ("
+    " assistant_id TEXT NOT NULL,"
+    " normalized_query TEXT NOT NULL,"
+    " thread_id TEXT,"
+    " run_id TEXT,"
+    " updated_at REAL NOT NULL,"
+    " seen INTEGER NOT NULL DEFAULT 1,"
+    " file_search_ms INTEGER,"
+    " ranking_options TEXT,"
+    " results TEXT,"
+    " steps TEXT,"
+    " PRIMARY KEY (assistant_id, normalized_query))",
+)
+
+_JSON_COLUMNS = ("ranking_options", "results", "steps")
+
+
+def _duration_ms(step):
+    start = getattr(step, 'created_at', None)
+    end = getattr(step, 'completed_at', None) or getattr(step, 'failed_at', None)
+    if not start or not end:
+        return None
+    return int((end - start) * 1000)
+
+
+def extract_retrieval(steps):
+    """Summarize run steps: per-step durations, ranking options and file_search results."""
+    summary = {"steps": [], "file_search_ms": None, "ranking_options": None, "results": []}
+    for step in steps:
+        details = getattr(step, 'step_details', None)
+        duration = _duration_ms(step)
+        summary["steps"].append({
+            "step_id": step.id,
+            "type": getattr(details, 'type', None) or getattr(step, 'type', None),
+            "status": getattr(step, 'status', None),
+            "duration_ms": duration,
+        })
+        for call in getattr(details, 'tool_calls', None) or []:
+            if getattr(call, 'type', None) != "file_search":
+                continue
+            if duration is not None:
+                summary["file_search_ms"] = (summary["file_search_ms"] or 0) + duration
+            file_search = call.file_search
+            options = getattr(file_search, 'ranking_options', None)
+            if options is not None:
+                summary["ranking_options"] = {
+                    "ranker": options.ranker,
+                    "score_threshold": options.score_threshold,
+                }
+            for result in getattr(file_search, 'results', None) or []:
+                text = "".join(c.text or "" for c in result.content or [])
+                summary["results"].append({
+                    "file_id": result.file_id,
+                    "file_name": result.file_name,
+                    "score": result.score,
+                    "text": text or None,
+                })
+    # Los pasos llegan del más nuevo al más viejo
+    summary["steps"].reverse()
+    return summary
+
+
+class RetrievalInspector:
+    """Fetches run steps in the background and caches file_search results per query."""
+
+    def __init__(self, client_getter, path=RETRIEVAL_DB, sample_ratio=RETRIEVAL_SAMPLE_RATIO):
+        self._client_getter = client_getter
+        self.path = path
+        self.sample_ratio = sample_ratio
+        self._connections = SQLiteConnections(path, _SCHEMA, row_factory=sqlite3.Row)
+        self._executor = ProcessExecutor(max_workers=1, thread_name_prefix="retrieval")
+
+    def _conn(self):
+        return self._connections.get()
+
+    def inspect(self, assistant_id, normalized_query, thread_id, run_id):
+        """Schedule the inspection of a completed run; never blocks the request."""
+        if random.random() >= self.sample_ratio:
+            return None
+        return self._executor.submit(
+            self._inspect, assistant_id, normalized_query, thread_id, run_id
+        )
+
+    def _inspect(self, assistant_id, normalized_query, thread_id, run_id):
+        try:
+            steps = self._client_getter().beta.threads.runs.steps.list(
+                run_id=run_id, thread_id=thread_id, include=STEPS_INCLUDE
+            )
+            summary = extract_retrieval(steps.data)
+            self.store(assistant_id, normalized_query, thread_id, run_id, summary)
+        except Exception:
+            metrics.incr("retrieval.inspect_failed")
+            return None
+        metrics.incr("retrieval.inspected")
+        metrics.incr("retrieval.results", len(summary["results"]))
+        if summary["file_search_ms"] is not None:
+            metrics.incr("retrieval.file_search.ms", summary["file_search_ms"])
+        return summary
+
+    def store(self, assistant_id, normalized_query, thread_id, run_id, summary):
+        """Upsert the latest retrieval for a query."""
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT INTO retrievals (assistant_id, normalized_query, thread_id, run_id,"
+                " updated_at, file_search_ms, ranking_options, results, steps)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (assistant_id, normalized_query) DO UPDATE SET"
+                " thread_id = excluded.thread_id, run_id = excluded.run_id,"
+                " updated_at = excluded.updated_at, seen = seen + 1,"
+                " file_search_ms = excluded.file_search_ms,"
+                " ranking_options = excluded.ranking_options,"
+                " results = excluded.results, steps = excluded.steps",
+                (assistant_id, normalized_query, thread_id, run_id, time.time(),
+                 summary["file_search_ms"], json.dumps(summary["ranking_options"]),
+                 json.dumps(summary["results"]), json.dumps(summary["steps"]))
+            )
+
+    def get(self, assistant_id, normalized_query):
+        """Return the cached retrieval for a query, or None."""
+        row = self._conn().execute(
+            "SELECT * FROM retrievals WHERE assistant_id = ? AND normalized_query = ?",
+            (assistant_id, normalized_query)
+        ).fetchone()
+        return self._decode(row) if row is not None else None
+
+    def iter_cached(self, assistant_id=None):
+        """Yield every cached retrieval, optionally for a single assistant."""
+        sql, params = "SELECT * FROM retrievals", []
+        if assistant_id:
+            sql += " WHERE assistant_id = ?"
+            params.append(assistant_id)
+        for row in self._conn().execute(sql + " ORDER BY normalized_query", params):
+            yield self._decode(row)
+
+    def _decode(self, row):
+        record = dict(row)
+        for column in _JSON_COLUMNS:
+            if record[column]:
+                record[column] = json.loads(record[column])
+        return record
+
+
+def replay(records, threshold):
+    """
+    Re-apply a score threshold to cached results offline.
+
+    Only meaningful for thresholds at or above the one used when recording:
+    chunks below the original threshold were never returned.
+    """
+    queries = 0
+    kept_total = 0
+    empty = []
+    files = {}
+    for record in records:
+        queries += 1
+        kept = [r for r in record["results"] or [] if r["score"] >= threshold]
+        kept_total += len(kept)
+        if not kept:
+            empty.append(record["normalized_query"])
+        for result in kept:
+            files[result["file_name"]] = files.get(result["file_name"], 0) + 1
+    return {
+        "threshold": threshold,
+        "queries": queries,
+        "avg_results": round(kept_total / queries, 2) if queries else 0,
+        "queries_without_results": empty,
+        "results_per_file": dict(sorted(files.items(), key=lambda item: -item[1])),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analizar resultados de file_search guardados")
+    parser.add_argument("--db", default=RETRIEVAL_DB)
+    parser.add_argument("--assistant-id")
+    parser.add_argument("--threshold", type=float, action="append",
+                        help="Umbral a evaluar (se puede repetir)")
+    parser.add_argument("--export", help="Escribir los resultados guardados como JSONL")
+    args = parser.parse_args()
+
+    inspector = RetrievalInspector(client_getter=None, path=args.db)
+    records = list(inspector.iter_cached(args.assistant_id))
+    print(f"📚 {len(records)} queries con resultados guardados")
+
+    if args.export:
+        with open(args.export, "w", encoding="utf-8") as out:
+            for record in records:
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        print(f"✅ Exportado a {args.export}")
+
+    for threshold in args.threshold or []:
+        print(json.dumps(replay(records, threshold), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""
+Enrutamiento de turnos triviales a una configuración más barata.
+
+Todos los turnos corren en el asistente con gpt-4o-mini y file_search, incluso
+"Hi", "no thanks" o un número de teléfono para agendar una visita, que no
+necesitan buscar nada. Un clasificador local por reglas (sobre la salida de
+clean_query y el estado de la conversación) decide la ruta:
+
+- "fast": saludos, agradecimientos/cierres y, en conversaciones ya iniciadas,
+  datos de contacto u horarios para la visita. Un "ok"/"great" a mitad de
+  conversación solo va a "fast" si la respuesta anterior del asistente fue una
+  despedida; si ofreció horarios o hizo una pregunta, el "ok" es una respuesta
+  que necesita el asistente completo. El run se crea con un modelo
+  más rápido (ROUTING_FAST_MODEL), sin herramientas y con instrucciones cortas.
+- "full": todo lo demás, con el asistente completo.
+
+Ante la duda se elige "full": cualquier palabra de inventario o reglas
+(lot, rent, pets...) o un post_id manda el turno al asistente completo.
+
+MODEL_ROUTING controla el modo:
+- off (por defecto): no clasifica.
+- shadow: clasifica y registra la decisión, pero todo corre en "full".
+- on: aplica la decisión.
+
+Cada turno con run se registra en ROUTING_LOG (JSON por línea) con la ruta,
+el motivo, la latencia, los tokens y el costo estimado.
+"""
+import json
+import os
+import re
+import time
+
+import metrics
+
+MODEL_ROUTING = os.getenv("MODEL_ROUTING", "off").lower()
+FAST_MODEL = os.getenv("ROUTING_FAST_MODEL", "gpt-4.1-nano")
+ROUTING_LOG = os.getenv("ROUTING_LOG", "routing.jsonl")
+# Más palabras que esto ya no es un saludo ni un dato suelto
+MAX_FAST_WORDS = 10
+
+FAST = "fast"
+FULL = "full"
+
+FAST_INSTRUCTIONS = """You are Christina, a sales assistant for a mobile home park.
+The user sent small talk or a reply to schedule a showing. Answer in one or two short, friendly sentences, in the user's language, without asterisks or lists.
+Never state prices, availability, lot details or community rules. If the user asks about them, say you will check that for them.
+If the user shares a phone number, an email or a time for a showing, thank them and say the park manager will reach out to confirm."""
+
+# Precio por millón de tokens (entrada, salida) en USD
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4.1-nano": (0.10, 0.40),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4o": (2.50, 10.00),
+}
+
+_GREETINGS = {"hi", "hello", "hey", "hola", "good morning", "good afternoon",
+              "good evening", "buenos dias", "buenas tardes", "buenas noches", "buenas"}
+_ACKNOWLEDGEMENTS = {
+    "thanks", "thank you", "thank you so much", "thanks so much", "thx", "ty",
+    "ok thanks", "ok thank you", "okay thanks", "okay thank you", "no thanks",
+    "no thank you", "bye", "goodbye", "got it", "sounds good", "perfect", "great",
+    "awesome", "cool", "ok", "okay", "gracias", "muchas gracias", "ok gracias",
+}
+# Palabras que pueden acompañar a un saludo o agradecimiento sin cambiar la ruta
+_FILLER = {"there", "christina", "again", "everyone", "maam", "sir", "and", "so", "much",
+           "very", "you", "a", "lot", "for", "the", "help", "info", "information"}
+# Cualquiera de estas palabras necesita el inventario o el reglamento
+_RETRIEVAL_WORDS = {
+    "lot", "lots", "home", "homes", "house", "houses", "trailer", "unit", "rent",
+    "renting", "price", "prices", "cost", "costs", "much", "available", "availability",
+    "bed", "beds", "bedroom", "bedrooms", "bath", "baths", "bathroom", "bathrooms",
+    "pet", "pets", "dog", "dogs", "cat", "cats", "deposit", "application", "apply",
+    "section", "fence", "fencing", "rules", "utilities", "water", "sqft", "size",
+    "address", "where", "own", "sale", "buy", "contract", "photo", "photos",
+    "picture", "pictures", "still", "move", "lease", "credit", "income", "park",
+}
+_POST_ID = re.compile(r'\d+_\d+')
+_PHONE = re.compile(r'(?:\d\D?){10,11}')
+_EMAIL = re.compile(r'[\w.+-]+@[\w-]+\.[\w.]+')
+_TIME = re.compile(
+    r'\b(?:today|tomorrow|tonight|morning|afternoon|evening|weekend|'
+    r'monday|tuesday|wednesday|thursday|friday|saturday|sunday|'
+    r'\d{1,4} ?(?:am|pm))\b'
+)
+
+
+# Marcas de una respuesta del asistente que cierra la conversación
+_CLOSING_MARKERS = (
+    "youre welcome", "you are welcome", "have a great", "have a nice", "have a good",
+    "take care", "anytime", "glad i could help", "happy to help", "park manager will",
+    "will reach out", "will contact you", "will be in touch", "talk soon", "see you",
+    "goodbye", "bye", "de nada", "que tengas", "hasta luego",
+)
+
+
+def is_closing(assistant_response):
+    """True if the assistant's reply says goodbye without asking or offering anything."""
+    if not assistant_response or "?" in assistant_response:
+        return False
+    text = re.sub(r'[^\w\s]', '', assistant_response.lower())
+    return any(re.search(r'\b' + marker + r'\b', text) for marker in _CLOSING_MARKERS)
+
+
+def _matches(words, phrases):
+    """True if the words are one of the phrases followed only by filler words."""
+    while words:
+        if " ".join(words) in phrases:
+            return True
+        if words[-1] not in _FILLER:
+            return False
+        words = words[:-1]
+    return False
+
+
+def classify(normalized_query, user_message="", continuing=False, previous_response=None):
+    """
+    Return (route, reason) for a turn using local rules only.
+
+    previous_response is the assistant's last reply in the thread (None if
+    unknown); mid-conversation acknowledgements only go fast after a closing.
+    """
+    if not normalized_query:
+        return FULL, "empty"
+    if _POST_ID.search(normalized_query):
+        return FULL, "post_id"
+    words = normalized_query.split()
+    if len(words) > MAX_FAST_WORDS:
+        return FULL, "long"
+
+    # Saludos y cierres solo si no hay nada más que relleno ("hi there", "thanks a lot")
+    if _matches(words, _GREETINGS):
+        return FAST, "greeting"
+    if _matches(words, _ACKNOWLEDGEMENTS):
+        if continuing and not is_closing(previous_response):
+            return FULL, "acknowledgement_open"
+        return FAST, "acknowledgement"
+
+    if _RETRIEVAL_WORDS.intersection(words):
+        return FULL, "retrieval_words"
+    # Datos para agendar: solo tienen sentido con una conversación en curso
+    if continuing:
+        if _PHONE.search(normalized_query) or _EMAIL.search(user_message or ""):
+            return FAST, "contact"
+        if _TIME.search(normalized_query):
+            return FAST, "schedule"
+    return FULL, "default"
+
+
+def fast_run_options():
+    """Per-run overrides for the fast route: cheaper model, no tools, short prompt."""
+    return {"model": FAST_MODEL, "tools": [], "instructions": FAST_INSTRUCTIONS}
+
+
+def estimate_cost(model, usage):
+    """Estimated USD cost of a run from its token usage, or None if unknown."""
+    if not usage or not model:
+        return None
+    prices = MODEL_PRICES.get(model)
+    if prices is None:
+        # Los snapshots (gpt-4o-mini-2024-07-18) cobran como su modelo base
+        prices = next((p for name, p in MODEL_PRICES.items() if model.startswith(name + "-")), None)
+    if prices is None:
+        return None
+    prompt = getattr(usage, 'prompt_tokens', 0) or 0
+    completion = getattr(usage, 'completion_tokens', 0) or 0
+    return (prompt * prices[0] + completion * prices[1]) / 1e6
+
+
+class ModelRouter:
+    """Applies the classifier to turns and logs each decision with its cost."""
+
+    def __init__(self, mode=MODEL_ROUTING, log_path=ROUTING_LOG, last_reply=None):
+        self.mode = mode if mode in ("off", "shadow", "on") else "off"
+        self.log_path = log_path
+        # last_reply(thread_id) -> última respuesta del asistente en el thread, o None
+        self._last_reply = last_reply
+
+    @property
+    def enabled(self):
+        return self.mode != "off"
+
+    def route(self, turn):
+        """Classify a turn and, in "on" mode, set the fast run overrides."""
+        if not self.enabled:
+            return None
+        start = time.perf_counter()
+        previous = None
+        if turn.continuing and self._last_reply is not None:
+            previous = self._last_reply(turn.thread_id)
+        route, reason = classify(turn.normalized_query, turn.user_message, turn.continuing,
+                                 previous)
+        turn.extras["route"] = {
+            "route": route,
+            "reason": reason,
+            "applied": self.mode == "on",
+            "classify_us": round((time.perf_counter() - start) * 1e6, 1),
+        }
+        if route == FAST and self.mode == "on":
+            turn.run_options.update(fast_run_options())
+        metrics.incr(f"routing.{route}")
+        return route
+
+    def record(self, turn):
+        """Log the routing decision of a completed run with its latency and cost."""
+        decision = turn.extras.get("route")
+        if decision is None or turn.run is None:
+            return
+        run = turn.run
+        usage = getattr(run, 'usage', None)
+        model = getattr(run, 'model', None) or turn.run_options.get("model")
+        cost = estimate_cost(model, usage)
+        latency_ms = int(sum(turn.timings.get(stage, 0) for stage in ("submit", "wait", "extract")) * 1000)
+        served = decision["route"] if decision["applied"] else FULL
+        metrics.incr(f"routing.{served}.ms", latency_ms)
+        if cost is not None:
+            metrics.incr(f"routing.{served}.cost_microusd", int(cost * 1e6))
+        if not self.log_path:
+            return
+        line = json.dumps({
+            "ts": time.time(),
+            "assistant_id": turn.assistant_id,
+            "run_id": run.id,
+            "query": turn.normalized_query,
+            **decision,
+            "model": model,
+            "latency_ms": latency_ms,
+            "prompt_tokens": getattr(usage, 'prompt_tokens', None) if usage else None,
+            "completion_tokens": getattr(usage, 'completion_tokens', None) if usage else None,
+            "cost_usd": round(cost, 6) if cost is not None else None,
+        }, ensure_ascii=False)
+        try:
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except OSError:
+            metrics.incr("routing.log_failed")
@@ -0,0 +1,125 @@
+"""
+Control de runs en curso: registro, cancelación y apagado ordenado.
+
+Cuando el request deja de esperar (timeout, cliente desconectado o apagado del
+worker) el run sigue consumiendo tokens en OpenAI. Aquí se cancela en segundo
+plano con runs.cancel para no bloquear la respuesta.
+"""
+import socket
+import threading
+import time
+
+import metrics
+from local_state import ProcessExecutor
+
+_lock = threading.Lock()
+_inflight = {}  # run_id -> thread_id
+_executor = ProcessExecutor(max_workers=2, thread_name_prefix="run-cancel")
+
+# Promedio de tokens de runs completados, para estimar tokens ahorrados
+_usage = {"runs": 0, "tokens": 0}
+
+# Momento a partir del cual los runs deben cancelarse (apagado del worker)
+_shutdown = {"deadline": None}
+
+
+def reset_after_fork():
+    """Forget the parent's runs after a fork (the executor is recreated per process)."""
+    with _lock:
+        _inflight.clear()
+
+
+def register(thread_id, run_id):
+    """Track a run that a request is waiting on."""
+    with _lock:
+        _inflight[run_id] = thread_id
+
+
+def unregister(run_id):
+    """Stop tracking a run once the request is done with it."""
+    with _lock:
+        _inflight.pop(run_id, None)
+
+
+def inflight_count():
+    """Number of runs currently being waited on by this worker."""
+    with _lock:
+        return len(_inflight)
+
+
+def record_usage(run):
+    """Accumulate token usage of a completed run."""
+    usage = getattr(run, 'usage', None)
+    total = getattr(usage, 'total_tokens', None) if usage else None
+    if total:
+        with _lock:
+            _usage["runs"] += 1
+            _usage["tokens"] += total
+
+
+def _average_tokens():
+    with _lock:
+        if not _usage["runs"]:
+            return 0
+        return _usage["tokens"] // _usage["runs"]
+
+
+def _cancel(client, thread_id, run_id, reason):
+    try:
+        client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run_id)
+        metrics.incr("runs.cancelled")
+        metrics.incr(f"runs.cancelled.{reason}")
+        metrics.incr("runs.tokens_saved_estimate", _average_tokens())
+    except Exception:
+        # El run pudo haber terminado entre medio; la cancelación es best-effort
+        metrics.incr("runs.cancel_failed")
+
+
+def cancel_async(client, thread_id, run_id, reason):
+    """Cancel a run in the background; never blocks the caller."""
+    unregister(run_id)
+    return _executor.submit(_cancel, client, thread_id, run_id, reason)
+
+
+def cancel_all(client, reason="shutdown", timeout=5):
+    """Cancel every tracked run and wait briefly for the calls to go out."""
+    with _lock:
+        runs = list(_inflight.items())
+    futures = [cancel_async(client, thread_id, run_id, reason)
+               for run_id, thread_id in runs]
+    end = time.time() + timeout
+    for future in futures:
+        try:
+            future.result(timeout=max(0, end - time.time()))
+        except Exception:
+            pass
+    return len(futures)
+
+
+def begin_shutdown(drain_seconds):
+    """Let in-flight runs drain for a while; after that they get cancelled."""
+    _shutdown["deadline"] = time.time() + drain_seconds
+
+
+def shutting_down():
+    """True once the drain window after SIGTERM has elapsed."""
+    deadline = _shutdown["deadline"]
+    return deadline is not None and time.time() > deadline
+
+
+def client_disconnected(environ):
+    """
+    Detect whether the HTTP client closed the connection.
+
+    Only works with gunicorn, which exposes the socket in the WSGI environ.
+    A zero-byte peek means the peer sent FIN.
+    """
+    sock = environ.get('gunicorn.socket')
+    if sock is None:
+        return False
+    try:
+        return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b''
+    except BlockingIOError:
+        return False
+    except OSError:
+        return True
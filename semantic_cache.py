@@ -0,0 +1,289 @@
+"""
+Caché semántica de respuestas para preguntas de primer turno.
+
+Las preguntas frecuentes ("do you allow pets?", "are pets allowed, i have an
+older lab") llegan con redacciones distintas, así que la coincidencia exacta
+sobre clean_query casi nunca acierta. Aquí se embebe el query normalizado y se
+busca el vecino más cercano entre las respuestas recientes del mismo asistente.
+
+- Embeddings: modelo local de sentence-transformers (SEMANTIC_CACHE_MODEL, por
+  defecto all-MiniLM-L6-v2), cargado una vez en warm_up. No hay llamada de red
+  en el camino del request, así que no depende del deadline ni del circuit
+  breaker. Si el paquete no está instalado, la caché no acierta nunca.
+- Índice: una matriz numpy por asistente con los vectores normalizados; la
+  búsqueda es un producto matriz-vector, con expiración por TTL y desalojo LRU.
+  numpy y el modelo se importan recién al usar la caché: con la caché apagada
+  (el default) los workers no pagan esos imports al arrancar.
+- Nunca se cachean queries que nombran un listing: dígitos, números escritos,
+  lots/units/spaces, calles ("nogales lane") o "this home". La respuesta de un
+  listing no puede servir para otro. "lot rent" y "section 8" son preguntas
+  del parque y sí se cachean.
+- Cada acierto se escribe en un log de auditoría para revisar falsos positivos.
+"""
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+SEMANTIC_CACHE_MODEL = os.getenv("SEMANTIC_CACHE_MODEL", "all-MiniLM-L6-v2")
+SIMILARITY_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.85))
+MAX_ENTRIES_PER_ASSISTANT = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", 2000))
+ENTRY_TTL = int(os.getenv("SEMANTIC_CACHE_TTL", 6 * 3600))
+AUDIT_LOG = os.getenv("SEMANTIC_CACHE_AUDIT_LOG", "semantic_cache_audit.jsonl")
+
+# Queries que dependen de un listing específico (el query ya viene en
+# minúsculas y sin puntuación, ver clean_query)
+_NUMBER_WORDS = (
+    "one|two|three|four|five|six|seven|eight|nine|ten|eleven|twelve|thirteen|"
+    "fourteen|fifteen|sixteen|seventeen|eighteen|nineteen|twenty|thirty|forty|"
+    "fifty|sixty|seventy|eighty|ninety|hundred|thousand"
+)
+_LOT_WORDS = "lot|lots|unit|units|space|spaces|site|sites|listing|listings|post"
+_STREET_WORDS = (
+    "street|st|lane|ln|road|rd|drive|dr|avenue|ave|av|court|ct|circle|cir|"
+    "boulevard|blvd|pl|trail|trl|terrace|parkway|pkwy|highway|hwy|"
+    "calle|avenida|camino"
+)
+# Preguntas generales del parque que usan esas palabras sin nombrar un listing
+_PARK_WIDE = re.compile(r'\bsection\s*(?:8|eight)\b')
+_UNCACHEABLE = re.compile(
+    r'\d'
+    r'|\b(?:' + _NUMBER_WORDS + r')\b'
+    r'|\b(?:' + _LOT_WORDS + r')\b(?!\s+(?:rent|fee|fees))'
+    r'|\b(?:' + _STREET_WORDS + r')\b'
+    r'|\b(?:this|that|these|those)\s+(?:one|home|house|trailer|mobile|property|place)\b'
+)
+
+
+class SentenceTransformerEmbedder:
+    """Dense embeddings from a local sentence-transformers model."""
+
+    def __init__(self, model_name):
+        # Import perezoso: el paquete es opcional y pesado
+        from sentence_transformers import SentenceTransformer
+        self.name = model_name
+        self._model = SentenceTransformer(model_name)
+
+    def embed(self, text):
+        return _normalize(self._model.encode(text))
+
+
+def _normalize(vector):
+    import numpy as np
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class _UnavailableEmbedder:
+    """Stand-in when sentence-transformers is missing: every lookup is a miss."""
+
+    name = None
+
+    def embed(self, text):
+        raise RuntimeError("sentence-transformers no está instalado")
+
+
+def build_embedder(model_name=SEMANTIC_CACHE_MODEL):
+    """Return the local sentence-transformers model, or a stand-in that never embeds."""
+    try:
+        return SentenceTransformerEmbedder(model_name)
+    except ImportError:
+        metrics.incr("semantic_cache.model_unavailable")
+        return _UnavailableEmbedder()
+
+
+class _VectorIndex:
+    """Fixed-capacity matrix of unit vectors with LRU order and TTL per row."""
+
+    def __init__(self, capacity):
+        import numpy as np
+        self.capacity = capacity
+        self._vectors = None  # (capacity, dim) float32, creado con el primer vector
+        self._created = np.full(capacity, -np.inf)
+        self._slots = [None] * capacity  # fila -> entrada
+        self._rows = OrderedDict()  # query -> fila, en orden LRU
+        self._free = list(range(capacity - 1, -1, -1))
+
+    def __len__(self):
+        return len(self._rows)
+
+    def add(self, entry):
+        import numpy as np
+        vector = entry["vector"]
+        if self._vectors is None:
+            self._vectors = np.zeros((self.capacity, vector.shape[0]), dtype=np.float32)
+        elif vector.shape[0] != self._vectors.shape[1]:
+            raise ValueError("Dimensión de embedding distinta a la del índice")
+        evicted = 0
+        if entry["query"] in self._rows:
+            self.remove(entry["query"])
+        elif not self._free:
+            self.remove(next(iter(self._rows)))
+            evicted = 1
+        row = self._free.pop()
+        self._vectors[row] = vector
+        self._created[row] = entry["created_at"]
+        self._slots[row] = entry
+        self._rows[entry["query"]] = row
+        return evicted
+
+    def remove(self, query):
+        row = self._rows.pop(query)
+        self._created[row] = float("-inf")
+        self._slots[row] = None
+        self._free.append(row)
+
+    def expire(self, oldest):
+        """Drop rows created before oldest; returns how many."""
+        import numpy as np
+        rows = np.flatnonzero(self._created < oldest)
+        expired = [self._slots[row]["query"] for row in rows if self._slots[row] is not None]
+        for query in expired:
+            self.remove(query)
+        return len(expired)
+
+    def nearest(self, vector):
+        """Return (entry, score) of the most similar live row, or (None, 0.0)."""
+        if not self._rows or vector.shape[0] != self._vectors.shape[1]:
+            return None, 0.0
+        scores = self._vectors @ vector
+        scores[self._created == float("-inf")] = float("-inf")
+        row = int(scores.argmax())
+        entry = self._slots[row]
+        if entry is None:
+            return None, 0.0
+        self._rows.move_to_end(entry["query"])
+        return entry, float(scores[row])
+
+
+class SemanticCache:
+    """Per-assistant nearest-neighbour cache of answered first-turn queries."""
+
+    def __init__(self, embedder=None, threshold=SIMILARITY_THRESHOLD,
+                 max_entries=MAX_ENTRIES_PER_ASSISTANT, ttl=ENTRY_TTL,
+                 audit_log=AUDIT_LOG):
+        self._embedder = embedder
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.audit_log = audit_log
+        self._lock = threading.Lock()
+        self._entries = {}  # assistant_id -> _VectorIndex
+
+    @property
+    def embedder(self):
+        # El modelo se carga en el primer uso, no al importar
+        if self._embedder is None:
+            self._embedder = build_embedder()
+        return self._embedder
+
+    @staticmethod
+    def cacheable(normalized_query):
+        """Queries that name a lot, street, post_id or number are never cached."""
+        if not normalized_query:
+            return False
+        return not _UNCACHEABLE.search(_PARK_WIDE.sub(" ", normalized_query))
+
+    def embed(self, normalized_query):
+        """Vector of a cacheable query, or None if it is not cacheable or the call failed."""
+        if not self.cacheable(normalized_query):
+            return None
+        try:
+            return self.embedder.embed(normalized_query)
+        except Exception:
+            metrics.incr("semantic_cache.embed_failed")
+            return None
+
+    def lookup(self, assistant_id, normalized_query, vector=None):
+        """Return the cached answer for the nearest query above threshold, or None."""
+        if vector is None:
+            vector = self.embed(normalized_query)
+        if vector is None:
+            return None
+        with self._lock:
+            index = self._entries.get(assistant_id)
+            if index is None:
+                metrics.incr("semantic_cache.miss")
+                return None
+            expired = index.expire(time.time() - self.ttl)
+            if expired:
+                metrics.incr("semantic_cache.expired", expired)
+            best, best_score = index.nearest(vector)
+        if best is None or best_score < self.threshold:
+            metrics.incr("semantic_cache.miss")
+            return None
+
+        metrics.incr("semantic_cache.hit")
+        self._audit(assistant_id, normalized_query, best, best_score)
+        return best["answer"]
+
+    def store(self, assistant_id, normalized_query, answer, vector=None):
+        """Remember an answered first-turn query (vector: the one lookup computed)."""
+        if not answer:
+            return
+        if vector is None:
+            vector = self.embed(normalized_query)
+        if vector is None:
+            return
+        entry = {
+            "query": normalized_query,
+            "answer": answer,
+            "vector": vector,
+            "created_at": time.time(),
+        }
+        with self._lock:
+            index = self._entries.get(assistant_id)
+            if index is None:
+                index = self._entries[assistant_id] = _VectorIndex(self.max_entries)
+            try:
+                evicted = index.add(entry)
+            except ValueError:
+                # Cambió el modelo de embeddings: el índice viejo ya no sirve
+                index = self._entries[assistant_id] = _VectorIndex(self.max_entries)
+                evicted = index.add(entry)
+        if evicted:
+            metrics.incr("semantic_cache.evicted", evicted)
+
+    def invalidate(self, assistant_id=None):
+        """Drop every entry of an assistant (or all of them)."""
+        with self._lock:
+            if assistant_id is None:
+                count = sum(len(e) for e in self._entries.values())
+                self._entries.clear()
+            else:
+                count = len(self._entries.pop(assistant_id, {}))
+        metrics.incr("semantic_cache.invalidated", count)
+        return count
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": SEMANTIC_CACHE_ENABLED,
+                "embedder": getattr(self._embedder, "name", None),
+                "threshold": self.threshold,
+                "entries": {k: len(v) for k, v in self._entries.items()},
+            }
+
+    def _audit(self, assistant_id, query, entry, score):
+        # Registro de aciertos para detectar falsos positivos y ajustar el umbral
+        if not self.audit_log:
+            return
+        line = json.dumps({
+            "ts": time.time(),
+            "assistant_id": assistant_id,
+            "query": query,
+            "matched_query": entry["query"],
+            "similarity": round(score, 4),
+            "answer": entry["answer"],
+        }, ensure_ascii=False)
+        try:
+            with open(self.audit_log, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except OSError:
+            metrics.incr("semantic_cache.audit_failed")
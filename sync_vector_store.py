@@ -0,0 +1,321 @@
+"""
+Sincronización incremental de los documentos de listings con el vector store.
+
+Cada archivo del directorio de documentos (listings, reglamento) se identifica
+por su ruta relativa y su hash SHA-256. Un manifiesto local guarda, por ruta,
+el hash y el file_id subido, así que una corrida sin cambios no llama a
+OpenAI y termina en segundos. En cada corrida:
+
+1. Se suben en paralelo solo los archivos nuevos o modificados (files.create)
+   y se agregan al vector store en un solo file batch, esperando a que termine
+   la indexación.
+2. Recién después se borran del vector store (y del storage) las versiones
+   anteriores y los archivos que ya no existen, para que file_search nunca se
+   quede sin el listing mientras se reindexa.
+3. Se guarda el manifiesto, aunque la corrida falle a mitad de camino. Los
+   archivos que fallaron al subir o al indexar no entran al manifiesto y se
+   reintentan en la próxima corrida; los file_id que no se pudieron borrar (o
+   que se subieron pero no llegaron al manifiesto) quedan en "pending_delete"
+   y se vuelven a borrar en la próxima corrida, aunque no haya otros cambios.
+4. Si algo cambió, se regenera el banco de respuestas por listing
+   (answer_bank.py).
+
+Uso:
+    python sync_vector_store.py --docs listings --vector-store-id vs_xxx
+    TENANT=foothills python sync_vector_store.py --docs listings
+    python sync_vector_store.py --docs listings --dry-run
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Cargar variables de entorno solo si existe el archivo .env (desarrollo local)
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except Exception:
+    # En producción, las variables ya están en el entorno
+    pass
+
+from vector_store_config import LISTINGS_DIR, VECTOR_STORE_ID
+
+MANIFEST_PATH = os.getenv("VECTOR_STORE_MANIFEST", "vector_store_manifest.json")
+UPLOAD_CONCURRENCY = int(os.getenv("VECTOR_STORE_UPLOAD_CONCURRENCY", 5))
+
+# Formatos que file_search sabe indexar
+SUPPORTED_EXTENSIONS = {".md", ".txt", ".pdf", ".docx", ".json", ".html", ".csv"}
+
+
+def file_hash(path):
+    """SHA-256 of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def scan(docs_dir):
+    """Return {relative_path: sha256} for every supported document."""
+    documents = {}
+    for root, _, names in os.walk(docs_dir):
+        for name in names:
+            if name.startswith(".") or os.path.splitext(name)[1].lower() not in SUPPORTED_EXTENSIONS:
+                continue
+            path = os.path.join(root, name)
+            documents[os.path.relpath(path, docs_dir).replace(os.sep, "/")] = file_hash(path)
+    return documents
+
+
+def load_manifest(path, vector_store_id):
+    """
+    Read the manifest as (files, pending_delete); a manifest for another
+    vector store counts as empty.
+    """
+    try:
+        with open(path, encoding="utf-8") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return {}, []
+    if manifest.get("vector_store_id") != vector_store_id:
+        return {}, []
+    return manifest.get("files", {}), manifest.get("pending_delete", [])
+
+
+def save_manifest(path, vector_store_id, files, pending_delete=()):
+    """Write the manifest atomically."""
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"vector_store_id": vector_store_id, "updated_at": time.time(),
+                   "files": files, "pending_delete": sorted(pending_delete)},
+                  f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def plan(documents, manifest):
+    """Return (to_upload, to_delete): changed paths and superseded file ids."""
+    to_upload = sorted(path for path, digest in documents.items()
+                       if manifest.get(path, {}).get("sha256") != digest)
+    to_delete = [entry["file_id"] for path, entry in manifest.items()
+                 if path not in documents or path in to_upload]
+    return to_upload, to_delete
+
+
+def _upload(client, docs_dir, path):
+    with open(os.path.join(docs_dir, path), "rb") as f:
+        # El nombre del archivo es lo que file_search devuelve como file_name
+        uploaded = client.files.create(file=(os.path.basename(path), f.read()), purpose="assistants")
+    return path, uploaded.id
+
+
+def _upload_all(client, docs_dir, paths, concurrency):
+    """Upload paths in parallel; returns ({path: file_id}, [failed paths])."""
+    uploaded, failed = {}, []
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(_upload, client, docs_dir, path): path for path in paths}
+        for future in as_completed(futures):
+            try:
+                path, file_id = future.result()
+            except Exception as e:
+                print(f"⚠️  No se pudo subir {futures[future]}: {e}")
+                failed.append(futures[future])
+                continue
+            uploaded[path] = file_id
+    return uploaded, sorted(failed)
+
+
+def _delete(client, vector_store_id, file_id):
+    for call in (lambda: client.vector_stores.files.delete(file_id, vector_store_id=vector_store_id),
+                 lambda: client.files.delete(file_id)):
+        try:
+            call()
+        except Exception as e:
+            # Un archivo ya borrado a mano no debe frenar la sincronización
+            if getattr(e, "status_code", None) != 404:
+                print(f"⚠️  No se pudo borrar {file_id}: {e}")
+                return False
+    return True
+
+
+def _failed_file_ids(client, vector_store_id, batch):
+    if not getattr(batch.file_counts, "failed", 0):
+        return set()
+    failed = client.vector_stores.file_batches.list_files(
+        batch.id, vector_store_id=vector_store_id, filter="failed"
+    )
+    return {f.id for f in failed}
+
+
+def sync(client, docs_dir, vector_store_id, manifest_path=MANIFEST_PATH,
+         concurrency=UPLOAD_CONCURRENCY, dry_run=False, prune_unknown=False,
+         chunking_strategy=None):
+    """
+    Bring the vector store in line with docs_dir.
+
+    Returns a summary dict with the uploaded paths, deleted file ids and
+    failures; "changed" is True when file_search content changed.
+    """
+    start = time.time()
+    manifest, pending_delete = load_manifest(manifest_path, vector_store_id)
+    documents = scan(docs_dir)
+    to_upload, to_delete = plan(documents, manifest)
+    # Borrados que fallaron en corridas anteriores
+    to_delete.extend(file_id for file_id in pending_delete if file_id not in to_delete)
+
+    if prune_unknown and client is not None:
+        # Archivos subidos a mano que el manifiesto no conoce
+        known = {entry["file_id"] for entry in manifest.values()}
+        for vs_file in client.vector_stores.files.list(vector_store_id, limit=100):
+            if vs_file.id not in known and vs_file.id not in to_delete:
+                to_delete.append(vs_file.id)
+
+    summary = {
+        "documents": len(documents),
+        "unchanged": len(documents) - len(to_upload),
+        "uploaded": [],
+        "deleted": [],
+        "failed": [],
+        "delete_failed": [],
+        "changed": False,
+    }
+    if dry_run or (not to_upload and not to_delete):
+        summary["pending_upload"] = to_upload
+        summary["pending_delete"] = to_delete
+        summary["elapsed_s"] = round(time.time() - start, 2)
+        return summary
+
+    uploaded = {}
+    try:
+        if to_upload:
+            uploaded, upload_failed = _upload_all(client, docs_dir, to_upload, concurrency)
+            for path in upload_failed:
+                summary["failed"].append(path)
+                # Sin versión nueva, la vieja sigue sirviendo
+                if path in manifest:
+                    to_delete.remove(manifest[path]["file_id"])
+        if uploaded:
+            options = {"file_ids": list(uploaded.values())}
+            if chunking_strategy:
+                options["chunking_strategy"] = chunking_strategy
+            # Un solo batch: OpenAI indexa en paralelo y create_and_poll espera a que termine
+            batch = client.vector_stores.file_batches.create_and_poll(vector_store_id, **options)
+            failed_ids = _failed_file_ids(client, vector_store_id, batch)
+            for path, file_id in uploaded.items():
+                if file_id in failed_ids:
+                    summary["failed"].append(path)
+                    # La versión vieja sigue sirviendo hasta que la nueva indexe bien
+                    if path in manifest:
+                        to_delete.remove(manifest[path]["file_id"])
+                    to_delete.append(file_id)
+                    continue
+                manifest[path] = {"sha256": documents[path], "file_id": file_id, "synced_at": time.time()}
+                summary["uploaded"].append(path)
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(lambda file_id: (file_id, _delete(client, vector_store_id, file_id)),
+                                        to_delete))
+        summary["deleted"] = [file_id for file_id, ok in results if ok]
+        summary["delete_failed"] = [file_id for file_id, ok in results if not ok]
+    finally:
+        # Siempre se guarda el manifiesto: si la corrida se cortó, los archivos
+        # ya subidos que no entraron al manifiesto quedan para borrar en la
+        # próxima corrida en vez de quedar huérfanos en el storage
+        for path in [p for p in manifest if p not in documents]:
+            del manifest[path]
+        live = {entry["file_id"] for entry in manifest.values()}
+        deleted = set(summary["deleted"])
+        pending = []
+        for file_id in list(to_delete) + list(uploaded.values()):
+            if file_id not in live and file_id not in deleted and file_id not in pending:
+                pending.append(file_id)
+        save_manifest(manifest_path, vector_store_id, manifest, pending)
+
+    summary["changed"] = bool(summary["uploaded"] or summary["deleted"])
+    summary["elapsed_s"] = round(time.time() - start, 2)
+    return summary
+
+
+def _resolve_vector_store(args):
+    if args.vector_store_id:
+        return args.vector_store_id
+    tenant_name = args.tenant or os.getenv("TENANT")
+    if tenant_name:
+        from tenants import TENANTS_CONFIG, TenantRegistry
+
+        tenant = TenantRegistry().get_by_name(tenant_name)
+        if tenant is None or not tenant.vector_store_id:
+            raise ValueError(f"El tenant '{tenant_name}' no tiene vector_store_id en {TENANTS_CONFIG}")
+        return tenant.vector_store_id
+    return VECTOR_STORE_ID
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sincronizar documentos con el vector store")
+    parser.add_argument("--docs", default=LISTINGS_DIR, help="Directorio con listings y reglamento")
+    parser.add_argument("--vector-store-id")
+    parser.add_argument("--tenant", help="Usar el vector store del tenant en tenants.json")
+    parser.add_argument("--manifest", help="Ruta del manifiesto local")
+    parser.add_argument("--concurrency", type=int, default=UPLOAD_CONCURRENCY)
+    parser.add_argument("--dry-run", action="store_true", help="Mostrar cambios sin subir nada")
+    parser.add_argument("--prune-unknown", action="store_true",
+                        help="Borrar archivos del vector store que no están en el manifiesto")
+    parser.add_argument("--max-chunk-tokens", type=int, help="Tamaño de chunk (estrategia estática)")
+    parser.add_argument("--chunk-overlap", type=int, default=400)
+    parser.add_argument("--no-answer-bank", action="store_true",
+                        help="No regenerar el banco de respuestas (answer_bank.py)")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.docs):
+        print(f"❌ No existe el directorio {args.docs}")
+        sys.exit(1)
+
+    vector_store_id = _resolve_vector_store(args)
+    manifest_path = args.manifest or MANIFEST_PATH
+    chunking_strategy = None
+    if args.max_chunk_tokens:
+        chunking_strategy = {"type": "static", "static": {
+            "max_chunk_size_tokens": args.max_chunk_tokens,
+            "chunk_overlap_tokens": args.chunk_overlap,
+        }}
+
+    client = None
+    if not args.dry_run:
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise ValueError("Por favor configura tu OPENAI_API_KEY como variable de entorno")
+        from openai import OpenAI
+        client = OpenAI(api_key=api_key)
+
+    print(f"🔄 Sincronizando {args.docs} con {vector_store_id}...")
+    summary = sync(client, args.docs, vector_store_id, manifest_path, args.concurrency,
+                   args.dry_run, args.prune_unknown, chunking_strategy)
+
+    print(f"📄 Documentos: {summary['documents']} ({summary['unchanged']} sin cambios)")
+    if args.dry_run:
+        print(f"📝 Se subirían: {summary['pending_upload']}")
+        print(f"🗑️  Se borrarían: {summary['pending_delete']}")
+    else:
+        print(f"⬆️  Subidos: {len(summary['uploaded'])}")
+        print(f"🗑️  Borrados: {len(summary['deleted'])}")
+        if summary["delete_failed"]:
+            print(f"⚠️  Sin borrar (se reintentan en la próxima corrida): {summary['delete_failed']}")
+    print(f"⏱️  {summary['elapsed_s']} s")
+    if not args.dry_run and not args.no_answer_bank:
+        # Import perezoso: answer_bank importa este módulo
+        import answer_bank
+
+        if summary["changed"] or not os.path.exists(answer_bank.ANSWER_BANK_PATH):
+            bank = answer_bank.build(args.docs, vector_store_id)
+            print(f"📚 Banco de respuestas regenerado: {bank['entries']} respuestas de {bank['listings']} listings")
+    if summary["failed"]:
+        print(f"❌ Fallaron al subir o indexar (se reintentan en la próxima corrida): {summary['failed']}")
+        sys.exit(1)
+    print("✅ Vector store sincronizado")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""
+Registro de asistentes por parque (multi-tenant).
+
+La configuración de cada parque vive en un JSON (TENANTS_CONFIG, por defecto
+tenants.json) con esta forma:
+
+    {
+      "tenants": [
+        {
+          "name": "foothills",
+          "assistant_id": "asst_xxx",
+          "vector_store_id": "vs_xxx",
+          "messenger_page_id": "1234567890",
+          "facts": {"Lot rent": "$525/month (fixed, always)", ...},
+          "rate_limits": {"max_inflight": 4},
+          "timeout": 60
+        }
+      ]
+    }
+
+tenants.json no se versiona, así que en un deploy desde git (Railway) la
+configuración llega en la variable TENANTS_JSON con el mismo contenido; si
+está definida tiene prioridad sobre el archivo.
+
+La búsqueda por assistant_id es un dict en memoria: validar un request no hace
+llamadas a OpenAI. El archivo se vuelve a leer cuando cambia su mtime (como
+máximo cada TENANTS_RELOAD_INTERVAL segundos), sin reiniciar los workers.
+Si no hay configuración, el registro queda abierto y acepta cualquier
+assistant_id; con TENANTS_CONFIG, TENANTS_JSON o TENANTS_REQUIRED=true definidos
+eso se avisa al arrancar (warn_if_missing).
+"""
+import json
+import os
+import sys
+import threading
+import time
+
+import metrics
+
+TENANTS_CONFIG = os.getenv("TENANTS_CONFIG", "tenants.json")
+TENANTS_JSON = os.getenv("TENANTS_JSON")
+RELOAD_INTERVAL = float(os.getenv("TENANTS_RELOAD_INTERVAL", 5))
+# Se espera un registro multi-tenant: un registro abierto es un error de deploy
+TENANTS_EXPECTED = (os.getenv("TENANTS_REQUIRED", "false").lower() == "true"
+                    or "TENANTS_CONFIG" in os.environ or TENANTS_JSON is not None)
+
+_NOT_LOADED = object()
+# "mtime" de la configuración que viene de TENANTS_JSON: no cambia sin reiniciar
+_FROM_ENV = "env"
+
+
+class Tenant:
+    """Configuration of one park / assistant."""
+
+    def __init__(self, config):
+        self.name = config["name"]
+        # Un parque recién dado de alta puede no tener asistente todavía
+        self.assistant_id = config.get("assistant_id")
+        self.vector_store_id = config.get("vector_store_id")
+        self.page_id = config.get("messenger_page_id")
+        self.facts = config.get("facts", {})
+        self.rate_limits = config.get("rate_limits", {})
+        # Deadline por defecto de sus requests, en segundos (deadline.py)
+        self.timeout = config.get("timeout")
+        self.raw = config
+
+    @property
+    def max_inflight(self):
+        return self.rate_limits.get("max_inflight")
+
+    def __eq__(self, other):
+        return isinstance(other, Tenant) and self.raw == other.raw
+
+
+def render_facts(facts):
+    """Render the fixed facts as the prompt's bullet list."""
+    return "\n".join(f"- {key}: {value}" for key, value in facts.items())
+
+
+class TenantRegistry:
+    """In-process assistant_id -> Tenant map with mtime-based hot reload."""
+
+    def __init__(self, path=TENANTS_CONFIG, reload_interval=RELOAD_INTERVAL,
+                 inline=TENANTS_JSON, expected=TENANTS_EXPECTED):
+        self.path = path
+        self.inline = inline
+        self.expected = expected
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._by_assistant = {}
+        self._by_name = {}
+        self._by_page = {}
+        self._mtime = _NOT_LOADED
+        self._checked_at = 0.0
+        self._listeners = []
+        self.load()
+
+    def on_change(self, listener):
+        """Register listener(tenant) called when a tenant changes or disappears."""
+        self._listeners.append(listener)
+        return listener
+
+    @property
+    def open(self):
+        """True when no configuration exists: every assistant_id is accepted."""
+        return self._mtime is None
+
+    @property
+    def source(self):
+        """Where the tenants came from: "TENANTS_JSON", the config path, or None."""
+        if self._mtime is None or self._mtime is _NOT_LOADED:
+            return None
+        return "TENANTS_JSON" if self._mtime == _FROM_ENV else self.path
+
+    def load(self):
+        """(Re)read the configuration if it changed since the last load."""
+        if self.inline is not None:
+            mtime = _FROM_ENV
+        else:
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except FileNotFoundError:
+                mtime = None
+        if mtime == self._mtime:
+            return False
+        by_name = {}
+        if mtime is not None:
+            try:
+                if mtime == _FROM_ENV:
+                    config = json.loads(self.inline)
+                else:
+                    with open(self.path, encoding="utf-8") as f:
+                        config = json.load(f)
+                by_name = {t["name"]: Tenant(t) for t in config.get("tenants", [])}
+            except (OSError, ValueError, KeyError):
+                # Un archivo a medio escribir no debe tumbar el servicio
+                metrics.incr("tenants.reload_failed")
+                return False
+
+        tenants = {t.assistant_id: t for t in by_name.values() if t.assistant_id}
+        by_page = {t.page_id: t for t in by_name.values() if t.page_id}
+        with self._lock:
+            previous = self._by_assistant
+            self._by_assistant = tenants
+            self._by_name = by_name
+            self._by_page = by_page
+            self._mtime = mtime
+        metrics.incr("tenants.reloaded")
+
+        for assistant_id, tenant in previous.items():
+            if tenants.get(assistant_id) != tenant:
+                for listener in self._listeners:
+                    listener(tenant)
+        return True
+
+    def warn_if_missing(self):
+        """Warn at boot when multi-tenant settings are expected but none loaded."""
+        if not self.expected or self.source is not None:
+            return False
+        metrics.incr("tenants.not_loaded")
+        if self.open:
+            impact = "se acepta cualquier assistant_id"
+        else:
+            impact = "la configuración es inválida y se rechaza todo assistant_id"
+        print(f"⚠️  No se cargó el registro de tenants (TENANTS_JSON o {self.path}): "
+              f"{impact} y no se aplican los timeouts ni límites por parque", file=sys.stderr)
+        return True
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = now
+        self.load()
+
+    def get(self, assistant_id):
+        """Return the Tenant for an assistant_id, or None."""
+        self._maybe_reload()
+        return self._by_assistant.get(assistant_id)
+
+    def is_known(self, assistant_id):
+        """O(1) validation of an incoming assistant_id."""
+        self._maybe_reload()
+        return self.open or assistant_id in self._by_assistant
+
+    def get_by_name(self, name):
+        """Return the Tenant with the given name, or None."""
+        self._maybe_reload()
+        return self._by_name.get(name)
+
+    def get_by_page(self, page_id):
+        """Return the Tenant of a Messenger page, or None."""
+        self._maybe_reload()
+        return self._by_page.get(page_id)
+
+    def tenants(self):
+        self._maybe_reload()
+        return list(self._by_name.values())
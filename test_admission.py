@@ -0,0 +1,102 @@
+"""
+Casos del control de admisión: orden WFQ, tope de batch y rechazo rápido.
+No necesita servidor ni credenciales: python -m pytest test_admission.py
+"""
+import threading
+import time
+
+import pytest
+
+from admission import BATCH, INTERACTIVE, AdmissionController, AdmissionRejected
+
+
+def wait_until(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def queue_in_order(controller, requests):
+    """Enqueue (name, assistant_id, priority) one by one; return grant order."""
+    granted = []
+    threads = []
+    for name, assistant_id, priority in requests:
+        depth = controller.stats()["queue_depth"]
+        thread = threading.Thread(
+            target=lambda n=name, a=assistant_id, p=priority: (
+                controller.acquire(a, priority=p), granted.append((n, a, p))),
+            daemon=True)
+        thread.start()
+        threads.append(thread)
+        wait_until(lambda d=depth: controller.stats()["queue_depth"] == d + 1)
+    return granted, threads
+
+
+def test_interactive_waiters_overtake_queued_batch():
+    controller = AdmissionController(max_inflight=1, max_per_assistant=1,
+                                     queue_timeout=5, batch_max_inflight=1,
+                                     batch_queue_timeout=5)
+    controller.acquire("asst_busy", priority=BATCH)
+    granted, threads = queue_in_order(controller, [
+        ("b1", "asst_replay", BATCH),
+        ("b2", "asst_replay", BATCH),
+        ("i1", "asst_a", INTERACTIVE),
+        ("i2", "asst_b", INTERACTIVE),
+    ])
+    release = ("busy", "asst_busy", BATCH)
+    for expected in range(1, 5):
+        controller.release(release[1], release[2])
+        wait_until(lambda e=expected: len(granted) == e)
+        release = granted[-1]
+    controller.release(release[1], release[2])
+    for thread in threads:
+        thread.join(timeout=1)
+    assert [name for name, _, _ in granted] == ["i1", "i2", "b1", "b2"]
+    assert controller.stats()["inflight"] == 0
+
+
+def test_batch_never_takes_more_than_its_cap():
+    controller = AdmissionController(max_inflight=3, max_per_assistant=3,
+                                     batch_max_inflight=1)
+    controller.acquire("asst_replay", priority=BATCH)
+    with pytest.raises(AdmissionRejected) as excinfo:
+        controller.acquire("asst_replay", priority=BATCH, timeout=0)
+    assert excinfo.value.reason == "deadline"
+    # El slot que batch no puede usar sigue libre para un lead
+    controller.acquire("asst_replay", priority=INTERACTIVE)
+    assert controller.stats()["inflight_per_priority"] == {INTERACTIVE: 1, BATCH: 1}
+
+
+def test_full_queue_is_rejected_immediately():
+    controller = AdmissionController(max_inflight=1, max_queue=0)
+    controller.acquire("asst_a")
+    started = time.monotonic()
+    with pytest.raises(AdmissionRejected) as excinfo:
+        controller.acquire("asst_a")
+    assert excinfo.value.reason == "queue_full"
+    assert time.monotonic() - started < 0.5
+
+
+def test_per_assistant_limit_queues_only_that_tenant():
+    controller = AdmissionController(max_inflight=4, max_per_assistant=1)
+    controller.acquire("asst_a")
+    with pytest.raises(AdmissionRejected):
+        controller.acquire("asst_a", timeout=0)
+    controller.acquire("asst_b")
+    controller.acquire("asst_a", limit=2)
+    assert controller.stats()["inflight_per_assistant"] == {"asst_a": 2, "asst_b": 1}
+
+
+def test_slot_releases_on_error_and_idle_flows_are_forgotten():
+    controller = AdmissionController(max_inflight=1, queue_timeout=0.01)
+    controller.acquire("asst_busy")
+    for i in range(20):
+        with pytest.raises(AdmissionRejected):
+            controller.acquire(f"asst_{i}")
+    controller.release("asst_busy")
+    with pytest.raises(RuntimeError):
+        with controller.slot("asst_a"):
+            raise RuntimeError()
+    assert controller.stats()["inflight"] == 0
+    assert controller._flow_finish == {}
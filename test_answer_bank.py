@@ -0,0 +1,114 @@
+"""
+Casos del banco de respuestas: lectura de preguntas, respuestas canónicas y mmap.
+No necesita servidor ni credenciales: python -m pytest test_answer_bank.py
+"""
+import pytest
+
+from answer_bank import (AnswerBank, build_answers, parse_listings, parse_question,
+                         read_bank, status_kind, write_bank)
+from pipeline import clean_query
+
+LISTING = """
+# Lot 335
+- Lot: Lot 335 Nogales Ln
+- **Lot property id:** 100815996313376_364484063234800
+- Bedrooms: 3
+- Bathrooms: 2
+- Current status for rent: Available
+- Rent price: $1,200
+- Current status for sale: Not available
+- Security deposit: $800
+"""
+
+
+def parse(message):
+    return parse_question(clean_query(message))
+
+
+@pytest.mark.parametrize("message,expected", [
+    ("How much is lot 335?", ("lot:335", ["price"])),
+    ("Is lot 335 still available?", ("lot:335", ["availability"])),
+    ("how many bedrooms and bathrooms does lot number 12 have",
+     ("lot:12", ["beds_baths"])),
+    ("What's the deposit for lot 7?", ("lot:7", ["deposit"])),
+    ("Is lot 335 available for sale?", ("lot:335", ["availability_sale"])),
+    ("price to rent to own lot 335", ("lot:335", ["price_rent_to_own"])),
+    ("100815996313376_364484063234800 available?",
+     ("post:100815996313376_364484063234800", ["availability"])),
+])
+def test_questions_about_one_listing(message, expected):
+    assert parse(message) == expected
+
+
+@pytest.mark.parametrize("message,expected", [
+    ("Is lot 335 or lot 336 available?", (None, [])),
+    ("Is it still available?", (None, [])),
+    ("", (None, [])),
+    ("How much is the deposit for lot 335?", ("lot:335", ["deposit"])),
+    ("Do you allow pets on lot 335?", ("lot:335", [])),
+    ("How much is the lot rent on lot 335?", ("lot:335", [])),
+    ("hi i saw lot 335 on marketplace and i wanted to ask you a few different things about it",
+     (None, [])),
+])
+def test_questions_the_bank_does_not_answer(message, expected):
+    assert parse(message) == expected
+
+
+@pytest.mark.parametrize("query,expected", [
+    ("is it for rent", "rent"),
+    ("is it rent to own", "rent_to_own"),
+    ("can i buy it", "sale"),
+    ("owner financing available", "contract_for_deed"),
+    ("for rent or for sale", None),
+    ("is it available", None),
+])
+def test_status_kind(query, expected):
+    assert status_kind(query) == expected
+
+
+def test_listing_fields_are_parsed_from_markdown():
+    [listing] = parse_listings(LISTING)
+    assert listing["post_id"] == "100815996313376_364484063234800"
+    assert listing["price_rent"] == "$1,200"
+    assert listing["deposit"] == "$800"
+
+
+def test_second_lot_starts_a_new_listing():
+    listings = parse_listings("Lot: Lot 1\nBedrooms: 2\nLot: Lot 2\nBedrooms: 3\nNote: x")
+    assert [listing["bedrooms"] for listing in listings] == ["2", "3"]
+
+
+def test_answers_only_cover_the_documented_statuses():
+    [listing] = parse_listings(LISTING)
+    answers = build_answers(listing)
+    assert answers["price"] == "Lot 335 Nogales Ln is available for rent at $1,200/month."
+    assert answers["availability_sale"] == (
+        "Lot 335 Nogales Ln is not available for sale at the moment. "
+        "It is available for rent at $1,200/month. Would that work for you?")
+    assert "availability_rent_to_own" not in answers
+    assert answers["beds_baths"] == (
+        "This is a 3 bedroom, 2 bathroom home at Lot 335 Nogales Ln.")
+
+
+def test_missing_price_is_left_out():
+    answers = build_answers({"lot": "Lot 9", "status_sale": "Available"})
+    assert "price" not in answers
+    assert answers["availability"].startswith("Yes, Lot 9 is available for sale.")
+
+
+def test_bank_round_trip_through_mmap(tmp_path):
+    path = str(tmp_path / "bank.bin")
+    write_bank(path, {
+        "vs_1|lot:335|price": "Lot 335 is $1,200/month.",
+        "vs_1|lot:335|availability": "Yes, Lot 335 is available.",
+        "vs_2|lot:335|price": "Another park.",
+    })
+    assert len(read_bank(path)) == 3
+    bank = AnswerBank(path=path, reload_interval=0)
+    assert bank.get("vs_1", "lot:335", "price") == "Lot 335 is $1,200/month."
+    assert bank.get("vs_1", "lot:336", "price") is None
+    assert bank.answer("vs_1", "is lot 335 available") == "Yes, Lot 335 is available."
+    # Si falta una de las intenciones, la pregunta va al asistente
+    assert bank.answer("vs_1", "is lot 335 available what is the deposit") is None
+    write_bank(path, {"vs_1|lot:335|price": "Now $1,300/month."})
+    assert bank.get("vs_1", "lot:335", "price") == "Now $1,300/month."
@@ -0,0 +1,125 @@
+"""
+Casos del circuit breaker: closed → open → half_open y respuestas locales.
+No necesita servidor ni credenciales: python -m pytest test_circuit_breaker.py
+"""
+import pytest
+
+import circuit_breaker
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, local_answer
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuit_breaker.time, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def breaker(clock):
+    return CircuitBreaker(window=60, min_calls=4, error_rate=0.5, slow_ms=1000,
+                          slow_rate=0.5, open_seconds=30, probe_timeout=90)
+
+
+def trip(breaker):
+    for _ in range(4):
+        breaker.record(ok=False)
+    assert breaker.state == OPEN
+
+
+def test_waits_for_min_calls_before_opening(breaker):
+    for _ in range(3):
+        breaker.record(ok=False)
+    assert breaker.state == CLOSED
+    breaker.record(ok=True)
+    assert breaker.state == OPEN
+
+
+def test_stays_closed_below_the_error_rate(breaker):
+    for ok in (True, True, True, False, False):
+        breaker.record(ok=ok)
+    assert breaker.state == CLOSED
+    assert breaker.allow() == (True, False)
+
+
+def test_opens_on_errors_and_short_circuits(breaker):
+    trip(breaker)
+    assert breaker.allow() == (False, False)
+    assert breaker.stats()["open_for_s"] == 30
+
+
+def test_opens_on_slow_calls(breaker):
+    for _ in range(3):
+        breaker.record(ok=True, latency_ms=1500)
+    breaker.record(ok=True, latency_ms=10)
+    assert breaker.state == OPEN
+
+
+def test_old_calls_leave_the_window(breaker, clock):
+    for _ in range(3):
+        breaker.record(ok=False)
+    clock.now += 61
+    breaker.record(ok=False)
+    assert breaker.state == CLOSED
+    assert breaker.stats()["window_calls"] == 1
+
+
+def test_half_open_lets_one_probe_through(breaker, clock):
+    trip(breaker)
+    clock.now += 30
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow() == (True, True)
+    assert breaker.allow() == (False, False)
+    # Solo el resultado del probe decide
+    breaker.record(ok=False)
+    assert breaker.state == HALF_OPEN
+
+
+def test_successful_probe_closes(breaker, clock):
+    trip(breaker)
+    clock.now += 30
+    breaker.allow()
+    breaker.record(ok=True, latency_ms=10, probe=True)
+    assert breaker.state == CLOSED
+    assert breaker.stats()["window_calls"] == 0
+
+
+@pytest.mark.parametrize("ok,latency_ms", [(False, 10), (True, 1500)])
+def test_failed_or_slow_probe_reopens(breaker, clock, ok, latency_ms):
+    trip(breaker)
+    clock.now += 30
+    breaker.allow()
+    breaker.record(ok=ok, latency_ms=latency_ms, probe=True)
+    assert breaker.state == OPEN
+    clock.now += 29
+    assert breaker.state == OPEN
+
+
+def test_lost_or_cancelled_probe_does_not_block_recovery(breaker, clock):
+    trip(breaker)
+    clock.now += 30
+    assert breaker.allow() == (True, True)
+    breaker.cancel_probe()
+    assert breaker.allow() == (True, True)
+    clock.now += 91
+    assert breaker.allow() == (True, True)
+
+
+@pytest.mark.parametrize("query,expected", [
+    ("what is the lot rent", "Lot rent: $450."),
+    ("do you accept section 8 vouchers", "Section 8: No."),
+    ("can i have a dog", "Pets: Yes, up to 2."),
+    ("how much is the home", None),
+    ("", None),
+])
+def test_local_answer_from_park_facts(query, expected):
+    facts = {"Lot rent": "$450", "Section 8": "No", "Pets": "Yes, up to 2"}
+    assert local_answer(facts, query) == expected
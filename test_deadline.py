@@ -0,0 +1,183 @@
+"""
+Casos del deadline por request y de los reintentos de call_upstream.
+No necesita servidor ni credenciales: python -m pytest test_deadline.py
+"""
+import pytest
+
+from deadline import (DEADLINE_MARGIN, MAX_REQUEST_TIMEOUT, MIN_CALL_TIMEOUT,
+                      REQUEST_TIMEOUT, RETRY_BACKOFF, Deadline, parse_timeout)
+from pipeline import ConversationPipeline, Turn, TurnError, retryable
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class UpstreamError(Exception):
+    def __init__(self, status_code):
+        super().__init__(status_code)
+        self.status_code = status_code
+
+
+class APIConnectionError(Exception):
+    pass
+
+
+class APITimeoutError(APIConnectionError):
+    pass
+
+
+class FlakyCall:
+    """Fails with the given errors, then succeeds; records each timeout."""
+
+    __name__ = "runs.retrieve"
+
+    def __init__(self, clock, errors, latency=0.0):
+        self.clock = clock
+        self.errors = list(errors)
+        self.latency = latency
+        self.timeouts = []
+
+    def __call__(self, timeout, **kwargs):
+        self.timeouts.append(timeout)
+        self.clock.now += self.latency
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def make_turn(clock, budget, thread_id=None):
+    return Turn("hello", "asst_1", thread_id=thread_id,
+                deadline=Deadline(budget, clock=clock))
+
+
+def make_pipeline(clock):
+    return ConversationPipeline(lambda: None, sleep=clock.sleep)
+
+
+@pytest.mark.parametrize("value,expected", [
+    ("30", 30.0),
+    ("2.5", 2.5),
+    ("0", None),
+    ("-5", None),
+    ("soon", None),
+    (None, None),
+])
+def test_parse_timeout(value, expected):
+    assert parse_timeout(value) == expected
+
+
+@pytest.mark.parametrize("header,tenant,budget,source", [
+    ("20", 45, 20.0, "header"),
+    ("abc", 45, 45.0, "tenant"),
+    (None, None, REQUEST_TIMEOUT, "default"),
+    (str(MAX_REQUEST_TIMEOUT * 2), None, MAX_REQUEST_TIMEOUT, "header"),
+])
+def test_budget_comes_from_header_then_tenant_then_default(header, tenant, budget, source):
+    deadline = Deadline.for_request(header, tenant)
+    assert (deadline.budget, deadline.source) == (budget, source)
+
+
+def test_clock_starts_at_arrival(clock):
+    arrived = clock()
+    clock.now += 4
+    deadline = Deadline(10, clock=clock, started=arrived)
+    assert deadline.remaining() == 6
+    assert deadline.report()["spent_ms"] == 4000
+
+
+def test_call_timeout_leaves_the_margin_and_respects_the_cap(clock):
+    deadline = Deadline(10, clock=clock)
+    assert deadline.call_timeout() == 10 - DEADLINE_MARGIN
+    assert deadline.call_timeout(cap=2) == 2
+    clock.now += 10
+    assert deadline.expired
+    assert deadline.call_timeout() == MIN_CALL_TIMEOUT
+
+
+def test_allows_only_waits_that_leave_room_for_a_call(clock):
+    deadline = Deadline(10, clock=clock)
+    assert deadline.allows(9 - DEADLINE_MARGIN - MIN_CALL_TIMEOUT)
+    assert not deadline.allows(10 - DEADLINE_MARGIN - MIN_CALL_TIMEOUT)
+
+
+@pytest.mark.parametrize("error,expected", [
+    (UpstreamError(429), True),
+    (UpstreamError(503), True),
+    (UpstreamError(400), False),
+    (APIConnectionError(), True),
+    (APITimeoutError(), False),
+    (ValueError(), False),
+])
+def test_retryable(error, expected):
+    assert retryable(error) is expected
+
+
+def test_each_attempt_gets_the_time_left(clock):
+    turn = make_turn(clock, 10)
+    call = FlakyCall(clock, [UpstreamError(500), UpstreamError(429)], latency=1)
+    assert make_pipeline(clock).call_upstream(turn, call) == "ok"
+    assert call.timeouts == [
+        10 - DEADLINE_MARGIN,
+        10 - 1 - RETRY_BACKOFF - DEADLINE_MARGIN,
+        10 - 2 - 3 * RETRY_BACKOFF - DEADLINE_MARGIN,
+    ]
+
+
+def test_timeout_cap_bounds_every_attempt(clock):
+    turn = make_turn(clock, 10)
+    call = FlakyCall(clock, [UpstreamError(500)])
+    make_pipeline(clock).call_upstream(turn, call, timeout_cap=2.5)
+    assert call.timeouts == [2.5, 2.5]
+
+
+def test_non_retryable_errors_are_raised_at_once(clock):
+    call = FlakyCall(clock, [UpstreamError(400)])
+    with pytest.raises(UpstreamError):
+        make_pipeline(clock).call_upstream(make_turn(clock, 10), call)
+    assert len(call.timeouts) == 1
+
+
+def test_retries_stop_at_max_retries(clock):
+    call = FlakyCall(clock, [UpstreamError(500)] * 5)
+    with pytest.raises(UpstreamError):
+        make_pipeline(clock).call_upstream(make_turn(clock, 60), call, max_retries=2)
+    assert len(call.timeouts) == 3
+
+
+def test_no_retry_when_the_backoff_does_not_fit(clock):
+    call = FlakyCall(clock, [UpstreamError(500)], latency=1)
+    with pytest.raises(UpstreamError):
+        make_pipeline(clock).call_upstream(make_turn(clock, 2), call)
+    assert len(call.timeouts) == 1
+
+
+def test_failure_after_the_deadline_is_a_408(clock):
+    turn = make_turn(clock, 5, thread_id="thread_1")
+    call = FlakyCall(clock, [TimeoutError()], latency=5)
+    with pytest.raises(TurnError) as excinfo:
+        make_pipeline(clock).call_upstream(turn, call)
+    assert excinfo.value.status_code == 408
+    assert excinfo.value.body["thread_id"] == "thread_1"
+
+
+def test_expired_deadline_skips_the_call(clock):
+    turn = make_turn(clock, 5)
+    clock.now += 5
+    call = FlakyCall(clock, [])
+    with pytest.raises(TurnError) as excinfo:
+        make_pipeline(clock).call_upstream(turn, call)
+    assert excinfo.value.status_code == 408
+    assert call.timeouts == []
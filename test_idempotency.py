@@ -0,0 +1,117 @@
+"""
+Casos de la supresión de duplicados: claim, reclamo tras fallo, TTL y leases.
+No necesita servidor ni credenciales: python -m pytest test_idempotency.py
+"""
+import threading
+
+import pytest
+
+import idempotency
+from idempotency import IdempotencyStore, derive_key
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(idempotency.time, "time", clock)
+    monkeypatch.setattr(idempotency.time, "sleep", lambda seconds: None)
+    return clock
+
+
+@pytest.fixture
+def store(tmp_path, clock):
+    return IdempotencyStore(path=str(tmp_path / "idempotency.db"), ttl=300,
+                            pending_timeout=120, max_waiters=1)
+
+
+def test_first_claim_owns_and_duplicates_get_the_response(store):
+    assert store.claim("key") == ("owner", None)
+    assert store.claim("key") == ("pending", None)
+    store.complete("key", '{"response": "hi"}', 200)
+    assert store.claim("key") == ("done", ('{"response": "hi"}', 200))
+    assert store.wait("key", timeout=1) == ("done", ('{"response": "hi"}', 200))
+
+
+def test_released_key_is_reclaimed_by_the_duplicate(store):
+    store.claim("key")
+    store.release("key")
+    assert store.wait("key", timeout=1) == ("released", None)
+    assert store.claim("key") == ("owner", None)
+
+
+def test_release_keeps_completed_responses(store):
+    store.claim("key")
+    store.complete("key", "body", 200)
+    store.release("key")
+    assert store.claim("key") == ("done", ("body", 200))
+
+
+def test_completed_response_expires_after_its_ttl(store, clock):
+    store.claim("key", ttl=5)
+    store.complete("key", "body", 200)
+    clock.now += 5
+    assert store.claim("key", ttl=5) == ("done", ("body", 200))
+    clock.now += 1
+    assert store.claim("key", ttl=5) == ("owner", None)
+
+
+def test_abandoned_pending_key_is_reclaimed(store, clock):
+    store.claim("key")
+    clock.now += 120
+    assert store.claim("key") == ("pending", None)
+    clock.now += 1
+    assert store.claim("key") == ("owner", None)
+
+
+def test_wait_times_out_while_pending(store, clock, monkeypatch):
+    store.claim("key")
+
+    def advance(seconds):
+        clock.now += seconds
+
+    monkeypatch.setattr(idempotency.time, "sleep", advance)
+    assert store.wait("key", timeout=1) == ("pending", None)
+
+
+def test_waiters_beyond_the_cap_are_busy(store):
+    store.claim("key")
+    store._waiters.acquire()
+    try:
+        assert store.wait("key", timeout=1) == ("busy", None)
+    finally:
+        store._waiters.release()
+
+
+def test_leases_are_exclusive_until_they_expire(store, clock):
+    assert store.acquire_lease("sender", "worker-1", ttl=30)
+    assert store.acquire_lease("sender", "worker-1", ttl=30)
+    assert not store.acquire_lease("sender", "worker-2", ttl=30)
+    store.release_lease("sender", "worker-2")
+    assert not store.acquire_lease("sender", "worker-2", ttl=30)
+    clock.now += 31
+    assert store.acquire_lease("sender", "worker-2", ttl=30)
+
+
+def test_claims_from_other_threads_see_the_same_state(store):
+    store.claim("key")
+    results = []
+    thread = threading.Thread(target=lambda: results.append(store.claim("key")))
+    thread.start()
+    thread.join()
+    assert results == [("pending", None)]
+
+
+def test_derived_keys_depend_on_every_field():
+    base = derive_key("/chat/continue", "asst_1", "thread_1", "ok")
+    assert base == derive_key("/chat/continue", "asst_1", "thread_1", "ok")
+    assert base != derive_key("/chat/continue", "asst_1", "thread_2", "ok")
+    assert base != derive_key("/chat/continue", "asst_1", "thread_1", "ok!")
+    assert base != derive_key("/chat", "asst_1", "thread_1", "ok")
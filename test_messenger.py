@@ -0,0 +1,158 @@
+"""
+Casos del webhook de Messenger: agrupación por remitente y reprogramación.
+No necesita servidor ni credenciales: python -m pytest test_messenger.py
+"""
+import hashlib
+import hmac
+import threading
+import time
+
+import pytest
+
+import messenger
+from admission import AdmissionRejected
+from messenger import (MessageBatcher, SenderBusy, SenderThreads, parse_events,
+                       verify_signature)
+
+WINDOW = 0.05
+
+
+class Turns:
+    """handle_turn stand-in: records each batch and can fail or block on demand."""
+
+    def __init__(self):
+        self.calls = []
+        self.errors = []
+        self.release = threading.Event()
+        self.release.set()
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, key, texts):
+        with self._lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            self.release.wait(2)
+            self.calls.append((key, list(texts)))
+            if self.errors:
+                raise self.errors.pop(0)
+        finally:
+            with self._lock:
+                self.running -= 1
+
+
+def wait_until(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+@pytest.fixture
+def turns():
+    return Turns()
+
+
+@pytest.fixture
+def batcher(turns):
+    return MessageBatcher(turns, window=WINDOW, max_wait=1, workers=4)
+
+
+def test_rapid_messages_become_one_turn(batcher, turns):
+    for text in ("Hi", "is this available?", "100815996313376_364484063234800"):
+        batcher.add("page:lead", text)
+    batcher.add("page:other", "hello")
+    wait_until(lambda: len(turns.calls) == 2)
+    assert sorted(turns.calls) == [
+        ("page:lead", ["Hi", "is this available?", "100815996313376_364484063234800"]),
+        ("page:other", ["hello"]),
+    ]
+
+
+def test_max_wait_bounds_the_debounce(turns):
+    batcher = MessageBatcher(turns, window=0.2, max_wait=0.1, workers=1)
+    started = time.monotonic()
+    batcher.add("page:lead", "Hi")
+    time.sleep(0.05)
+    batcher.add("page:lead", "anyone there?")
+    wait_until(lambda: turns.calls)
+    assert time.monotonic() - started < 0.2
+    assert turns.calls == [("page:lead", ["Hi", "anyone there?"])]
+
+
+def test_messages_during_a_turn_wait_for_the_next_one(batcher, turns):
+    turns.release.clear()
+    batcher.add("page:lead", "Hi")
+    wait_until(lambda: turns.running == 1)
+    batcher.add("page:lead", "is lot 335 available?")
+    batcher.add("page:lead", "and the price?")
+    time.sleep(WINDOW * 3)
+    assert batcher.stats() == {"pending_senders": 1, "active_turns": 1}
+    turns.release.set()
+    wait_until(lambda: len(turns.calls) == 2)
+    assert turns.calls[1] == ("page:lead", ["is lot 335 available?", "and the price?"])
+    assert turns.max_running == 1
+
+
+def test_sender_busy_is_rescheduled_without_spending_retries(batcher, turns):
+    turns.errors = [SenderBusy(retry_after=0.01)] * (messenger.MAX_RETRIES + 2)
+    batcher.add("page:lead", "Hi")
+    wait_until(lambda: len(turns.calls) == messenger.MAX_RETRIES + 3)
+    assert turns.calls[-1] == ("page:lead", ["Hi"])
+    wait_until(lambda: batcher.stats() == {"pending_senders": 0, "active_turns": 0})
+
+
+def test_rejected_turn_is_retried_then_dropped(batcher, turns):
+    turns.errors = [AdmissionRejected("queue_full", retry_after=0.01)] * 10
+    batcher.add("page:lead", "Hi")
+    wait_until(lambda: len(turns.calls) == messenger.MAX_RETRIES + 1)
+    time.sleep(0.1)
+    assert len(turns.calls) == messenger.MAX_RETRIES + 1
+    assert batcher.stats() == {"pending_senders": 0, "active_turns": 0}
+
+
+def test_retried_batch_keeps_its_messages_first(batcher, turns):
+    turns.release.clear()
+    turns.errors = [AdmissionRejected("queue_full", retry_after=WINDOW)]
+    batcher.add("page:lead", "Hi")
+    wait_until(lambda: turns.running == 1)
+    batcher.add("page:lead", "hello?")
+    turns.release.set()
+    wait_until(lambda: len(turns.calls) == 2)
+    assert turns.calls[1] == ("page:lead", ["Hi", "hello?"])
+
+
+def test_signature_is_checked_against_the_raw_body():
+    body = b'{"object": "page"}'
+    signature = "sha256=" + hmac.new(b"secret", body, hashlib.sha256).hexdigest()
+    assert verify_signature(body, signature, secret="secret")
+    assert not verify_signature(body + b" ", signature, secret="secret")
+    assert not verify_signature(body, signature[len("sha256="):], secret="secret")
+    assert not verify_signature(body, None, secret="secret")
+
+
+def test_parse_events_skips_echoes_and_attachments():
+    payload = {"object": "page", "entry": [{"id": "page_1", "messaging": [
+        {"sender": {"id": "lead_1"}, "message": {"mid": "m1", "text": " Hi "}},
+        {"sender": {"id": "page_1"}, "message": {"mid": "m2", "text": "Hello!", "is_echo": True}},
+        {"sender": {"id": "lead_1"}, "message": {"mid": "m3", "attachments": [{}]}},
+        {"sender": {"id": "lead_1"}, "read": {"watermark": 1}},
+    ]}]}
+    assert parse_events(payload) == [
+        {"page_id": "page_1", "sender_id": "lead_1", "mid": "m1", "text": "Hi"}]
+    assert parse_events({"object": "instagram"}) == []
+
+
+def test_sender_threads_is_bounded_and_falls_back_to_the_lookup():
+    lookups = []
+    threads = SenderThreads(lookup=lambda lead: lookups.append(lead) or f"thread_{lead}",
+                            max_size=2)
+    threads.set("a", "thread_a")
+    threads.set("b", "thread_b")
+    threads.get("a")
+    threads.set("c", "thread_c")
+    assert threads.get("a") == "thread_a"
+    assert threads.get("b") == "thread_b"
+    assert lookups == ["b"]
@@ -0,0 +1,57 @@
+"""
+Casos del output guard: pedidos de fotos y redacción de post_ids.
+No necesita servidor ni credenciales: python -m pytest test_output_guard.py
+"""
+import pytest
+
+from output_guard import PHOTO_RESPONSE, guard_response, photo_requested, redact_post_ids
+
+
+@pytest.mark.parametrize("message", [
+    "send me pictures",
+    "Can you send me some more pics?",
+    "show me photos",
+    "do you have more pics?",
+    "can I see pictures",
+    "pictures?",
+    "more pics please",
+    "mándame fotos",
+    "tienes más fotos?",
+    "any pictures of lot 335?",
+    "Pictures of the kitchen?",
+    "Got pics?",
+    "Photos of the inside?",
+    "hi, any more pics?",
+])
+def test_photo_requests(message):
+    assert photo_requested(message)
+    assert guard_response("Sure!", message) == PHOTO_RESPONSE
+
+
+@pytest.mark.parametrize("message", [
+    "I saw your post with pictures, is it available?",
+    "Is this still available? The post had nice pictures",
+    "any more info? the pics look great",
+    "I saw the pictures on marketplace",
+    "Can you send me the address? Pictures look nice",
+    "the pictures show a big yard",
+])
+def test_photo_mentions_are_not_requests(message):
+    assert not photo_requested(message)
+
+
+@pytest.mark.parametrize("text,expected", [
+    ("Lot 335 Nogales Ln (post 100815996313376_364484063234800) is available.",
+     "Lot 335 Nogales Ln is available."),
+    ("It's a 3_2 home, post_id: 801258793331921_1307579981159541.",
+     "It's a 3_2 home."),
+    ("Sure! 100815996313376_364484063234800", "Sure!"),
+])
+def test_post_ids_are_redacted_with_their_label(text, expected):
+    assert redact_post_ids(text) == (expected, 1)
+
+
+def test_short_underscored_numbers_are_kept():
+    assert redact_post_ids("We have a 3_2 and a 2024_05 listing") == (
+        "We have a 3_2 and a 2024_05 listing", 0
+    )
@@ -0,0 +1,96 @@
+"""
+Casos del clasificador de turnos triviales y del router de modelos.
+No necesita servidor ni credenciales: python -m pytest test_routing.py
+"""
+from types import SimpleNamespace
+
+import pytest
+
+from pipeline import Turn, clean_query
+from routing import FAST, FULL, ModelRouter, classify, estimate_cost, is_closing
+
+
+def route(message, continuing=False, previous_response=None):
+    return classify(clean_query(message), message, continuing, previous_response)
+
+
+@pytest.mark.parametrize("message,reason", [
+    ("Hi", "greeting"),
+    ("hello there!", "greeting"),
+    ("Buenas tardes", "greeting"),
+    ("Thanks a lot for the help", "acknowledgement"),
+    ("no thanks", "acknowledgement"),
+])
+def test_small_talk_goes_fast(message, reason):
+    assert route(message) == (FAST, reason)
+
+
+@pytest.mark.parametrize("message,reason", [
+    ("", "empty"),
+    ("100815996313376_364484063234800", "post_id"),
+    ("hi is lot 335 still available", "retrieval_words"),
+    ("how much is the rent", "retrieval_words"),
+    ("do you allow dogs", "retrieval_words"),
+    ("hi, I'm interested and would like to know more about what you have right now",
+     "long"),
+    ("when can I come by", "default"),
+])
+def test_anything_else_goes_full(message, reason):
+    assert route(message) == (FULL, reason)
+
+
+@pytest.mark.parametrize("message,reason", [
+    ("(520) 555-0142", "contact"),
+    ("my email is lead@example.com", "contact"),
+    ("tomorrow at 3pm", "schedule"),
+    ("saturday morning works", "schedule"),
+])
+def test_scheduling_details_go_fast_mid_conversation(message, reason):
+    assert route(message, continuing=True) == (FAST, reason)
+    assert route(message) == (FULL, "default")
+
+
+@pytest.mark.parametrize("previous,expected", [
+    ("You're welcome! Have a great day.", (FAST, "acknowledgement")),
+    ("We have openings Saturday at 10am or 2pm. Which works for you?",
+     (FULL, "acknowledgement_open")),
+    ("Lot 12 is available for $45,000.", (FULL, "acknowledgement_open")),
+    (None, (FULL, "acknowledgement_open")),
+])
+def test_mid_conversation_ok_depends_on_the_previous_reply(previous, expected):
+    assert route("ok", continuing=True, previous_response=previous) == expected
+
+
+@pytest.mark.parametrize("reply,expected", [
+    ("Thanks! The park manager will reach out to confirm.", True),
+    ("Take care!", True),
+    ("Would you like to schedule a showing? Have a great day", False),
+    ("The lot rent is $450.", False),
+    ("", False),
+])
+def test_is_closing(reply, expected):
+    assert is_closing(reply) is expected
+
+
+def test_estimate_cost_uses_the_base_model_price_for_snapshots():
+    usage = SimpleNamespace(prompt_tokens=1_000_000, completion_tokens=1_000_000)
+    assert estimate_cost("gpt-4o-mini-2024-07-18", usage) == pytest.approx(0.75)
+    assert estimate_cost("unknown-model", usage) is None
+    assert estimate_cost("gpt-4o-mini", None) is None
+
+
+@pytest.mark.parametrize("mode,applied", [("shadow", False), ("on", True)])
+def test_router_applies_fast_options_only_when_on(mode, applied):
+    router = ModelRouter(mode=mode, log_path=None)
+    turn = Turn("hi there", "asst_1")
+    assert router.route(turn) == FAST
+    assert turn.extras["route"]["applied"] is applied
+    assert ("tools" in turn.run_options) is applied
+
+
+def test_router_reads_the_last_reply_of_the_thread():
+    replies = {"thread_1": "Which time works for you?"}
+    router = ModelRouter(mode="on", log_path=None, last_reply=replies.get)
+    turn = Turn("ok", "asst_1", thread_id="thread_1")
+    assert router.route(turn) == FULL
+    assert turn.run_options == {}
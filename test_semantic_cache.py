@@ -0,0 +1,74 @@
+"""
+Casos de la caché semántica con un embedder fijo (sin llamar a OpenAI).
+python -m pytest test_semantic_cache.py
+"""
+import numpy as np
+import pytest
+
+from semantic_cache import SemanticCache
+
+
+class BagOfWordsEmbedder:
+    """Deterministic embedder: every query with the same words gets the same vector."""
+
+    name = "test"
+
+    def __init__(self):
+        self._vocabulary = {}
+
+    def embed(self, text):
+        vector = np.zeros(64, dtype=np.float32)
+        for word in text.split():
+            vector[self._vocabulary.setdefault(word, len(self._vocabulary) % 64)] += 1
+        return vector / np.linalg.norm(vector)
+
+
+@pytest.fixture
+def cache():
+    return SemanticCache(embedder=BagOfWordsEmbedder(), threshold=0.9, audit_log=None)
+
+
+def test_hit_for_same_question(cache):
+    cache.store("asst_1", "do you allow pets", "Yes, pets are allowed.")
+    assert cache.lookup("asst_1", "pets do you allow") == "Yes, pets are allowed."
+    assert cache.lookup("asst_2", "do you allow pets") is None
+
+
+@pytest.mark.parametrize("first,second", [
+    ("is the home on nogales lane available", "is the home on cactus lane available"),
+    ("how much is lot three", "how much is lot five"),
+    ("is this home still available", "is this house still available"),
+    ("price of the home at 335 nogales", "price of the home at 120 nogales"),
+    ("tell me about the one on sunset drive", "tell me about the one on mesa drive"),
+])
+def test_different_listings_never_share_an_entry(cache, first, second):
+    cache.store("asst_1", first, "Listing answer")
+    assert cache.lookup("asst_1", first) is None
+    assert cache.lookup("asst_1", second) is None
+    assert cache.stats()["entries"] == {}
+
+
+def test_lru_eviction_and_ttl():
+    cache = SemanticCache(embedder=BagOfWordsEmbedder(), threshold=0.9,
+                          max_entries=2, audit_log=None)
+    cache.store("asst_1", "do you allow pets", "pets")
+    cache.store("asst_1", "what is the lot rent", "rent")
+    cache.store("asst_1", "do you take section 8", "s8")
+    assert cache.lookup("asst_1", "do you allow pets") is None
+    assert cache.lookup("asst_1", "what is the lot rent") == "rent"
+    assert cache.lookup("asst_1", "do you take section 8") == "s8"
+    cache.ttl = -1
+    assert cache.lookup("asst_1", "do you take section 8") is None
+    assert cache.stats()["entries"] == {"asst_1": 0}
+
+
+def test_embedding_failure_is_a_miss():
+    class Failing:
+        name = "failing"
+
+        def embed(self, text):
+            raise TimeoutError()
+
+    cache = SemanticCache(embedder=Failing(), audit_log=None)
+    cache.store("asst_1", "do you allow pets", "pets")
+    assert cache.lookup("asst_1", "do you allow pets") is None
@@ -0,0 +1,179 @@
+"""
+Casos de la sincronización incremental con un cliente de OpenAI falso.
+No necesita servidor ni credenciales: python -m pytest test_sync_vector_store.py
+"""
+import itertools
+from types import SimpleNamespace
+
+import pytest
+
+from sync_vector_store import load_manifest, plan, scan, sync
+
+
+class NotFound(Exception):
+    status_code = 404
+
+
+class FakeOpenAI:
+    """Just the calls sync() makes, recording every file that is created or deleted."""
+
+    def __init__(self):
+        self._ids = itertools.count(1)
+        self.uploaded = {}  # file_id -> name
+        self.deleted = []
+        self.fail_upload = set()
+        self.fail_index = set()
+        self.fail_delete = set()
+        self.batch_error = None
+        self.files = SimpleNamespace(create=self._create, delete=self._delete_file)
+        self.vector_stores = SimpleNamespace(
+            files=SimpleNamespace(delete=self._delete_vs_file, list=self._list),
+            file_batches=SimpleNamespace(create_and_poll=self._create_batch,
+                                         list_files=self._list_batch_files),
+        )
+
+    def _create(self, file, purpose):
+        name, _ = file
+        if name in self.fail_upload:
+            raise ConnectionError(name)
+        file_id = f"file_{next(self._ids)}"
+        self.uploaded[file_id] = name
+        return SimpleNamespace(id=file_id)
+
+    def _create_batch(self, vector_store_id, file_ids):
+        if self.batch_error is not None:
+            raise self.batch_error
+        self.batch_failed = [f for f in file_ids if self.uploaded[f] in self.fail_index]
+        return SimpleNamespace(id="batch_1",
+                               file_counts=SimpleNamespace(failed=len(self.batch_failed)))
+
+    def _list_batch_files(self, batch_id, vector_store_id, filter):
+        return [SimpleNamespace(id=file_id) for file_id in self.batch_failed]
+
+    def _delete_vs_file(self, file_id, vector_store_id):
+        if file_id in self.fail_delete:
+            raise ConnectionError(file_id)
+
+    def _delete_file(self, file_id):
+        if file_id not in self.uploaded:
+            raise NotFound(file_id)
+        self.deleted.append(file_id)
+
+    def _list(self, vector_store_id, limit):
+        return [SimpleNamespace(id=file_id) for file_id in self.uploaded
+                if file_id not in self.deleted]
+
+
+@pytest.fixture
+def docs(tmp_path):
+    docs = tmp_path / "listings"
+    docs.mkdir()
+    (docs / "lot_1.md").write_text("Lot: Lot 1\nBedrooms: 2")
+    (docs / "lot_2.md").write_text("Lot: Lot 2\nBedrooms: 3")
+    (docs / ".DS_Store").write_text("x")
+    (docs / "photo.png").write_bytes(b"\x89PNG")
+    return docs
+
+
+@pytest.fixture
+def manifest_path(tmp_path):
+    return str(tmp_path / "manifest.json")
+
+
+def run(client, docs, manifest_path, **kwargs):
+    return sync(client, str(docs), "vs_1", manifest_path, concurrency=2, **kwargs)
+
+
+def test_plan_uploads_changes_and_deletes_superseded_versions():
+    documents = {"a.md": "h1", "b.md": "h2-new", "c.md": "h3"}
+    manifest = {
+        "a.md": {"sha256": "h1", "file_id": "file_a"},
+        "b.md": {"sha256": "h2", "file_id": "file_b"},
+        "gone.md": {"sha256": "h4", "file_id": "file_gone"},
+    }
+    assert plan(documents, manifest) == (["b.md", "c.md"], ["file_b", "file_gone"])
+
+
+def test_scan_skips_hidden_and_unsupported_files(docs):
+    assert sorted(scan(str(docs))) == ["lot_1.md", "lot_2.md"]
+
+
+def test_second_run_without_changes_does_not_call_openai(docs, manifest_path):
+    client = FakeOpenAI()
+    summary = run(client, docs, manifest_path)
+    assert sorted(summary["uploaded"]) == ["lot_1.md", "lot_2.md"]
+    assert summary["changed"]
+    summary = run(None, docs, manifest_path)
+    assert summary["unchanged"] == 2
+    assert not summary["changed"]
+
+
+def test_changed_file_replaces_the_old_version(docs, manifest_path):
+    client = FakeOpenAI()
+    run(client, docs, manifest_path)
+    old_id = load_manifest(manifest_path, "vs_1")[0]["lot_1.md"]["file_id"]
+    (docs / "lot_1.md").write_text("Lot: Lot 1\nBedrooms: 4")
+    (docs / "lot_2.md").unlink()
+    summary = run(client, docs, manifest_path)
+    files, pending = load_manifest(manifest_path, "vs_1")
+    assert summary["uploaded"] == ["lot_1.md"]
+    assert old_id in summary["deleted"] and len(summary["deleted"]) == 2
+    assert list(files) == ["lot_1.md"] and files["lot_1.md"]["file_id"] != old_id
+    assert pending == []
+
+
+@pytest.mark.parametrize("failure", ["fail_upload", "fail_index"])
+def test_failed_new_version_keeps_the_old_one(docs, manifest_path, failure):
+    client = FakeOpenAI()
+    run(client, docs, manifest_path)
+    old_id = load_manifest(manifest_path, "vs_1")[0]["lot_1.md"]["file_id"]
+    (docs / "lot_1.md").write_text("Lot: Lot 1\nBedrooms: 4")
+    getattr(client, failure).add("lot_1.md")
+    summary = run(client, docs, manifest_path)
+    assert summary["failed"] == ["lot_1.md"]
+    assert old_id not in client.deleted
+    assert load_manifest(manifest_path, "vs_1")[0]["lot_1.md"]["file_id"] == old_id
+    # La próxima corrida lo reintenta
+    getattr(client, failure).clear()
+    assert run(client, docs, manifest_path)["uploaded"] == ["lot_1.md"]
+
+
+def test_failed_delete_is_retried_on_the_next_run(docs, manifest_path):
+    client = FakeOpenAI()
+    run(client, docs, manifest_path)
+    old_id = load_manifest(manifest_path, "vs_1")[0]["lot_2.md"]["file_id"]
+    (docs / "lot_2.md").unlink()
+    client.fail_delete.add(old_id)
+    summary = run(client, docs, manifest_path)
+    assert summary["delete_failed"] == [old_id]
+    assert load_manifest(manifest_path, "vs_1")[1] == [old_id]
+    client.fail_delete.clear()
+    summary = run(client, docs, manifest_path)
+    assert summary["deleted"] == [old_id]
+    assert load_manifest(manifest_path, "vs_1")[1] == []
+
+
+def test_manifest_is_saved_when_the_run_is_interrupted(docs, manifest_path):
+    client = FakeOpenAI()
+    client.batch_error = KeyboardInterrupt()
+    with pytest.raises(KeyboardInterrupt):
+        run(client, docs, manifest_path)
+    files, pending = load_manifest(manifest_path, "vs_1")
+    # Lo subido sin llegar al manifiesto queda para borrar, no huérfano
+    assert files == {}
+    assert sorted(pending) == sorted(client.uploaded)
+    client.batch_error = None
+    summary = run(client, docs, manifest_path)
+    assert sorted(summary["uploaded"]) == ["lot_1.md", "lot_2.md"]
+    assert sorted(client.deleted) == sorted(pending)
+
+
+def test_dry_run_only_reports(docs, manifest_path):
+    summary = run(None, docs, manifest_path, dry_run=True)
+    assert summary["pending_upload"] == ["lot_1.md", "lot_2.md"]
+    assert load_manifest(manifest_path, "vs_1") == ({}, [])
+
+
+def test_manifest_of_another_vector_store_is_ignored(docs, manifest_path):
+    run(FakeOpenAI(), docs, manifest_path)
+    assert load_manifest(manifest_path, "vs_2") == ({}, [])
@@ -0,0 +1,264 @@
+"""
+Trazas OpenTelemetry del ciclo de vida de un run.
+
+Cubre el request de Flask, cada llamada al SDK de OpenAI (create_and_run,
+cada runs.retrieve, messages.list) y, para runs lentos, los pasos del run
+(runs.steps.list), que muestran cuánto tardó file_search frente a la generación.
+Los pasos se piden en un hilo en segundo plano, después de responder: la
+llamada extra nunca alarga el request que ya fue lento.
+
+OpenTelemetry es opcional: si TRACING_ENABLED no está activo o el paquete
+opentelemetry-sdk no está instalado, span() no hace nada.
+
+Exportación:
+- OTEL_EXPORTER_OTLP_ENDPOINT configurado (y opentelemetry-exporter-otlp
+  instalado): se envía a un collector.
+- Si no, se escriben las trazas como JSON por línea en TRACE_FILE.
+
+Muestreo por cola: los spans se guardan por traza hasta que termina el span
+raíz y solo se exportan las trazas más lentas que TRACE_SLOW_MS, más una
+fracción TRACE_SAMPLE_RATIO del resto.
+"""
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import metrics
+from local_state import ProcessExecutor
+
+try:
+    from opentelemetry.sdk.trace import SpanProcessor
+except ImportError:
+    # Sin OpenTelemetry instalado el procesador nunca se instancia
+    SpanProcessor = object
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").lower() == "true"
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", 20000))
+TRACE_SAMPLE_RATIO = float(os.getenv("TRACE_SAMPLE_RATIO", 0.01))
+# Spans sin raíz terminada después de esto se descartan (p. ej. pasos de un run
+# cuya decisión ya salió de _decided); debe superar el --timeout de gunicorn
+TRACE_PENDING_SECONDS = float(os.getenv("TRACE_PENDING_SECONDS", 300))
+SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "assistant-api")
+
+_tracer = None
+_steps_executor = ProcessExecutor(max_workers=1, thread_name_prefix="trace-steps")
+
+
+def enabled():
+    return _tracer is not None
+
+
+@contextmanager
+def span(name, **attributes):
+    """Start a child span of the current context (no-op when tracing is off)."""
+    if _tracer is None:
+        yield None
+        return
+    with _tracer.start_as_current_span(name) as current:
+        for key, value in attributes.items():
+            if value is not None:
+                current.set_attribute(key, value)
+        yield current
+
+
+def set_attribute(current, key, value):
+    """Set an attribute on a span returned by span(), ignoring None spans."""
+    if current is not None and value is not None:
+        current.set_attribute(key, value)
+
+
+def record_run_steps(client, thread_id, run_id, run_started_ns):
+    """
+    Add one span per run step (file_search, message creation) with the
+    timestamps reported by OpenAI. Costs one extra API call, so callers only
+    use it for slow runs.
+    """
+    if _tracer is None:
+        return
+    with span("openai.runs.steps.list", **{"openai.thread_id": thread_id,
+                                            "openai.run_id": run_id}):
+        steps = client.beta.threads.runs.steps.list(thread_id=thread_id, run_id=run_id)
+    for step in steps.data:
+        start = getattr(step, 'created_at', None)
+        end = getattr(step, 'completed_at', None) or getattr(step, 'failed_at', None)
+        if not start or not end:
+            continue
+        details = getattr(step, 'step_details', None)
+        step_type = getattr(details, 'type', None) or getattr(step, 'type', 'step')
+        tool_types = []
+        for call in getattr(details, 'tool_calls', None) or []:
+            tool_types.append(getattr(call, 'type', 'tool'))
+        step_span = _tracer.start_span(
+            f"openai.run_step.{step_type}",
+            start_time=max(int(start * 1e9), run_started_ns),
+        )
+        step_span.set_attribute("openai.step_id", step.id)
+        step_span.set_attribute("openai.step_status", getattr(step, 'status', ''))
+        if tool_types:
+            step_span.set_attribute("openai.tool_types", ",".join(tool_types))
+        step_span.end(end_time=int(end * 1e9))
+
+
+def record_run_steps_async(client, thread_id, run_id, run_started_ns):
+    """Schedule record_run_steps in the background, under the caller's span."""
+    if _tracer is None:
+        return None
+    from opentelemetry import context
+    return _steps_executor.submit(_record_run_steps_in, context.get_current(),
+                                  client, thread_id, run_id, run_started_ns)
+
+
+def _record_run_steps_in(parent, client, thread_id, run_id, run_started_ns):
+    from opentelemetry import context
+    token = context.attach(parent)
+    try:
+        record_run_steps(client, thread_id, run_id, run_started_ns)
+    except Exception:
+        metrics.incr("tracing.run_steps_failed")
+    finally:
+        context.detach(token)
+
+
+def setup_tracing(app):
+    """Configure the tracer provider and Flask request spans, if enabled."""
+    global _tracer
+    if not TRACING_ENABLED or _tracer is not None:
+        return False
+    try:
+        from opentelemetry import context, trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    except ImportError:
+        metrics.incr("tracing.unavailable")
+        return False
+
+    provider = TracerProvider(resource=Resource.create({"service.name": SERVICE_NAME}))
+    exporter = _build_exporter()
+    provider.add_span_processor(
+        _SlowTraceProcessor(BatchSpanProcessor(exporter), TRACE_SLOW_MS, TRACE_SAMPLE_RATIO)
+    )
+    trace.set_tracer_provider(provider)
+    _tracer = trace.get_tracer("assistant-api")
+
+    from flask import g, request
+
+    @app.before_request
+    def _start_request_span():
+        current = _tracer.start_span(
+            f"{request.method} {request.url_rule.rule if request.url_rule else request.path}",
+            kind=trace.SpanKind.SERVER,
+        )
+        current.set_attribute("http.method", request.method)
+        current.set_attribute("http.target", request.path)
+        g._trace_span = current
+        g._trace_token = context.attach(trace.set_span_in_context(current))
+
+    @app.after_request
+    def _tag_status(response):
+        current = g.get('_trace_span')
+        if current is not None:
+            current.set_attribute("http.status_code", response.status_code)
+        return response
+
+    @app.teardown_request
+    def _end_request_span(exc):
+        current = g.pop('_trace_span', None)
+        token = g.pop('_trace_token', None)
+        if current is not None:
+            if exc is not None:
+                current.record_exception(exc)
+            current.end()
+        if token is not None:
+            context.detach(token)
+
+    return True
+
+
+def _build_exporter():
+    if os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT"):
+        try:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+            return OTLPSpanExporter()
+        except ImportError:
+            metrics.incr("tracing.otlp_unavailable")
+    from opentelemetry.sdk.trace.export import ConsoleSpanExporter
+    out = open(TRACE_FILE, "a", encoding="utf-8")
+    return ConsoleSpanExporter(out=out, formatter=lambda s: s.to_json(indent=None) + "\n")
+
+
+class _SlowTraceProcessor(SpanProcessor):
+    """
+    Tail sampler: buffers the spans of each trace until its root span ends,
+    then forwards the whole trace only if it was slow (or randomly sampled).
+    Spans that end after their root (run steps recorded in the background)
+    follow the decision already taken for their trace; if that decision was
+    already forgotten, they wait in the buffer and are dropped after
+    pending_seconds like any trace whose root never ends.
+    """
+
+    # Decisiones recordadas para spans tardíos
+    MAX_DECIDED = 1024
+
+    def __init__(self, delegate, slow_ms, sample_ratio,
+                 pending_seconds=TRACE_PENDING_SECONDS, clock=time.monotonic):
+        self._delegate = delegate
+        self._slow_ns = slow_ms * 1e6
+        self._sample_ratio = sample_ratio
+        self._pending_seconds = pending_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        # trace_id -> (primer span en el buffer, [spans]), en orden de llegada
+        self._pending = OrderedDict()
+        self._decided = OrderedDict()  # trace_id -> exported
+
+    def on_start(self, span, parent_context=None):
+        pass
+
+    def on_end(self, span):
+        trace_id = span.context.trace_id
+        with self._lock:
+            self._expire_pending()
+            exported = self._decided.get(trace_id)
+            if exported is None:
+                spans = self._pending.setdefault(trace_id, (self._clock(), []))[1]
+                spans.append(span)
+                if span.parent is not None:
+                    return
+                del self._pending[trace_id]
+        if exported is not None:
+            if exported:
+                self._delegate.on_end(span)
+            return
+        duration = span.end_time - span.start_time
+        exported = duration >= self._slow_ns or random.random() < self._sample_ratio
+        with self._lock:
+            self._decided[trace_id] = exported
+            while len(self._decided) > self.MAX_DECIDED:
+                self._decided.popitem(last=False)
+        if exported:
+            metrics.incr("tracing.exported")
+            for buffered in spans:
+                self._delegate.on_end(buffered)
+        else:
+            metrics.incr("tracing.dropped")
+
+    def _expire_pending(self):
+        # _pending está en orden de llegada: basta mirar el principio
+        oldest = self._clock() - self._pending_seconds
+        while self._pending:
+            trace_id, (buffered_at, spans) = next(iter(self._pending.items()))
+            if buffered_at > oldest:
+                break
+            del self._pending[trace_id]
+            metrics.incr("tracing.expired", len(spans))
+
+    def shutdown(self):
+        self._delegate.shutdown()
+
+    def force_flush(self, timeout_millis=30000):
+        return self._delegate.force_flush(timeout_millis)
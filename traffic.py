@@ -0,0 +1,109 @@
+"""
+Grabación de tráfico real para benchmarks reproducibles.
+
+Con TRAFFIC_RECORD_PATH configurado, cada request a /chat y /chat/continue se
+agrega como una línea JSON con:
+- el momento de llegada, la ruta, el mensaje y la respuesta (anonimizados),
+- el status, la latencia total y los tiempos de cada etapa upstream
+  (submit, wait, extract),
+- ids de thread y lead reemplazados por un hash estable, para poder
+  reconstruir qué /chat/continue sigue a qué /chat.
+
+Anonimización: teléfonos y emails se reemplazan por valores de ejemplo con la
+misma forma (así el tráfico reproducido sigue el mismo camino que el real).
+Los post_id y los assistant_id se conservan: identifican listings y parques,
+no personas. Los nombres propios dentro del texto no se detectan.
+
+replay_traffic.py reproduce el archivo contra cualquier build.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+
+import metrics
+
+TRAFFIC_RECORD_PATH = os.getenv("TRAFFIC_RECORD_PATH")
+# Sal del hash de ids; cambiarla impide cruzar grabaciones con los ids reales
+TRAFFIC_SALT = os.getenv("TRAFFIC_SALT", "assistant-traffic")
+
+_EMAIL = re.compile(r'[\w.+-]+@[\w-]+\.[\w.]+')
+# 10 u 11 dígitos con separadores opcionales, sin tocar post_ids (\d+_\d+)
+_PHONE = re.compile(r'(?<![\d_])(?:\+?1[\s.-]?)?\(?\d{3}\)?[\s.-]?\d{3}[\s.-]?\d{4}(?![\d_])')
+
+PHONE_PLACEHOLDER = "555-010-0000"
+EMAIL_PLACEHOLDER = "lead@example.com"
+
+
+def anonymize_text(text):
+    """Replace phone numbers and emails with same-shaped placeholders."""
+    if not text:
+        return text
+    text = _EMAIL.sub(EMAIL_PLACEHOLDER, text)
+    return _PHONE.sub(PHONE_PLACEHOLDER, text)
+
+
+def anonymize_id(value, salt=None):
+    """Stable pseudonym for a thread or lead id."""
+    if not value:
+        return value
+    digest = hashlib.sha256(f"{salt or TRAFFIC_SALT}:{value}".encode("utf-8")).hexdigest()
+    return f"anon_{digest[:16]}"
+
+
+class TrafficRecorder:
+    """Appends anonymized request/response pairs to a JSONL file."""
+
+    def __init__(self, path=TRAFFIC_RECORD_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+        self._pid = None
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def record(self, arrival, path, data, body, status_code, latency_ms, turn=None):
+        """Write one request; never raises into the request path."""
+        if not self.path:
+            return
+        data = data or {}
+        body = body or {}
+        timings = turn.timings if turn is not None else {}
+        entry = {
+            "ts": round(arrival, 6),
+            "path": path,
+            "assistant_id": data.get("assistant_id"),
+            "thread": anonymize_id(data.get("thread_id")),
+            "lead": anonymize_id(data.get("lead_id")),
+            "priority": data.get("priority"),
+            "message": anonymize_text(data.get("message")),
+            "status": status_code,
+            "result_thread": anonymize_id(body.get("thread_id")),
+            "response": anonymize_text(body.get("response") or body.get("error")),
+            "source": turn.source if turn is not None else None,
+            "latency_ms": round(latency_ms, 2),
+            "upstream_ms": {stage: round(timings[stage] * 1000, 2)
+                            for stage in ("submit", "wait", "extract") if stage in timings},
+        }
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        try:
+            with self._lock:
+                # Un archivo abierto por proceso: los workers escriben líneas completas con O_APPEND
+                if self._file is None or self._pid != os.getpid():
+                    self._file = open(self.path, "a", encoding="utf-8", buffering=1)
+                    self._pid = os.getpid()
+                self._file.write(line)
+            metrics.incr("traffic.recorded")
+        except OSError:
+            metrics.incr("traffic.record_failed")
+
+
+def load(path):
+    """Read a recording, sorted by arrival time."""
+    with open(path, encoding="utf-8") as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+    entries.sort(key=lambda e: e["ts"])
+    return entries
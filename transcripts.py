@@ -0,0 +1,176 @@
+"""
+Almacén local de transcripciones de conversación.
+
+Cada turno (mensaje, query normalizado, respuesta limpia, run id, tiempos y
+uso de tokens) se escribe en un SQLite en modo WAL, append-only. Las escrituras
+se encolan y las hace un hilo en segundo plano, fuera del camino crítico del
+request. La lectura por thread_id o lead_id usa índices y tarda milisegundos.
+
+También guarda los mensajes de turnos respondidos sin run (fotos, modo
+degradado) que no se pudieron agregar al thread de OpenAI, para agregarlos
+antes del próximo run de ese thread.
+"""
+import json
+import os
+import queue
+import sqlite3
+import time
+
+import metrics
+from local_state import ProcessThread, SQLiteConnections
+
+TRANSCRIPT_DB = os.getenv("TRANSCRIPT_DB", "transcripts.db")
+QUEUE_SIZE = int(os.getenv("TRANSCRIPT_QUEUE_SIZE", 10000))
+BATCH_SIZE = 100
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS turns ("
+    " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+    " created_at REAL NOT NULL,"
+    " thread_id TEXT,"
+    " lead_id TEXT,"
+    " assistant_id TEXT,"
+    " run_id TEXT,"
+    " user_message TEXT,"
+    " normalized_query TEXT,"
+    " response TEXT,"
+    " source TEXT,"
+    " timings TEXT,"
+    " usage TEXT)",
+    "CREATE INDEX IF NOT EXISTS idx_turns_thread ON turns (thread_id, id)",
+    "CREATE INDEX IF NOT EXISTS idx_turns_lead ON turns (lead_id, id)",
+    # Mensajes respondidos sin run que todavía no están en el thread de OpenAI
+    "CREATE TABLE IF NOT EXISTS unsynced_messages ("
+    " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+    " created_at REAL NOT NULL,"
+    " thread_id TEXT NOT NULL,"
+    " role TEXT NOT NULL,"
+    " content TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS idx_unsynced_thread ON unsynced_messages (thread_id, id)",
+)
+
+_COLUMNS = ("created_at", "thread_id", "lead_id", "assistant_id", "run_id",
+            "user_message", "normalized_query", "response", "source",
+            "timings", "usage")
+
+
+class TranscriptStore:
+    """Append-only turn log with an async writer thread."""
+
+    def __init__(self, path=TRANSCRIPT_DB, queue_size=QUEUE_SIZE):
+        self.path = path
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._connections = SQLiteConnections(path, _SCHEMA, pragmas=("synchronous=NORMAL",),
+                                              row_factory=sqlite3.Row)
+        self._writer = ProcessThread(self._write_loop, "transcript-writer")
+
+    def _conn(self):
+        return self._connections.get()
+
+    def append(self, record):
+        """Queue a turn record; never blocks the request."""
+        self._writer.ensure_started()
+        record.setdefault("created_at", time.time())
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            metrics.incr("transcripts.dropped")
+
+    def _write_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+                metrics.incr("transcripts.written", len(batch))
+            except Exception:
+                metrics.incr("transcripts.write_failed", len(batch))
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, batch):
+        rows = []
+        for record in batch:
+            row = []
+            for column in _COLUMNS:
+                value = record.get(column)
+                if column in ("timings", "usage") and value is not None:
+                    value = json.dumps(value)
+                row.append(value)
+            rows.append(row)
+        conn = self._conn()
+        with conn:
+            conn.executemany(
+                f"INSERT INTO turns ({', '.join(_COLUMNS)}) "
+                f"VALUES ({', '.join('?' for _ in _COLUMNS)})",
+                rows
+            )
+
+    def flush(self, timeout=5):
+        """Wait until queued records are written (used in tests and shutdown)."""
+        end = time.time() + timeout
+        while self._queue.unfinished_tasks and time.time() < end:
+            time.sleep(0.01)
+
+    def add_unsynced(self, thread_id, messages):
+        """Remember [(role, content)] that still have to be added to an OpenAI thread."""
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.executemany(
+                "INSERT INTO unsynced_messages (created_at, thread_id, role, content) "
+                "VALUES (?, ?, ?, ?)",
+                [(now, thread_id, role, content) for role, content in messages]
+            )
+        metrics.incr("transcripts.unsynced", len(messages))
+
+    def take_unsynced(self, thread_id):
+        """Remove and return a thread's pending [(role, content)], oldest first."""
+        conn = self._conn()
+        with conn:
+            rows = conn.execute(
+                "DELETE FROM unsynced_messages WHERE thread_id = ? "
+                "RETURNING id, role, content", (thread_id,)
+            ).fetchall()
+        return [(row["role"], row["content"]) for row in sorted(rows, key=lambda r: r["id"])]
+
+    def history(self, thread_id=None, lead_id=None, limit=None):
+        """Return the turns of a thread or a lead, oldest first."""
+        return list(self.iter_history(thread_id=thread_id, lead_id=lead_id, limit=limit))
+
+    def last_turn(self, lead_id):
+        """Return the most recent turn of a lead, or None."""
+        row = self._conn().execute(
+            "SELECT * FROM turns WHERE lead_id = ? ORDER BY id DESC LIMIT 1", (lead_id,)
+        ).fetchone()
+        return dict(row) if row is not None else None
+
+    def iter_history(self, thread_id=None, lead_id=None, limit=None):
+        """
+        Yield turn dicts for a thread or lead, oldest first, without loading
+        them all at once. With limit, only the most recent turns are yielded.
+        """
+        if thread_id is not None:
+            where, value = "thread_id = ?", thread_id
+        elif lead_id is not None:
+            where, value = "lead_id = ?", lead_id
+        else:
+            raise ValueError("Se requiere thread_id o lead_id")
+        sql = f"SELECT * FROM turns WHERE {where} ORDER BY id"
+        params = [value]
+        if limit is not None:
+            # Los N turnos más recientes, devueltos en orden cronológico
+            sql = (f"SELECT * FROM (SELECT * FROM turns WHERE {where} "
+                   f"ORDER BY id DESC LIMIT ?) ORDER BY id")
+            params.append(int(limit))
+        for row in self._conn().execute(sql, params):
+            turn = dict(row)
+            for column in ("timings", "usage"):
+                if turn[column]:
+                    turn[column] = json.loads(turn[column])
+            yield turn
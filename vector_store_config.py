@@ -0,0 +1,11 @@
+"""
+Ubicación de los documentos de listings y vector store por defecto.
+
+Lo comparten la app, el banco de respuestas y sync_vector_store.py; vive
+aparte para que la app no importe el script de sincronización (y su
+load_dotenv) solo por dos constantes.
+"""
+import os
+
+LISTINGS_DIR = os.getenv("LISTINGS_DIR", "listings")
+VECTOR_STORE_ID = os.getenv("VECTOR_STORE_ID", "vs_68f948333dbc8191a4c1c0e12f86c77e")